@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Autores: Jesús López Ansón (839922), Javier Sin Pelayo (843442)
+# Funcionamiento: mide la velocidad (MB/s), la memoria máxima (RSS) y la tasa de compresión de huf.py en cada uno de
+#                 sus modos, comprimiendo y descomprimiendo por separado un corpus sintético reproducible, y las compara
+#                 con las de zlib. Los resultados se muestran en una tabla y se guardan en JSON para poder comparar
+#                 ejecuciones y detectar regresiones.
+
+# MODO DE USO
+# python benchmark.py [--semilla N] [--tam N] [--tam-grande N] [--repeticiones N] [--modos M1,M2,...]
+#                     [--corpus C1,C2,...] [--json RUTA] [--conservar DIR]
+#   - El corpus se genera en un directorio temporal (o en --conservar DIR, que no se borra al terminar)
+#   - Cada compresión y descompresión se ejecuta en un proceso nuevo, del que se obtiene su memoria máxima
+#   - python benchmark.py --medir ORDEN... lo usa el propio script para medir cada orden en un proceso aparte
+#   - De las repeticiones se toma el menor tiempo y la mayor memoria
+
+import os, sys, time, random, bisect, struct, zlib, shutil, tempfile, subprocess, platform, resource
+from optparse import OptionParser
+
+# El JSON se escribe con a_json de huf.py, que no depende del módulo json (disponible a partir de python2.6)
+from huf import a_json
+
+HUF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'huf.py')
+
+TAM_BUFFER = 1 << 20 # Bytes que procesa zlib en cada paso, como huf.py
+
+# Modos de huf.py que se miden, con sus opciones de compresión; zlib se añade siempre como referencia
+MODOS = [
+    ('original', []),
+    ('canonico', ['--canonico']),
+    ('bloques', ['-j', '1']),
+    ('entrelazado', ['--entrelazado']),
+    ('adaptativo', ['--adaptativo']),
+    ('lz', ['--nivel', '6']),
+    ('contextos', ['--contextos', '16']),
+]
+REFERENCIA = 'zlib'
+
+# Opciones de descompresión de los modos que las necesitan: los bloques y los flujos entrelazados se descomprimen con
+# varios procesos, de modo que la ganancia del formato entrelazado se vea también en ficheros de un solo bloque
+PROCESOS_DESCOMPRESION = 4
+OPCIONES_DESCOMPRESION = {
+    'bloques': ['-j', str(PROCESOS_DESCOMPRESION)],
+    'entrelazado': ['-j', str(PROCESOS_DESCOMPRESION)],
+}
+
+# Vocabulario del texto sintético: las palabras se eligen con una distribución de Zipf
+PALABRAS = ('de la que el en y a los se del las un por con no una su para es al lo como más pero sus le ya o este '
+            'porque esta entre cuando muy sin sobre también me hasta hay donde quien desde todo nos durante todos uno '
+            'les ni contra otros ese eso ante ellos esto antes algunos qué unos yo otro otras otra él tanto esa estos '
+            'mucho quienes nada muchos cual poco ella estar estas algunas algo nosotros caballero escudero molino '
+            'venta camino aventura señora hidalgo lanza rocín armas libro historia pueblo noche tierra').split()
+
+""" Texto en castellano sintético: frases de palabras del vocabulario elegidas con una distribución de Zipf. """
+def generar_texto(aleatorio, tam):
+    acumulados = []
+    total = 0.0
+    for rango in range(len(PALABRAS)):
+        total += 1.0 / (rango + 1)
+        acumulados.append(total)
+
+    partes = []
+    longitud = 0
+    while longitud < tam:
+        n_palabras = aleatorio.randint(4, 20)
+        frase = [PALABRAS[bisect.bisect(acumulados, aleatorio.random() * total)] for i in range(n_palabras)]
+        frase = ' '.join(frase)
+        frase = frase[0].upper() + frase[1:] + aleatorio.choice(['. ', '. ', ', ', '.\n'])
+        partes.append(frase)
+        longitud += len(frase)
+    return ''.join(partes)[:tam]
+
+""" Datos binarios estructurados: registros de tamaño fijo con una marca de tiempo creciente, un identificador de un
+    conjunto pequeño, un contador y una medida en coma flotante, como los de un registro de sensores. """
+def generar_binario(aleatorio, tam):
+    registros = []
+    instante = 1700000000
+    for i in range(tam // 24 + 1):
+        instante += aleatorio.randint(0, 3)
+        registros.append(struct.pack('<IHHqd', instante, aleatorio.randint(1, 12), 0xCAFE, i,
+                                     20.0 + aleatorio.gauss(0, 2)))
+    return ''.join(registros)[:tam]
+
+""" Bytes con una distribución geométrica muy sesgada: unos pocos valores ocupan casi todo el archivo. """
+def generar_sesgado(aleatorio, tam):
+    acumulados = []
+    total = 0.0
+    for valor in range(256):
+        total += 0.5 ** (valor / 2.0)
+        acumulados.append(total)
+    return ''.join([chr(bisect.bisect(acumulados, aleatorio.random() * total)) for i in range(tam)])
+
+""" Bytes uniformemente distribuidos, que no se pueden comprimir. """
+def generar_uniforme(aleatorio, tam):
+    if tam == 0:
+        return ''
+    return ('%0*x' % (2 * tam, aleatorio.getrandbits(8 * tam))).decode('hex')
+
+""" Genera el corpus en el directorio indicado y devuelve la lista de (nombre, ruta) en orden. Con la misma semilla y
+    los mismos tamaños, los archivos son siempre los mismos. """
+def generar_corpus(directorio, semilla, tam, tam_grande, nombres=None):
+    generadores = [
+        ('texto', generar_texto, tam),
+        ('binario', generar_binario, tam),
+        ('sesgado', generar_sesgado, tam),
+        ('uniforme', generar_uniforme, tam),
+        ('diminuto', generar_texto, 100),
+        ('grande', generar_texto, tam_grande),
+    ]
+    corpus = []
+    for n, (nombre, generador, tam_archivo) in enumerate(generadores):
+        if nombres is not None and nombre not in nombres:
+            continue
+        ruta = os.path.join(directorio, nombre)
+        archivo = open(ruta, 'wb')
+        archivo.write(generador(random.Random(semilla * 100 + n), tam_archivo))
+        archivo.close()
+        corpus.append((nombre, ruta))
+    return corpus
+
+""" Ejecuta la orden como único proceso hijo de este y escribe en la salida estándar su estado de salida, el tiempo
+    transcurrido en segundos y su memoria máxima (RSS) en KiB. Al no haber otros hijos, getrusage(RUSAGE_CHILDREN) da
+    la memoria de esta orden (y de los procesos que lance), sin la de ejecuciones anteriores; os.wait4, que la daría
+    directamente, no existe en python2.4. """
+def medir_orden(orden):
+    nulo = open(os.devnull, 'wb')
+    inicio = time.time()
+    estado = subprocess.call(orden, stdout=nulo)
+    segundos = time.time() - inicio
+    nulo.close()
+    sys.stdout.write("%d %r %d\n" % (estado, segundos, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+""" Ejecuta la orden en un proceso nuevo y devuelve el tiempo transcurrido en segundos y su memoria máxima (RSS) en
+    KiB. La medida la toma este mismo script en un proceso intermedio (ver medir_orden). """
+def medir(orden):
+    proceso = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--medir'] + orden, stdout=subprocess.PIPE)
+    salida = proceso.communicate()[0]
+    if proceso.returncode != 0:
+        raise RuntimeError("No se ha podido medir la orden %s" % ' '.join(orden))
+    estado, segundos, memoria = salida.split()
+    if int(estado) != 0:
+        raise RuntimeError("La orden %s ha terminado con el estado %s" % (' '.join(orden), estado))
+    return float(segundos), int(memoria)
+
+""" Mide la orden repeticiones veces y devuelve el menor tiempo y la mayor memoria. """
+def medir_repeticiones(orden, repeticiones):
+    tiempos = []
+    memorias = []
+    for i in range(repeticiones):
+        segundos, memoria = medir(orden)
+        tiempos.append(segundos)
+        memorias.append(memoria)
+    return min(tiempos), max(memorias)
+
+""" Órdenes de compresión y descompresión de un modo. huf.py comprime x en x.huf y descomprime x.huf en x, de modo
+    que el archivo comprimido se renombra antes de descomprimirlo; zlib se ejecuta con este mismo script para que
+    también se mida en un proceso nuevo. """
+def ordenes(modo, opciones, original, comprimido, descomprimido):
+    if modo == REFERENCIA:
+        script = os.path.abspath(__file__)
+        return ([sys.executable, script, '--zlib', '-c', original, comprimido],
+                [sys.executable, script, '--zlib', '-d', comprimido, descomprimido])
+    return ([sys.executable, HUF, '-c'] + opciones + [original],
+            [sys.executable, HUF, '-d'] + OPCIONES_DESCOMPRESION.get(modo, []) + [comprimido])
+
+""" Compara el contenido de dos archivos. """
+def iguales(ruta_a, ruta_b):
+    archivo_a = open(ruta_a, 'rb')
+    archivo_b = open(ruta_b, 'rb')
+    try:
+        while True:
+            bloque_a = archivo_a.read(TAM_BUFFER)
+            if bloque_a != archivo_b.read(TAM_BUFFER):
+                return False
+            if not bloque_a:
+                return True
+    finally:
+        archivo_a.close()
+        archivo_b.close()
+
+""" Mide un modo sobre un archivo del corpus y devuelve el diccionario con sus resultados. """
+def medir_modo(modo, opciones, nombre, ruta, directorio, repeticiones):
+    original = os.path.join(directorio, nombre)
+    shutil.copyfile(ruta, original)
+    descomprimido = original + '.descomprimido'
+    comprimido = descomprimido + '.huf'
+    orden_c, orden_d = ordenes(modo, opciones, original, comprimido, descomprimido)
+
+    segundos_c, memoria_c = medir_repeticiones(orden_c, repeticiones)
+    if modo != REFERENCIA:
+        os.rename(original + '.huf', comprimido)
+    segundos_d, memoria_d = medir_repeticiones(orden_d, repeticiones)
+
+    tam = os.path.getsize(original)
+    tam_comprimido = os.path.getsize(comprimido)
+    resultado = {
+        'archivo': nombre,
+        'modo': modo,
+        'tamano': tam,
+        'tamano_comprimido': tam_comprimido,
+        'ratio': tam and float(tam_comprimido) / tam,
+        'correcto': iguales(original, descomprimido),
+        'compresion': fase(tam, segundos_c, memoria_c),
+        'descompresion': fase(tam, segundos_d, memoria_d),
+    }
+    for ruta_temporal in (original, comprimido, descomprimido):
+        os.remove(ruta_temporal)
+    return resultado
+
+""" Resultados de una fase: tiempo, velocidad en MB/s (de datos originales) y memoria máxima en KiB. """
+def fase(tam, segundos, memoria):
+    return {'segundos': round(segundos, 4), 'mb_s': round(tam / 1e6 / segundos, 3), 'rss_max_kb': memoria}
+
+""" JSON del informe con las claves ordenadas y un resultado por línea al final, para que dos ejecuciones se puedan 
+    comparar con diff. """
+def informe_json(informe, resultados):
+    cabecera = a_json(informe)
+    return cabecera[:-1] + ', "resultados": [\n' + ',\n'.join([a_json(resultado) for resultado in resultados]) + '\n]}\n'
+
+""" Compresión y descompresión con zlib (nivel por defecto) por bloques, para usarla como referencia. """
+def zlib_archivo(modo, ruta_entrada, ruta_salida):
+    entrada = open(ruta_entrada, 'rb')
+    salida = open(ruta_salida, 'wb')
+    if modo == '-c':
+        flujo = zlib.compressobj()
+        procesar = flujo.compress
+    else:
+        flujo = zlib.decompressobj()
+        procesar = flujo.decompress
+    bloque = entrada.read(TAM_BUFFER)
+    while bloque:
+        salida.write(procesar(bloque))
+        bloque = entrada.read(TAM_BUFFER)
+    salida.write(flujo.flush())
+    entrada.close()
+    salida.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == '--zlib':
+        zlib_archivo(sys.argv[2], sys.argv[3], sys.argv[4])
+        sys.exit()
+    if len(sys.argv) > 2 and sys.argv[1] == '--medir':
+        medir_orden(sys.argv[2:])
+        sys.exit()
+
+    uso = "python benchmark.py [--semilla N] [--tam N] [--tam-grande N] [--repeticiones N] [--modos M1,M2,...] [--corpus C1,C2,...] [--json RUTA] [--conservar DIR]"
+    parser = OptionParser(usage=uso)
+    parser.add_option('--semilla', type='int', dest='semilla', default=1, metavar='N',
+                      help='semilla del generador del corpus (por defecto 1)')
+    parser.add_option('--tam', type='int', dest='tam', default=1 << 20, metavar='N',
+                      help='tamaño en bytes de los archivos del corpus (por defecto 1 MiB)')
+    parser.add_option('--tam-grande', type='int', dest='tam_grande', default=16 << 20, metavar='N',
+                      help='tamaño en bytes del archivo grande (por defecto 16 MiB)')
+    parser.add_option('--repeticiones', type='int', dest='repeticiones', default=3, metavar='N',
+                      help='veces que se mide cada operación, de las que se toma la mejor (por defecto 3)')
+    parser.add_option('--modos', dest='modos', default=None, metavar='M1,M2,...',
+                      help='modos que se miden, entre %s (por defecto todos)' %
+                           ', '.join([modo for modo, _ in MODOS] + [REFERENCIA]))
+    parser.add_option('--corpus', dest='corpus', default=None, metavar='C1,C2,...',
+                      help='archivos del corpus que se usan, entre texto, binario, sesgado, uniforme, diminuto y '
+                           'grande (por defecto todos)')
+    parser.add_option('--json', dest='json', default='benchmark.json', metavar='RUTA',
+                      help='archivo en el que se guardan los resultados (por defecto benchmark.json)')
+    parser.add_option('--conservar', dest='conservar', default=None, metavar='DIR',
+                      help='genera el corpus en DIR y no lo borra al terminar')
+    opciones, argumentos = parser.parse_args()
+
+    modos = MODOS + [(REFERENCIA, [])]
+    if opciones.modos is not None:
+        elegidos = opciones.modos.split(',')
+        modos = [(modo, opciones_modo) for modo, opciones_modo in modos if modo in elegidos]
+    nombres = None
+    if opciones.corpus is not None:
+        nombres = opciones.corpus.split(',')
+
+    if argumentos or opciones.tam < 0 or opciones.tam_grande < 0 or opciones.repeticiones <= 0 or not modos:
+        print("Uso: " + uso)
+        sys.exit()
+
+    directorio = opciones.conservar
+    if directorio is None:
+        directorio = tempfile.mkdtemp(prefix='huf_benchmark_')
+    elif not os.path.isdir(directorio):
+        os.makedirs(directorio)
+    trabajo = tempfile.mkdtemp(prefix='huf_benchmark_trabajo_')
+
+    try:
+        corpus = generar_corpus(directorio, opciones.semilla, opciones.tam, opciones.tam_grande, nombres)
+        resultados = []
+        print("%-10s %-12s %10s %7s %10s %10s %10s %10s %s" % ('archivo', 'modo', 'tamaño', 'ratio', 'comp MB/s',
+                                                              'comp KiB', 'desc MB/s', 'desc KiB', ''))
+        for nombre, ruta in corpus:
+            for modo, opciones_modo in modos:
+                resultado = medir_modo(modo, opciones_modo, nombre, ruta, trabajo, opciones.repeticiones)
+                resultados.append(resultado)
+                estado = 'OK'
+                if not resultado['correcto']: estado = 'ERROR'
+                print("%-10s %-12s %10d %7.3f %10.2f %10d %10.2f %10d %s" % (
+                    nombre, modo, resultado['tamano'], resultado['ratio'],
+                    resultado['compresion']['mb_s'], resultado['compresion']['rss_max_kb'],
+                    resultado['descompresion']['mb_s'], resultado['descompresion']['rss_max_kb'], estado))
+    finally:
+        shutil.rmtree(trabajo)
+        if opciones.conservar is None:
+            shutil.rmtree(directorio)
+
+    informe = {
+        'semilla': opciones.semilla,
+        'tam': opciones.tam,
+        'tam_grande': opciones.tam_grande,
+        'repeticiones': opciones.repeticiones,
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+    }
+    archivo_json = open(opciones.json, 'w')
+    archivo_json.write(informe_json(informe, resultados))
+    archivo_json.close()
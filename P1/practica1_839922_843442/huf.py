@@ -2,7 +2,112 @@
 #coding=utf-8
 
 from heapq import heapify, heappop, heappush
-import os, sys, struct
+from array import array
+from optparse import OptionParser
+from cStringIO import StringIO
+import os, sys, struct, mmap, zlib, math, time, socket, SocketServer, tempfile
+
+# resource (solo en sistemas Unix) es opcional: sin él las estadísticas no incluyen la memoria máxima
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# NumPy es opcional: si está disponible se usa para codificar de forma vectorizada
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# multiprocessing (disponible a partir de python2.6) es opcional: sin él los bloques se procesan de uno en uno
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Número de bits que se consultan de una vez en las tablas de decodificación
+BITS_TABLA = 12
+
+# Los formatos versionados empiezan por MAGICO seguido de un byte de versión. En el formato original los primeros 
+# bytes son la longitud del árbol serializado, por lo que su primer byte es siempre 0 y no se pueden confundir.
+MAGICO = 'HUF'
+VERSION_CANONICA = 1 # Cabecera con las longitudes de los códigos canónicos en lugar del árbol
+VERSION_BLOQUES = 2  # Contenedor de bloques codificados de forma independiente, con un directorio de posiciones
+VERSION_ADAPTATIVA = 3 # Segmentos codificados en una sola pasada con un modelo que se actualiza sobre la marcha
+VERSION_DICCIONARIO = 4 # Contenido codificado con la tabla de un diccionario entrenado, identificado por su CRC-32
+VERSION_ARCHIVO = 5  # Contenedor de varios archivos (miembros) comprimidos por bloques, con un índice de miembros
+VERSION_ALMACENADA = 6 # Archivo que no se puede comprimir, guardado tal cual a continuación de la cabecera
+VERSION_VERIFICADA = 7 # CRC-32 y longitud de los datos originales, seguidos del archivo comprimido en otro formato
+
+# Longitud de la cabecera de VERSION_VERIFICADA: MAGICO, la versión, el CRC-32 (4 bytes) y la longitud (8 bytes)
+LONGITUD_VERIFICADA = len(MAGICO) + 1 + 4 + 8
+
+# Los archivos de diccionario empiezan por este identificador, seguido de las longitudes de los códigos canónicos
+MAGICO_DICCIONARIO = 'HUFD'
+
+# Tamaño por defecto (en bytes) de los bloques en los que se leen los archivos al comprimir y descomprimir
+TAM_BUFFER = 1 << 20
+
+# Modo adaptativo: tamaño del primer segmento y máximo al que se duplica, y suma de frecuencias a partir de la cual se 
+# dividen entre dos
+SEGMENTO_MIN = 1 << 10
+SEGMENTO_MAX = 1 << 17
+LIMITE_MODELO = 1 << 18
+
+# Bit de la longitud del cuerpo de un bloque (o segmento) que indica que sus datos se guardan sin comprimir, y entropía 
+# (en bits por byte) a partir de la cual un bloque se guarda así sin intentar codificarlo
+BLOQUE_ALMACENADO = 1 << 31
+ENTROPIA_ALMACENADO = 7.9
+
+# Bit de la longitud del cuerpo de un bloque que indica que se codifica con la tabla de un bloque anterior
+BLOQUE_REPETIDO = 1 << 30
+
+# Bit de la longitud del cuerpo de un bloque que indica que se ha comprimido con LZ77 antes de aplicar Huffman, y 
+# máscara con todos los bits de marca
+BLOQUE_LZ = 1 << 29
+BLOQUE_CONTEXTO = 1 << 28 # Bloque codificado con tablas elegidas según el byte anterior
+BLOQUE_ENTRELAZADO = 1 << 27 # Bloque codificado en varios flujos intercalados (se combina con BLOQUE_REPETIDO)
+MARCAS_BLOQUE = BLOQUE_ALMACENADO | BLOQUE_REPETIDO | BLOQUE_LZ | BLOQUE_CONTEXTO | BLOQUE_ENTRELAZADO
+
+# Las marcas ocupan los bits altos de la longitud del cuerpo, por lo que el cuerpo de un bloque debe ocupar menos de 
+# LONGITUD_CUERPO_MAX bytes. El tamaño de bloque (-b) de los formatos por bloques se limita a TAM_BLOQUE_MAX, con margen 
+# para los bloques cuyo cuerpo ocupa algo más que sus datos
+LONGITUD_CUERPO_MAX = BLOQUE_ENTRELAZADO
+TAM_BLOQUE_MAX = 1 << 26
+
+# Número de flujos en los que se reparten los bytes de un bloque entrelazado
+FLUJOS_ENTRELAZADOS = 4
+
+# LZ77: longitud mínima y máxima de una coincidencia, ventana por defecto y, para cada nivel de 1 a 9, el número máximo 
+# de candidatos que se prueban en cada posición, la longitud a partir de la cual se deja de buscar una mejor y si se 
+# insertan en las cadenas las posiciones del interior de las coincidencias
+LZ_MIN = 4
+LZ_MAX = 1 << 16
+VENTANA_LZ = 1 << 15
+MUESTRA_LZ = 1 << 16 # Bytes en los que se buscan coincidencias antes de descartar LZ77 en un bloque de alta entropía
+
+# Modelo de orden 1: número de tablas por defecto entre las que se agrupan los contextos, máximo, e iteraciones del 
+# agrupamiento
+TABLAS_CONTEXTO = 16
+TABLAS_CONTEXTO_MAX = 64
+ITERACIONES_CONTEXTO = 6
+NIVELES_LZ = [None, (4, 16, False), (8, 32, False), (16, 64, False), (16, 64, True), (32, 128, True),
+              (64, 256, True), (128, 512, True), (256, 1024, True), (1024, LZ_MAX, True)]
+
+# Servicio de compresión (--servidor): cada petición es un byte de operación (PETICION_COMPRIMIR o 
+# PETICION_DESCOMPRIMIR), la longitud de los datos en 4 bytes y los datos; cada respuesta, un byte de estado 
+# (RESPUESTA_CORRECTA o RESPUESTA_ERROR), la longitud en 4 bytes y los datos resultantes o el mensaje de error
+PETICION_COMPRIMIR = 'c'
+PETICION_DESCOMPRIMIR = 'd'
+RESPUESTA_CORRECTA = '0'
+RESPUESTA_ERROR = 'E'
+MINIMO_POOL = 1 << 18 # Tamaño a partir del cual una petición se atiende en el pool de procesos y no en su hilo
+PETICION_MAX = 1 << 26 # Tamaño máximo de los datos de una petición, que se reciben enteros en memoria
+TABLAS_CACHE = 256    # Número máximo de decodificadores que el servicio guarda en la caché
+
+# Tipo de array cuyos elementos son palabras de 32 bits sin signo, donde se vuelca el buffer de bits al comprimir
+if array('I').itemsize == 4: TIPO_PALABRA = 'I'
+else:                        TIPO_PALABRA = 'L'
 
 """
 Funciones auxiliares de conversión de tipos
@@ -23,6 +128,14 @@ def int_to_1byte(int_value):
 def bytes1_to_int(bytes):
     return struct.unpack('>B', bytes)[0]
 
+# Convierte un entero a su forma de 8 bytes
+def int_to_8bytes(int_value):
+    return struct.pack('>Q', int_value)
+
+# Convierte 8 bytes a su forma de entero
+def bytes8_to_int(bytes):
+    return struct.unpack('>Q', bytes)[0]
+
 # Convierte un byte a su forma de cadena con todos los 8 bits, incluyendo los ceros iniciales
 # byte_to_str(ord(a)) = "01100001"
 def byte_to_str(byte):
@@ -35,12 +148,224 @@ def byte_to_str(byte):
 def str_to_char(s):
     return chr(int(s, 2))
 
+# Recorre el archivo en bloques de tam_buffer bytes a partir de la posición inicio. Si usar_mmap es True, el archivo 
+# se proyecta en memoria y cada bloque es una vista (buffer) sobre la proyección, de manera que los datos se leen 
+# directamente de la caché de páginas del sistema operativo, sin la copia de read. Quien los recibe debe aceptar 
+# vistas: si las convierte a cadena (str), el bloque se copia igualmente.
+def leer_bloques(ruta_archivo, tam_buffer, usar_mmap=False, inicio=0):
+    archivo = open(ruta_archivo, 'rb')
+    if usar_mmap:
+        mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        for pos in xrange(inicio, len(mapa), tam_buffer):
+            yield buffer(mapa, pos, tam_buffer)
+        mapa.close()
+    else:
+        archivo.seek(inicio)
+        bloque = archivo.read(tam_buffer)
+        while bloque:
+            yield bloque
+            bloque = archivo.read(tam_buffer)
+    archivo.close()
+
+# Convierte un entero a su forma de cadena con el número de bits indicado, incluyendo los ceros iniciales
+# int_to_bits(5, 4) = "0101"
+def int_to_bits(valor, longitud):
+    return ''.join([str((valor >> i) & 1) for i in range(longitud - 1, -1, -1)])
+
 # Convierte una cadena a su representación binaria.
 # Ejemplo: "abc" -> "011000010110001001100011"
 def string_to_binary(s):
     return ''.join(''.join(str((ord(c) >> i) & 1) for i in range(7, -1, -1)) for c in s)
     
 
+"""
+Estadísticas de ejecución. Con la opción --stats, o si la variable de entorno HUF_STATS tiene valor, cada compresión y 
+descompresión emite una línea JSON con el tiempo de cada una de sus fases, los bytes de entrada y de salida y la 
+memoria máxima del proceso (y de sus procesos hijos). Las líneas se escriben en la salida de errores, o al final del 
+archivo indicado en HUF_STATS si su valor no es 1 ni -.
+"""
+
+""" Convierte a JSON un valor formado por diccionarios, listas, cadenas, números, booleanos y None. Los diccionarios 
+    pueden ser también listas de pares (clave, valor), para conservar su orden. """
+def a_json(valor):
+    if isinstance(valor, dict):
+        valor = valor.items()
+        valor.sort()
+        return a_json_pares(valor)
+    if isinstance(valor, (list, tuple)):
+        return '[' + ', '.join([a_json(elemento) for elemento in valor]) + ']'
+    if valor is None:
+        return 'null'
+    if valor is True or valor is False:
+        return str(valor).lower()
+    if isinstance(valor, (int, long, float)):
+        return repr(valor)
+    # Cadena: se escapan las comillas, las barras y los caracteres de control; el resto se copia tal cual
+    caracteres = []
+    for caracter in str(valor):
+        if caracter in '"\\':
+            caracteres.append('\\' + caracter)
+        elif caracter < ' ':
+            caracteres.append('\\u%04x' % ord(caracter))
+        else:
+            caracteres.append(caracter)
+    return '"' + ''.join(caracteres) + '"'
+
+# Objeto JSON a partir de una lista de pares (clave, valor)
+def a_json_pares(pares):
+    return '{' + ', '.join([a_json(clave) + ': ' + a_json(valor) for clave, valor in pares]) + '}'
+
+""" Tiempos de las fases de la operación en curso. Si no están activas, sumar solo devuelve la hora actual, de modo que 
+    medir las fases no cuesta más que consultar el reloj una vez por fase y bloque. """
+class Estadisticas:
+    def __init__(self):
+        self.destino = None # Archivo en el que se escriben las líneas, o None si las estadísticas no están activas
+        self.iniciar(None, None)
+
+    """ Activa las estadísticas, que se escribirán en el archivo abierto destino. """
+    def activar(self, destino):
+        self.destino = destino
+
+    """ Empieza a medir una nueva operación sobre el archivo indicado. """
+    def iniciar(self, operacion, ruta_archivo):
+        self.operacion = operacion
+        self.ruta_archivo = ruta_archivo
+        self.fases = [] # Nombres de las fases, en el orden en que aparecen
+        self.tiempos = {} # Segundos de cada fase
+        self.inicio = time.time()
+
+    """ Suma a la fase el tiempo transcurrido desde inicio y devuelve la hora actual, que sirve de inicio de la fase 
+        siguiente. """
+    def sumar(self, fase, inicio):
+        ahora = time.time()
+        if self.destino is not None:
+            if fase not in self.tiempos:
+                self.fases.append(fase)
+                self.tiempos[fase] = 0.0
+            self.tiempos[fase] += ahora - inicio
+        return ahora
+
+    """ Llama a la función con los argumentos indicados, suma su tiempo a la fase y devuelve su resultado. """
+    def medir(self, fase, funcion, *argumentos):
+        inicio = time.time()
+        resultado = funcion(*argumentos)
+        self.sumar(fase, inicio)
+        return resultado
+
+    """ Emite la línea de la operación en curso con los bytes de entrada y de salida indicados. """
+    def emitir(self, bytes_entrada, bytes_salida):
+        if self.destino is None:
+            return
+        linea = [('operacion', self.operacion), ('archivo', self.ruta_archivo),
+                 ('fases', [(fase, round(self.tiempos[fase], 6)) for fase in self.fases]),
+                 ('segundos', round(time.time() - self.inicio, 6)),
+                 ('bytes_entrada', bytes_entrada), ('bytes_salida', bytes_salida)]
+        if resource is not None:
+            # En Linux ru_maxrss está en KiB
+            linea.append(('memoria_max_kb', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+            linea.append(('memoria_max_hijos_kb', resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+        self.destino.write(a_json_pares(linea) + '\n')
+        self.destino.flush()
+
+# Estadísticas de la operación en curso, compartidas por todo el programa
+estadisticas = Estadisticas()
+
+""" Activa las estadísticas si la variable de entorno HUF_STATS tiene valor, o si forzar es True (opción --stats). """
+def configurar_estadisticas(forzar=False):
+    valor = os.environ.get('HUF_STATS', '')
+    if valor in ('', '0') and not forzar:
+        return
+    if valor in ('', '0', '1', '-'):
+        estadisticas.activar(sys.stderr)
+    else:
+        estadisticas.activar(open(valor, 'a'))
+
+
+"""
+Funciones auxiliares de la cabecera canónica. Un código de Huffman canónico queda determinado únicamente por la
+longitud del código de cada byte: los códigos se asignan en orden creciente de longitud y, a igual longitud, en
+orden creciente de byte, sumando 1 al código anterior y desplazándolo a la izquierda cada vez que aumenta la longitud.
+Por ello basta con guardar las longitudes en la cabecera, y ambos lados pueden construir los códigos sin el árbol.
+"""
+# Devuelve la longitud del código de cada byte de una tabla de códigos ('0101')
+def longitudes_codigos(tabla_codigos):
+    longitudes = {}
+    for byte, codigo in tabla_codigos.items():
+        longitudes[byte] = len(codigo)
+    return longitudes
+
+# Genera la tabla de códigos canónicos ('0101') a partir de la longitud del código de cada byte
+def codigos_canonicos(longitudes):
+    orden = [(longitud, byte) for byte, longitud in longitudes.items()]
+    orden.sort()
+
+    codigos = {}
+    codigo = 0
+    longitud_anterior = orden[0][0]
+    for longitud, byte in orden:
+        codigo <<= longitud - longitud_anterior
+        codigos[byte] = int_to_bits(codigo, longitud)
+        codigo += 1
+        longitud_anterior = longitud
+    return codigos
+
+# Serializa las longitudes de los códigos en una cadena de unos y ceros, recorriendo los bytes en orden canónico:
+#  - Un primer bit a '1' si hay un único byte y a '0' en otro caso.
+#  - Para cada byte, el aumento de longitud respecto al byte anterior en unario (un '1' por cada bit de aumento, 
+#    terminado en '0'), seguido de los 8 bits del byte.
+# No hace falta guardar el número de bytes: el último es aquel con el que los códigos leídos completan el árbol.
+def serializar_longitudes(longitudes):
+    orden = [(longitud, byte) for byte, longitud in longitudes.items()]
+    orden.sort()
+
+    bits = ['0']
+    if len(orden) == 1: bits = ['1']
+    longitud_anterior = 0
+    for longitud, byte in orden:
+        bits.append('1' * (longitud - longitud_anterior) + '0' + byte_to_str(ord(byte)))
+        longitud_anterior = longitud
+    return ''.join(bits)
+
+# Lee del archivo las longitudes serializadas por serializar_longitudes, byte a byte según se necesitan, de manera 
+# que el archivo queda posicionado justo después de ellas.
+def leer_longitudes(archivo):
+    bits = byte_to_str(bytes1_to_int(archivo.read(1)))
+    unico = bits[0] == '1'
+    pos = 1
+
+    longitudes = {}
+    longitud = 0
+    ocupados = 0 # Hojas del nivel 'longitud' ocupadas por los códigos leídos; el árbol está completo con 2^longitud
+    while True:
+        # Aumento de longitud en unario
+        while True:
+            if pos == len(bits): bits += byte_to_str(bytes1_to_int(archivo.read(1)))
+            pos += 1
+            if bits[pos - 1] == '0': break
+            longitud += 1
+            ocupados <<= 1
+
+        if len(bits) - pos < 8: bits += byte_to_str(bytes1_to_int(archivo.read(1)))
+        longitudes[str_to_char(bits[pos:pos + 8])] = longitud
+        pos += 8
+
+        ocupados += 1
+        if unico or ocupados == 1 << longitud:
+            return longitudes
+
+# Lee del archivo la longitud de los datos originales (8 bytes) con la que terminan las cabeceras de los códigos 
+# canónicos y del diccionario
+def leer_longitud_original(archivo):
+    bytes = archivo.read(8)
+    if len(bytes) < 8:
+        raise ValueError("El archivo comprimido está truncado")
+    return bytes8_to_int(bytes)
+
+# Convierte una cadena de unos y ceros en bytes, completando con ceros el último byte
+def bits_to_bytes(bits):
+    if len(bits) % 8: bits += '0' * (8 - len(bits) % 8)
+    return ''.join([str_to_char(bits[i:i + 8]) for i in range(0, len(bits), 8)])
+
 """
     Esta clase representa un nodo en el árbol de Huffman. 
     Cada nodo dispone de: 
@@ -64,34 +389,127 @@ class NodoHuffman:
         else:
             return 0
 
+"""
+Histograma de bytes. Las frecuencias se cuentan por fragmentos con una primitiva vectorizada (numpy.bincount si NumPy 
+está disponible o, si no, str.count para cada byte presente en el fragmento) y los histogramas de los fragmentos se 
+suman, opcionalmente repartiendo rangos del archivo entre un pool de procesos. Junto a las cuentas se guarda la 
+posición de la primera aparición de cada byte: el diccionario de frecuencias se rellena en ese orden, el mismo en el que 
+se insertarían los bytes recorriendo el archivo uno a uno, para que se recorra igual y el árbol construido no cambie.
+"""
+
+""" 
+    Histograma de un fragmento que empieza en la posición inicio del archivo: la lista de las 256 cuentas y un 
+    diccionario con la posición de la primera aparición de cada byte presente que no esté en conocidos (los bytes cuya 
+    primera aparición ya se encontró en un fragmento anterior). Con NumPy, las cuentas se obtienen sobre el propio 
+    fragmento, aunque sea una vista de --mmap, y solo se copia a una cadena si hay que buscar algún byte nuevo. 
+"""
+def histograma_bloque(bloque, inicio=0, conocidos=()):
+    if numpy is not None:
+        cuentas = numpy.bincount(numpy.frombuffer(bloque, dtype=numpy.uint8), minlength=256).tolist()
+    else:
+        bloque = str(bloque)
+        cuentas = [0] * 256
+        for byte in set(bloque):
+            cuentas[ord(byte)] = bloque.count(byte)
+
+    primeras = {}
+    nuevos = [valor for valor in range(256) if cuentas[valor] and valor not in conocidos]
+    if nuevos:
+        bloque = str(bloque)
+        for valor in nuevos:
+            primeras[valor] = inicio + bloque.find(chr(valor))
+    return cuentas, primeras
+
+""" Suma una lista de histogramas, quedándose con la primera aparición más temprana de cada byte. """
+def sumar_histogramas(histogramas):
+    cuentas = [0] * 256
+    primeras = {}
+    for cuentas_parcial, primeras_parcial in histogramas:
+        for valor in range(256):
+            cuentas[valor] += cuentas_parcial[valor]
+        for valor, posicion in primeras_parcial.items():
+            if valor not in primeras or posicion < primeras[valor]:
+                primeras[valor] = posicion
+    return cuentas, primeras
+
+""" Diccionario de frecuencias {byte: frecuencia} de un histograma, con los bytes en orden de primera aparición. """
+def frecuencias_histograma(cuentas, primeras):
+    orden = [(posicion, valor) for valor, posicion in primeras.items()]
+    orden.sort()
+    frecuencias = {}
+    for posicion, valor in orden:
+        frecuencias[chr(valor)] = cuentas[valor]
+    return frecuencias
+
+""" Histograma del rango [inicio, inicio + longitud) del archivo, leído en fragmentos de tam_buffer bytes. Recibe sus 
+    argumentos en una tupla para poder repartirlos entre los procesos del pool. """
+def histograma_rango(tarea):
+    ruta_archivo, inicio, longitud, tam_buffer = tarea
+    histograma = ([0] * 256, {})
+    archivo = open(ruta_archivo, 'rb')
+    try:
+        archivo.seek(inicio)
+        posicion = inicio
+        while posicion < inicio + longitud:
+            bloque = archivo.read(min(tam_buffer, inicio + longitud - posicion))
+            if not bloque:
+                break
+            histograma = sumar_histogramas([histograma, histograma_bloque(bloque, posicion, histograma[1])])
+            posicion += len(bloque)
+    finally:
+        archivo.close()
+    return histograma
+
+""" Histograma del archivo completo. Con varios trabajos el archivo se divide en cuatro rangos por proceso (de al menos 
+    tam_buffer bytes) que se cuentan en paralelo; si no, se recorre en este proceso con leer_bloques. """
+def histograma_archivo(ruta_archivo, tam_buffer=TAM_BUFFER, trabajos=1, usar_mmap=False):
+    pool = crear_pool(trabajos)
+    if pool is None:
+        histograma = ([0] * 256, {})
+        posicion = 0
+        for bloque in leer_bloques(ruta_archivo, tam_buffer, usar_mmap):
+            histograma = sumar_histogramas([histograma, histograma_bloque(bloque, posicion, histograma[1])])
+            posicion += len(bloque)
+        return histograma
+
+    tam_archivo = os.path.getsize(ruta_archivo)
+    longitud = max(tam_buffer, -(-tam_archivo // (4 * trabajos)))
+    tareas = [(ruta_archivo, inicio, longitud, tam_buffer) for inicio in range(0, tam_archivo, longitud)]
+    try:
+        histogramas = pool.map(histograma_rango, tareas)
+    finally:
+        pool.close()
+        pool.join()
+    return sumar_histogramas(histogramas)
+
 """ Clase encargada de realizar la compresión utilizando el algoritmo de Huffman. Incrusta una cabecera
     al archivo comprimido, para posibilitar la posterior descompresión."""
 class CompresorHuffman:
-    def __init__(self, ruta_archivo):
+    def __init__(self, ruta_archivo, tam_buffer=TAM_BUFFER, canonico=False, usar_mmap=False, trabajos=1, diccionario=None):
         self.ruta_archivo = ruta_archivo  # Ruta del archivo de entrada
+        self.tam_buffer = tam_buffer      # Número de bytes que se leen del archivo de entrada en cada paso
+        self.canonico = canonico          # Si es True, se usan códigos canónicos y la cabecera versionada
+        self.usar_mmap = usar_mmap        # Si es True, el archivo de entrada se lee proyectándolo en memoria
+        self.trabajos = trabajos          # Número de procesos con los que se cuentan las frecuencias
+        self.diccionario = diccionario    # DiccionarioHuffman cuya tabla se usa en lugar de una propia, o None
 
-    # Cuenta la frecuencia de cada byte en el archivo.
+    # Cuenta la frecuencia de cada byte en el archivo a partir de su histograma, leyéndolo en bloques de tam_buffer bytes.
     def contar_frecuencia(self):
-        frecuencia_bytes = {}
-        archivo = open(self.ruta_archivo, 'rb')
-        for linea in archivo:
-            for byte in linea:
-                if byte in frecuencia_bytes:
-                    frecuencia_bytes[byte] += 1
-                else:
-                    frecuencia_bytes[byte] = 1
-        archivo.close()
-
-        return frecuencia_bytes
+        cuentas, primeras = histograma_archivo(self.ruta_archivo, self.tam_buffer, self.trabajos, self.usar_mmap)
+        return frecuencias_histograma(cuentas, primeras)
 
     ''' 
     - Este método construye el árbol de Huffman a partir de las frecuencias de los bytes.
     - Utiliza una cola de prioridad para mantener los nodos ordenados por frecuencia.
     - Los nodos con menor frecuencia estarán a la mayor profundidad del árbol mientras que los nodos con mayor
         frecuencia estarán a menor profundidad, de manera que el byte más frecuente tendrá el código más corto.
+    - Si no se indican las frecuencias, se cuentan las del archivo de entrada.
     '''
-    def construir_arbol(self):
-        cola_prioridad = [NodoHuffman(byte, frecuencia) for byte, frecuencia in self.contar_frecuencia().items()]
+    def construir_arbol(self, frecuencias=None):
+        if frecuencias is None:
+            frecuencias = self.contar_frecuencia()
+        self.frecuencias = frecuencias
+        cola_prioridad = [NodoHuffman(byte, frecuencia) for byte, frecuencia in self.frecuencias.items()]
         heapify(cola_prioridad) # Convierte la lista en una cola de prioridad o montículo (heap)
 
         while len(cola_prioridad) > 1:
@@ -105,6 +523,74 @@ class CompresorHuffman:
 
         return cola_prioridad[0]
 
+    '''
+    - Este método calcula las longitudes óptimas de los códigos con la restricción de que ninguna supere long_max 
+      bits, mediante el algoritmo package-merge.
+    - Cada byte es una moneda de valor 2^-long_max y peso su frecuencia. En cada nivel, empezando por el más profundo, 
+      las monedas se agrupan por parejas (de menor a mayor peso) en paquetes que valen el doble, y los paquetes se 
+      mezclan con las monedas originales del nivel superior.
+    - Las 2n-2 monedas o paquetes de menor peso del último nivel forman la solución: la longitud del código de cada 
+      byte es el número de veces que aparece en ellos.
+    '''
+    @staticmethod
+    def longitudes_limitadas(frecuencias, long_max):
+        hojas = [(frecuencia, [byte]) for byte, frecuencia in frecuencias.items()]
+        hojas.sort()
+        if len(hojas) == 1:
+            return {hojas[0][1][0]: 1}
+        if len(hojas) > 1 << long_max:
+            raise ValueError("No caben %d códigos distintos en %d bits" % (len(hojas), long_max))
+
+        nivel = hojas
+        for i in range(long_max - 1):
+            paquetes = [(nivel[j][0] + nivel[j + 1][0], nivel[j][1] + nivel[j + 1][1]) for j in range(0, len(nivel) - 1, 2)]
+            nivel = hojas + paquetes
+            nivel.sort()
+
+        longitudes = {}
+        for _, bytes_paquete in nivel[:2 * len(hojas) - 2]:
+            for byte in bytes_paquete:
+                longitudes[byte] = longitudes.get(byte, 0) + 1
+        return longitudes
+
+    # Construye el árbol de Huffman correspondiente a una tabla de códigos, con las frecuencias de cada byte en sus hojas
+    @staticmethod
+    def arbol_desde_codigos(tabla_codigos, frecuencias):
+        raiz = NodoHuffman(frecuencia=0)
+        for byte, codigo in tabla_codigos.items():
+            nodo = raiz
+            nodo.frecuencia += frecuencias[byte]
+            for bit in codigo:
+                if bit == '0':
+                    if nodo.izquierda is None: nodo.izquierda = NodoHuffman(frecuencia=0)
+                    nodo = nodo.izquierda
+                else:
+                    if nodo.derecha is None: nodo.derecha = NodoHuffman(frecuencia=0)
+                    nodo = nodo.derecha
+                nodo.frecuencia += frecuencias[byte]
+            nodo.byte = byte
+        return raiz
+
+    '''
+        Limita a long_max bits la longitud de los códigos generados por el árbol de Huffman, para que las tablas del 
+        decodificador no crezcan con la profundidad del árbol. Si algún código supera el límite, se sustituyen por los 
+        códigos canónicos de longitud limitada óptima y, si informar es True, se informa del aumento de tamaño respecto 
+        al código sin límite (solo lo pide el programa principal). Devuelve el árbol y la tabla de códigos resultantes.
+    '''
+    def limitar_longitud(self, arbol_huffman, tabla_codigos, long_max, informar=False):
+        if max([len(codigo) for codigo in tabla_codigos.values()]) <= long_max:
+            return arbol_huffman, tabla_codigos
+
+        tabla_limitada = codigos_canonicos(self.longitudes_limitadas(self.frecuencias, long_max))
+        arbol_limitado = self.arbol_desde_codigos(tabla_limitada, self.frecuencias)
+
+        bits_optimos = self.contar_bits(arbol_huffman, tabla_codigos)
+        bits_limitados = self.contar_bits(arbol_limitado, tabla_limitada)
+        if informar: print("Códigos limitados a %d bits: el contenido comprimido ocupa un %.2f%% más" 
+              % (long_max, (bits_limitados - bits_optimos) * 100.0 / bits_optimos))
+
+        return arbol_limitado, tabla_limitada
+
     # Imprime el árbol de Huffman de izquierda a derecha
     @staticmethod
     def imprimir_arbol(raiz, nivel=0):
@@ -178,51 +664,200 @@ class CompresorHuffman:
         len_arbol_serializado_bytes = int_to_4bytes(len(arbol_serializado)) # Fijar la longitud a 4 bytes
         return len_arbol_serializado_bytes + arbol_serializado # Devolver el árbol con la cabecera incrustada al inicio
 
-    '''
-        Comprime el archivo de entrada utilizando los códigos generados por el árbol de Huffman.
-        Realiza los siguientes pasos:
-         - Abre el archivo original en modo lectura y el archivo comprimido en modo binario.
-         - Recorre el archivo original, reemplazando cada byte por su código binario correspondiente y escribiendo 
-           los bytes resultantes en el archivo comprimido.
-         - Si al final del archivo aún hay bits por escribir, se añade un byte adicional para completar el último byte 
-           y se agrega información sobre el relleno al final del archivo.
-    '''
-    def comprimir_archivo(self, ruta_archivo_comprimido, tabla_codigos, arbol_huffman):
-        archivo = open(self.ruta_archivo, 'r') # Lectura en modo texto
+    """ Genera la cabecera versionada de los códigos canónicos: el identificador del formato seguido de las longitudes 
+        de los códigos de la tabla y de la longitud de los datos originales (8 bytes). """
+    def generar_cabecera_canonica(self, tabla_codigos, longitud):
+        longitudes = longitudes_codigos(tabla_codigos)
+        return MAGICO + int_to_1byte(VERSION_CANONICA) + bits_to_bytes(serializar_longitudes(longitudes)) + \
+               int_to_8bytes(longitud)
 
-        bits_acumulados = ''
-        content = ''
-
-        # Recorrer el fichero original y escribir los bits comprimidos en el fichero comprimido
-        for linea in archivo:
-            for byte in linea:
-                bits_acumulados += tabla_codigos[byte] # Añadir el código binario correspondiente al byte
-
-                while len(bits_acumulados) >= 8:
-                    byte_to_write = bits_acumulados[:8]   # Tomar los primeros 8 bits
-                    content += str_to_char(byte_to_write) # Convertir los 8 bits a su forma de byte y añadir al contenido
-                    bits_acumulados = bits_acumulados[8:] # Eliminar los 8 bits que ya se han escrito
+    """ Convierte la tabla de códigos en forma de cadena ('0101') a pares enteros (valor, longitud). """
+    @staticmethod
+    def codigos_enteros(tabla_codigos):
+        tabla_enteros = {}
+        for byte, codigo in tabla_codigos.items():
+            tabla_enteros[byte] = (int(codigo, 2), len(codigo))
+        return tabla_enteros
+
+    """ Calcula el número total de bits del contenido comprimido: la suma, para cada hoja del árbol, de su 
+        frecuencia por la longitud de su código. """
+    @staticmethod
+    def contar_bits(raiz, tabla_codigos):
+        if raiz is None:
+            return 0
+        if raiz.byte is not None:
+            return raiz.frecuencia * len(tabla_codigos[raiz.byte])
+        return CompresorHuffman.contar_bits(raiz.izquierda, tabla_codigos) + CompresorHuffman.contar_bits(raiz.derecha, tabla_codigos)
 
-        # En caso de que queden bits por escribir, se añade un byte adicional para completar el último byte
-        padding = 0
-        if bits_acumulados:
-            padding = 8 - len(bits_acumulados)
-            bits_acumulados += '0' * padding
-            content += str_to_char(bits_acumulados) # Añadir el byte de padding
+    """ 
+        Codifica la cadena de bytes datos a continuación de los n_bits bits pendientes de buffer_bits:
+         - Reserva de antemano las palabras de 32 bits necesarias en el peor caso (todos los códigos de longitud máxima).
+         - Acumula el código (valor, longitud) de cada byte en un entero que actúa de buffer de bits, y vuelca 
+           en el array cada palabra de 32 bits completa (varias seguidas si el código tiene más de 32 bits), de 
+           manera que en el buffer nunca quedan 32 bits o más.
+        Devuelve los bytes completos y los bits que quedan pendientes (menos de 8), que se anteponen al siguiente 
+        fragmento o se completan con ceros si era el último.
+    """
+    @staticmethod
+    def codificar(datos, tabla_enteros, buffer_bits=0, n_bits=0):
+        long_max = max([longitud for _, longitud in tabla_enteros.values()])
+
+        # Palabras de 32 bits reservadas de antemano
+        palabras = array(TIPO_PALABRA, [0]) * ((n_bits + len(datos) * long_max) // 32 + 1)
+        i = 0
+
+        for byte in datos:
+            valor, longitud = tabla_enteros[byte]
+            buffer_bits = (buffer_bits << longitud) | valor
+            n_bits += longitud
+            while n_bits >= 32:
+                n_bits -= 32
+                palabras[i] = buffer_bits >> n_bits
+                buffer_bits &= (1 << n_bits) - 1
+                i += 1
+
+        # Las palabras se escriben en orden big-endian
+        del palabras[i:]
+        if sys.byteorder == 'little':
+            palabras.byteswap()
+        content = palabras.tostring()
+
+        # De los bits que quedan en el buffer se vuelcan los bytes completos, de uno en uno
+        bytes_finales = []
+        while n_bits >= 8:
+            n_bits -= 8
+            bytes_finales.append(chr(buffer_bits >> n_bits))
+            buffer_bits &= (1 << n_bits) - 1
+        content += ''.join(bytes_finales)
+
+        return content, buffer_bits, n_bits
 
-        archivo.close() # Cerrar el archivo original
+    """ 
+        Versión vectorizada de codificar, que requiere NumPy y códigos de 32 bits como máximo. En lugar de recorrer 
+        los bytes en Python:
+         - Traduce todo el buffer a valores y longitudes de código mediante arrays de búsqueda de 256 entradas, 
+           precedidos de los bits pendientes como si fueran un código más.
+         - Calcula con una suma acumulada el bit en el que empieza el código de cada byte.
+         - Coloca cada código en la ventana de 64 bits formada por la palabra de 32 bits en la que empieza y la 
+           siguiente. Como los códigos no se solapan, cada palabra del resultado es la suma de las partes de los 
+           códigos que caen en ella, y se obtiene de una vez con numpy.bincount.
+    """
+    @staticmethod
+    def codificar_numpy(datos, tabla_enteros, buffer_bits=0, n_bits=0):
+        valores = numpy.zeros(256, dtype=numpy.uint64)
+        longitudes = numpy.zeros(256, dtype=numpy.uint64)
+        for byte, (valor, longitud) in tabla_enteros.items():
+            valores[ord(byte)] = valor
+            longitudes[ord(byte)] = longitud
+
+        bytes_entrada = numpy.frombuffer(datos, dtype=numpy.uint8)
+        valores_codigo = numpy.concatenate(([buffer_bits], valores[bytes_entrada])).astype(numpy.uint64)
+        longitudes_codigo = numpy.concatenate(([n_bits], longitudes[bytes_entrada])).astype(numpy.uint64)
+        fines = numpy.cumsum(longitudes_codigo)
+        inicios = fines - longitudes_codigo # Bit en el que empieza cada código
+        total_bits = int(fines[-1])
+
+        palabra = (inicios >> numpy.uint64(5)).astype(numpy.int64)
+        desplazamiento = numpy.uint64(64) - (inicios & numpy.uint64(31)) - longitudes_codigo
+        ventana = valores_codigo << desplazamiento
+        alta = (ventana >> numpy.uint64(32)).astype(numpy.float64)
+        baja = (ventana & numpy.uint64(0xFFFFFFFF)).astype(numpy.float64)
+
+        n_palabras = total_bits // 32 + 2
+        palabras = numpy.bincount(palabra, alta, n_palabras) + numpy.bincount(palabra + 1, baja, n_palabras)
+        content = palabras.astype('>u4').tostring()
+
+        # Los bits del último byte incompleto quedan pendientes
+        n_bytes = total_bits // 8
+        n_bits = total_bits % 8
+        buffer_bits = 0
+        if n_bits:
+            buffer_bits = ord(content[n_bytes]) >> (8 - n_bits)
+        return content[:n_bytes], buffer_bits, n_bits
+
+    # Devuelve la versión vectorizada de codificar si NumPy está disponible y los códigos lo permiten
+    @staticmethod
+    def elegir_codificador(tabla_enteros):
+        if numpy is not None and max([longitud for _, longitud in tabla_enteros.values()]) <= 32:
+            return CompresorHuffman.codificar_numpy
+        return CompresorHuffman.codificar
+
+    """ Tamaño que tendrá el archivo comprimido: cabecera (terminada en la longitud original o en el byte de relleno) 
+        y contenido. """
+    def tamano_comprimido(self, tabla_codigos, arbol_huffman):
+        if self.canonico:
+            cabecera = self.generar_cabecera_canonica(tabla_codigos, 0)
+        else:
+            cabecera = self.generar_cabecera(arbol_huffman) + int_to_1byte(0)
+        return len(cabecera) + (self.contar_bits(arbol_huffman, tabla_codigos) + 7) // 8
+
+    """ Guarda el archivo de entrada sin comprimir, a continuación de la cabecera de VERSION_ALMACENADA (y del 
+        prefijo indicado, como en comprimir_archivo). """
+    def almacenar_archivo(self, ruta_archivo_comprimido, prefijo='', verificador=None):
+        archivo_comprimido = open(ruta_archivo_comprimido, 'wb')
+        archivo_comprimido.write(prefijo + MAGICO + int_to_1byte(VERSION_ALMACENADA))
+        inicio = time.time()
+        for bloque in bloques_verificados(leer_bloques(self.ruta_archivo, self.tam_buffer, self.usar_mmap), verificador):
+            inicio = estadisticas.sumar('lectura', inicio)
+            archivo_comprimido.write(bloque)
+            inicio = estadisticas.sumar('escritura', inicio)
+        archivo_comprimido.close()
 
+    '''
+        Comprime el archivo de entrada utilizando la tabla de códigos indicada (la del árbol de Huffman o la del 
+        diccionario). Realiza los siguientes pasos, los tres últimos en escribir_comprimido:
+         - Si se indica un prefijo (la cabecera de VERSION_VERIFICADA), lo escribe antes que la cabecera propia del 
+           formato.
+         - Escribe la cabecera completa antes que el contenido. Con códigos canónicos o con un diccionario termina 
+           con la longitud de los datos originales (longitud, el tamaño del archivo de entrada); en el formato 
+           original, con el número de bits de relleno del último byte, que se calcula a partir de las frecuencias 
+           del árbol.
+         - Recorre el archivo original en bloques de tam_buffer bytes, codificándolos (de forma vectorizada si 
+           NumPy está disponible) y escribiendo los bytes completos en el archivo comprimido. Los bits que no 
+           llegan a completar un byte pasan al siguiente bloque. Si se indica un verificador, recibe los bloques 
+           leídos para calcular su suma.
+         - Si al final del archivo aún hay bits por escribir, se completa el último byte con ceros.
+        De esta forma la memoria utilizada no depende del tamaño del archivo.
+    '''
+    def comprimir_archivo(self, ruta_archivo_comprimido, tabla_codigos, arbol_huffman, longitud, prefijo='',
+                          verificador=None):
         archivo_comprimido = open(ruta_archivo_comprimido, 'wb') # Escritura en modo binario
-
-        # Generar la cabecera y escribirla en el archivo comprimido
-        archivo_comprimido.write(self.generar_cabecera(arbol_huffman))
-
-        # Escribir en 1 byte la cantidad de bits de relleno del último byte
-        archivo_comprimido.write(int_to_1byte(padding))
-        archivo_comprimido.write(content)
-
+        archivo_comprimido.write(prefijo)
+        bloques = bloques_verificados(leer_bloques(self.ruta_archivo, self.tam_buffer, self.usar_mmap), verificador)
+        self.escribir_comprimido(archivo_comprimido, bloques, tabla_codigos, arbol_huffman, longitud)
         archivo_comprimido.close() # Cerrar el archivo comprimido
 
+    """ Escribe en el objeto salida la cabecera y el contenido codificado de los bloques de datos indicados, que suman 
+        longitud bytes. """
+    def escribir_comprimido(self, archivo_comprimido, bloques, tabla_codigos, arbol_huffman, longitud):
+        inicio = time.time()
+        tabla_enteros = self.codigos_enteros(tabla_codigos)
+        codificar = self.elegir_codificador(tabla_enteros)
+
+        # Generar la cabecera y escribirla en el archivo comprimido. Las versionadas terminan con la longitud de los 
+        # datos originales, y la del formato original con la cantidad de bits de relleno del último byte (1 byte)
+        if self.diccionario is not None:
+            archivo_comprimido.write(self.diccionario.generar_cabecera(longitud))
+        elif self.canonico:
+            archivo_comprimido.write(self.generar_cabecera_canonica(tabla_codigos, longitud))
+        else:
+            total_bits = self.contar_bits(arbol_huffman, tabla_codigos)
+            archivo_comprimido.write(self.generar_cabecera(arbol_huffman) + int_to_1byte((8 - total_bits % 8) % 8))
+        inicio = estadisticas.sumar('cabecera', inicio)
+
+        buffer_bits = 0
+        n_bits = 0
+        for bloque in bloques:
+            inicio = estadisticas.sumar('lectura', inicio)
+            content, buffer_bits, n_bits = codificar(bloque, tabla_enteros, buffer_bits, n_bits)
+            inicio = estadisticas.sumar('codificacion', inicio)
+            archivo_comprimido.write(content)
+            inicio = estadisticas.sumar('escritura', inicio)
+
+        # Añadir el byte de padding con los últimos bits
+        if n_bits:
+            archivo_comprimido.write(int_to_1byte(buffer_bits << (8 - n_bits)))
+
 """ 
 Imprime la información del árbol de Huffman, incluyendo:
  - Si "show_tree" es True, imprime el árbol de Huffman
@@ -265,26 +900,231 @@ def info_arbol_huffman(arbol_huffman, show_tree=False):
     print("Profundidad máxima: " + str(profundidad[0]))
 
 
-""" Crea una instancia del CompresorHuffman, construye el árbol, genera los códigos y comprime el archivo. """
-def comprimir_archivo_huffman(ruta_archivo, ruta_archivo_comprimido):
+""" Crea una instancia del CompresorHuffman, construye el árbol, genera los códigos y comprime el archivo. 
+     - Si long_max no es None, ningún código supera los long_max bits. Si además informar es True y el límite afecta a 
+       algún código, se muestra cuánto aumenta el tamaño del contenido comprimido.
+     - Si canonico es True, los códigos del árbol se sustituyen por los canónicos de la misma longitud.
+     - Si trabajos no es None, se utiliza el formato por bloques de tam_buffer bytes, comprimidos en paralelo por 
+       ese número de procesos.
+     - Si intervalo no es None, se utiliza el formato por bloques con un índice de acceso aleatorio con un punto de 
+       control cada intervalo bytes.
+     - Si usar_mmap es True, el archivo se lee proyectándolo en memoria.
+     - Si entrelazado es True, se utiliza el formato por bloques y cada bloque se codifica en flujos intercalados.
+     - Si crc es True, el archivo comprimido empieza por la cabecera de VERSION_VERIFICADA, con el CRC-32 y la 
+       longitud de los datos originales. Se calculan en la misma pasada en la que se leen los datos para escribirlos 
+       y la cabecera se completa al terminar, sin leer el archivo una vez más.
+    El tiempo de cada fase se suma a las estadísticas, que se emiten al terminar si están activas. """
+def comprimir_archivo_huffman(ruta_archivo, ruta_archivo_comprimido, tam_buffer=TAM_BUFFER, canonico=False, long_max=None,
+                              trabajos=None, intervalo=None, usar_mmap=False, procesos_histograma=1, adaptativo=False,
+                              diccionario=None, nivel=None, ventana=VENTANA_LZ, tablas_contexto=None,
+                              entrelazado=False, crc=False, informar=False):
+    estadisticas.iniciar('comprimir', ruta_archivo)
+    tam_archivo = os.path.getsize(ruta_archivo)
+
+    # La cabecera de VERSION_VERIFICADA se reserva ahora y se completa con la suma del verificador al terminar
+    prefijo = ''
+    verificador = None
+    if crc and tam_archivo:
+        prefijo = cabecera_verificada(0, 0)
+        verificador = VerificadorSalida()
+
     # Si el archivo está vacío, crear uno vacío con la extensión .huf
-    if os.stat(ruta_archivo).st_size == 0:
+    if tam_archivo == 0:
         open(ruta_archivo_comprimido, 'w').close()
-        return
 
-    compresor = CompresorHuffman(ruta_archivo)
-    arbol_huffman = compresor.construir_arbol()
-    tabla_codigos = compresor.generar_codigos(arbol_huffman)
-    compresor.comprimir_archivo(ruta_archivo_comprimido, tabla_codigos, arbol_huffman)
+    elif adaptativo:
+        archivo = open(ruta_archivo, 'rb')
+        archivo_comprimido = open(ruta_archivo_comprimido, 'wb')
+        archivo_comprimido.write(prefijo)
+        estadisticas.medir('adaptativo', comprimir_adaptativo, archivo, archivo_comprimido, verificador)
+        archivo.close()
+        archivo_comprimido.close()
+
+    elif trabajos is not None or intervalo is not None or nivel is not None or tablas_contexto is not None or \
+         entrelazado:
+        if trabajos is None: trabajos = 1
+        compresor = CompresorBloques(ruta_archivo, tam_buffer, long_max, trabajos, intervalo, nivel, ventana,
+                                     tablas_contexto, entrelazado)
+        compresor.comprimir_archivo(ruta_archivo_comprimido, prefijo, verificador)
+
+    # Con un diccionario no hace falta contar las frecuencias ni construir el árbol
+    elif diccionario is not None:
+        compresor = CompresorHuffman(ruta_archivo, tam_buffer, usar_mmap=usar_mmap, diccionario=diccionario)
+        compresor.comprimir_archivo(ruta_archivo_comprimido, diccionario.tabla_char_codigo, None, tam_archivo, prefijo,
+                                    verificador)
+
+    else:
+        compresor = CompresorHuffman(ruta_archivo, tam_buffer, canonico, usar_mmap, procesos_histograma)
+        frecuencias = estadisticas.medir('contar_frecuencia', compresor.contar_frecuencia)
+        arbol_huffman = estadisticas.medir('construir_arbol', compresor.construir_arbol, frecuencias)
+        tabla_codigos = estadisticas.medir('generar_codigos', compresor.generar_codigos, arbol_huffman)
+        if long_max is not None:
+            arbol_huffman, tabla_codigos = estadisticas.medir('limitar_longitud', compresor.limitar_longitud,
+                                                              arbol_huffman, tabla_codigos, long_max, informar)
+        if canonico:
+            tabla_codigos = codigos_canonicos(longitudes_codigos(tabla_codigos))
+
+        # Si la codificación no reduce el archivo, se guarda sin comprimir y ambas operaciones se limitan a copiarlo
+        tamano = estadisticas.medir('estimar_tamano', compresor.tamano_comprimido, tabla_codigos, arbol_huffman)
+        if tamano >= tam_archivo + len(MAGICO) + 1:
+            compresor.almacenar_archivo(ruta_archivo_comprimido, prefijo, verificador)
+        else:
+            compresor.comprimir_archivo(ruta_archivo_comprimido, tabla_codigos, arbol_huffman, tam_archivo, prefijo,
+                                        verificador)
+
+    if verificador is not None:
+        completar_cabecera_verificada(ruta_archivo_comprimido, verificador)
+
+    estadisticas.emitir(tam_archivo, os.path.getsize(ruta_archivo_comprimido))
 
     # Descomentar la siguiente línea si se desea imprimir información relativa al árbol de Huffman generado
     # info_arbol_huffman(arbol_huffman, show_tree=True)
 
+""" 
+    Decodificador de Huffman basado en tablas de búsqueda de k bits. En lugar de avanzar bit a bit por el flujo
+    comprimido, se consultan los k bits siguientes y se resuelven de una vez todos los símbolos completos que contienen:
+     - tabla_primaria: para cada valor de k bits, el primer símbolo y la longitud de su código.
+     - tabla: para cada valor de k bits, la cadena con todos los símbolos completos y el número de bits que ocupan.
+     - codigos_largos: los códigos de más de k bits, que se resuelven alargando el código bit a bit.
+"""
+class DecodificadorHuffman:
+    def __init__(self, tabla_char_codigo, k=BITS_TABLA):
+        self.long_max = max(len(codigo) for codigo in tabla_char_codigo.values())
+        self.k = min(k, self.long_max) # No tiene sentido una tabla más ancha que el código más largo
+        k = self.k
+
+        # Rellenamos la tabla primaria: un código de longitud l <= k ocupa 2^(k-l) entradas consecutivas
+        self.tabla_primaria = [(None, 0)] * (1 << k)
+        self.codigos_largos = {}
+        for byte, codigo in tabla_char_codigo.items():
+            longitud = len(codigo)
+            valor = int(codigo, 2)
+            if longitud <= k:
+                inicio = valor << (k - longitud)
+                for i in range(inicio, inicio + (1 << (k - longitud))):
+                    self.tabla_primaria[i] = (byte, longitud)
+            else:
+                self.codigos_largos[(longitud, valor)] = byte
+
+        # A partir de la primaria, cada entrada acumula todos los símbolos que caben completos en sus k bits
+        mascara = (1 << k) - 1
+        self.tabla = []
+        for i in range(1 << k):
+            simbolos = ''
+            consumidos = 0
+            byte, longitud = self.tabla_primaria[i]
+            while byte is not None and consumidos + longitud <= k:
+                simbolos += byte
+                consumidos += longitud
+                byte, longitud = self.tabla_primaria[(i << consumidos) & mascara]
+            self.tabla.append((simbolos, consumidos))
+
+    """ 
+        Decodifica total_bits bits de la cadena de bytes (o vista) datos, empezando en el bit desfase del primer byte. 
+        Los bits se cargan de 32 en 32 en un entero que actúa de buffer, del que se extraen los k bits siguientes para 
+        indexar las tablas; al final de los datos, la última palabra se completa con ceros (palabra_final) en lugar de 
+        añadir el relleno a una copia de los datos. 
+        Si final es False, los bits son solo un fragmento del flujo y se deja de decodificar cuando quedan menos bits 
+        que el código más largo, ya que el siguiente código podría continuar en el fragmento siguiente.
+        Devuelve la cadena decodificada y el número de bits consumidos.
+    """
+    def decodificar(self, datos, total_bits, desfase=0, final=True):
+        k = self.k
+        mascara = (1 << k) - 1
+        tabla = self.tabla
+        tabla_primaria = self.tabla_primaria
+        unpack = struct.unpack
+        ultima = len(datos) - 4 # Última posición desde la que se pueden cargar 32 bits de datos
+
+        salida = []
+        buffer_bits = 0 # Bits cargados pendientes de decodificar
+        n_bits = 0      # Número de bits válidos en buffer_bits
+        pos = 0         # Siguiente byte de datos a cargar
+        restantes = total_bits
+
+        # Los bits anteriores al desfase del primer byte ya se consumieron
+        if desfase:
+            buffer_bits = ord(datos[0]) & (0xFF >> desfase)
+            n_bits = 8 - desfase
+            pos = 1
+
+        limite = k
+        if not final:
+            limite = max(k, self.long_max)
+
+        # Mientras queden al menos k bits, cada entrada de la tabla da símbolos completos que no se salen del flujo
+        while restantes >= limite:
+            if n_bits < k:
+                if pos <= ultima: palabra = unpack('>I', datos[pos:pos + 4])[0]
+                else: palabra = palabra_final(datos, pos)
+                buffer_bits = ((buffer_bits & ((1 << n_bits) - 1)) << 32) | palabra
+                pos += 4
+                n_bits += 32
+            simbolos, consumidos = tabla[(buffer_bits >> (n_bits - k)) & mascara]
+            if consumidos:
+                salida.append(simbolos)
+                n_bits -= consumidos
+                restantes -= consumidos
+            else:
+                # El código es más largo que k: se alarga bit a bit hasta encontrarlo
+                while n_bits < self.long_max:
+                    if pos <= ultima: palabra = unpack('>I', datos[pos:pos + 4])[0]
+                    else: palabra = palabra_final(datos, pos)
+                    buffer_bits = ((buffer_bits & ((1 << n_bits) - 1)) << 32) | palabra
+                    pos += 4
+                    n_bits += 32
+                for longitud in xrange(k + 1, self.long_max + 1):
+                    valor = (buffer_bits >> (n_bits - longitud)) & ((1 << longitud) - 1)
+                    if (longitud, valor) in self.codigos_largos:
+                        break
+                else:
+                    raise ValueError("El contenido comprimido está dañado: ningún código coincide con sus bits")
+                salida.append(self.codigos_largos[(longitud, valor)])
+                n_bits -= longitud
+                restantes -= longitud
+
+        # Últimos bits del flujo (menos de k): los códigos que quedan son cortos, basta la tabla primaria
+        while final and restantes > 0:
+            if n_bits < k:
+                if pos <= ultima: palabra = unpack('>I', datos[pos:pos + 4])[0]
+                else: palabra = palabra_final(datos, pos)
+                buffer_bits = ((buffer_bits & ((1 << n_bits) - 1)) << 32) | palabra
+                pos += 4
+                n_bits += 32
+            byte, longitud = tabla_primaria[(buffer_bits >> (n_bits - k)) & mascara]
+            if byte is None:
+                raise ValueError("El contenido comprimido está dañado: ningún código coincide con sus bits")
+            salida.append(byte)
+            n_bits -= longitud
+            restantes -= longitud
+
+        return ''.join(salida), total_bits - restantes
+
+    """ 
+        Decodifica todos los bits de datos, contenido de uno de los formatos que guardan la longitud de los datos 
+        originales en lugar del número de bits de relleno del último byte, y devuelve los primeros longitud bytes. Los 
+        bits de relleno son ceros, y los ceros siempre empiezan por el código canónico más corto, así que a lo sumo 
+        producen algún byte de más, que se descarta. Lanza ValueError si no se llega a la longitud. 
+    """
+    def decodificar_longitud(self, datos, longitud):
+        content, _ = self.decodificar(datos, len(datos) * 8)
+        if len(content) < longitud:
+            raise ValueError("El contenido comprimido está dañado: no llega a la longitud original")
+        return content[:longitud]
+
+""" Palabra de 32 bits de datos que empieza en la posición pos, completada con ceros si los datos terminan antes. """
+def palabra_final(datos, pos):
+    return struct.unpack('>I', (str(datos[pos:pos + 4]) + '\0\0\0\0')[:4])[0]
+
 """ Clase encargada de descomprimir un archivo comprimido con el algoritmo de Huffman. Recupera la información necesaria 
     para la descompresión a partir de la cabecera del archivo comprimido. """
 class DescompresorHuffman:
-    def __init__(self, ruta_archivo_comprimido):
+    def __init__(self, ruta_archivo_comprimido, tam_buffer=TAM_BUFFER, usar_mmap=False, diccionario=None, inicio=0):
         self.ruta_archivo_comprimido = ruta_archivo_comprimido
+        self.tam_buffer = tam_buffer   # Número de bytes que se leen del archivo comprimido en cada paso
+        self.usar_mmap = usar_mmap     # Si es True, el contenido se lee proyectando el archivo en memoria
+        self.diccionario = diccionario # DiccionarioHuffman con el que se comprimió el archivo, si se usó alguno
+        self.inicio = inicio           # Posición de la cabecera (tras la de VERSION_VERIFICADA, si la hay)
 
     """ Reconstruye el árbol de Huffman a partir de la cadena serializada. """
     def deserializar_huffman_tree(self, s):
@@ -305,11 +1145,29 @@ class DescompresorHuffman:
 
         return helper(list(s)) # Convertir la cadena a una lista de bits
 
-    """ Lee el archivo comprimido y extrae el contenido (bits) y la tabla de códigos. """
-    def leer_archivo(self, archivo_comprimido):
-        archivo_comprimido = open(self.ruta_archivo_comprimido, 'rb')
-        
-        len_tree = bytes4_to_int(archivo_comprimido.read(4)) # Leemos la longitud que ocupa el árbol serializado
+    """ Lee la cabecera del archivo comprimido, dejándolo posicionado al inicio del contenido, y devuelve la tabla 
+        de códigos, la longitud del relleno del último byte y la de los datos originales. En las cabeceras versionadas 
+        no hay relleno (0) y se guarda la longitud original; en la del formato original, la longitud es None. """
+    def leer_cabecera(self, archivo_comprimido):
+        inicio = archivo_comprimido.read(4)
+
+        # Cabecera versionada: la tabla de códigos se construye directamente a partir de las longitudes
+        if inicio[:3] == MAGICO:
+            version = bytes1_to_int(inicio[3])
+            if version == VERSION_DICCIONARIO:
+                identificador = bytes4_to_int(archivo_comprimido.read(4))
+                if self.diccionario is None:
+                    raise ValueError("El archivo se comprimió con un diccionario (opción --diccionario)")
+                if identificador != self.diccionario.identificador:
+                    raise ValueError("El archivo se comprimió con un diccionario distinto del indicado")
+                tabla_char_codigo = self.diccionario.tabla_char_codigo
+            elif version == VERSION_CANONICA:
+                tabla_char_codigo = codigos_canonicos(leer_longitudes(archivo_comprimido))
+            else:
+                raise ValueError("Versión de archivo comprimido no soportada: %d" % version)
+            return tabla_char_codigo, 0, leer_longitud_original(archivo_comprimido)
+
+        len_tree = bytes4_to_int(inicio) # Leemos la longitud que ocupa el árbol serializado
 
         serialized_tree_binary = archivo_comprimido.read(len_tree) # Leemos el árbol serializado
 
@@ -318,84 +1176,2245 @@ class DescompresorHuffman:
         arbol_huffman = self.deserializar_huffman_tree(serialized_tree_str) # Reconstruimos el árbol de Huffman
         
         tabla_char_codigo = CompresorHuffman.generar_codigos(arbol_huffman) # Generamos la tabla de códigos a partir del árbol de Huffman
-
-        # Invertimos la tabla de códigos para poder buscar los códigos en O(1)
-        tabla_codigo_char = {}
-        for k, v in tabla_char_codigo.items():
-            tabla_codigo_char[v] = k
         
         len_padding = bytes1_to_int(archivo_comprimido.read(1)) # Leemos la longitud del relleno del último byte
 
-        # Leemos el resto del archivo comprimido
-        bytes = archivo_comprimido.read()
-        archivo_comprimido.close()
-        bits = string_to_binary(bytes)
+        return tabla_char_codigo, len_padding, None
+
+    """ 
+        Lee la cabecera como leer_cabecera, pero devuelve el decodificador de su tabla en lugar de la tabla. tablas es 
+        una caché de decodificadores indexada por los bytes de la cabecera (sin el byte de relleno ni la longitud 
+        original): si ya contiene la cabecera no se vuelve a leer el árbol ni a construir las tablas de decodificación. 
+    """
+    def leer_decodificador(self, archivo_comprimido, tablas):
+        inicio = archivo_comprimido.tell()
+        cabecera = archivo_comprimido.read(4)
+        if cabecera[:3] != MAGICO:
+            cabecera += archivo_comprimido.read(bytes4_to_int(cabecera))
+        elif bytes1_to_int(cabecera[3]) == VERSION_CANONICA:
+            leer_longitudes(archivo_comprimido)
+            fin = archivo_comprimido.tell()
+            archivo_comprimido.seek(inicio)
+            cabecera = archivo_comprimido.read(fin - inicio)
+        else: # Identificador del diccionario
+            cabecera += archivo_comprimido.read(4)
+
+        decodificador = tablas.get(cabecera)
+        if decodificador is not None:
+            if cabecera[:3] != MAGICO:
+                return decodificador, bytes1_to_int(archivo_comprimido.read(1)), None
+            return decodificador, 0, leer_longitud_original(archivo_comprimido)
+
+        archivo_comprimido.seek(inicio)
+        tabla_char_codigo, len_padding, longitud = self.leer_cabecera(archivo_comprimido)
+        decodificador = DecodificadorHuffman(tabla_char_codigo)
+        if len(tablas) >= TABLAS_CACHE:
+            tablas.clear()
+        tablas[cabecera] = decodificador
+        return decodificador, len_padding, longitud
 
-        # Eliminamos los bits de relleno del último byte, si los hay
-        if len_padding > 0:
-            bits = bits[ : -len_padding]
 
-        return bits, tabla_codigo_char
+    '''
+        Descomprime el archivo comprimido deserializando el árbol de Huffman de la cabecera. El contenido se lee 
+        en bloques de tam_buffer bytes, y cada bloque se decodifica y se escribe antes de leer el siguiente:
+         - Los bits del final de un bloque que no completan un código se anteponen al bloque siguiente.
+         - El número total de bits útiles se conoce de antemano (tamaño del contenido menos el relleno), lo que 
+           permite saber cuándo se está decodificando el último bloque. En los formatos que guardan la longitud de 
+           los datos originales, los bits de relleno también se decodifican, y los bytes de más se descartan.
+         - Con usar_mmap, cada bloque es una vista de la proyección que ya empieza en el primer byte pendiente, así 
+           que los bytes pendientes no se copian delante del bloque siguiente.
+        De esta forma la memoria utilizada no depende del tamaño del archivo. Los datos se escriben en salida si se 
+        indica, o en el archivo con el nombre original.
+    '''
+    def descomprimir_archivo(self, salida=None):
+        archivo_comprimido = open(self.ruta_archivo_comprimido, 'rb')
+        archivo_comprimido.seek(self.inicio)
 
+        # Leemos la cabecera y extraemos la tabla de códigos
+        tabla_char_codigo, len_padding, faltan = estadisticas.medir('cabecera', self.leer_cabecera, archivo_comprimido)
+        decodificador = estadisticas.medir('tabla_decodificacion', DecodificadorHuffman, tabla_char_codigo)
 
-    """ Descomprime el archivo comprimido deserializando el árbol de Huffman de la cabecera. """
-    def descomprimir_archivo(self):
-        # Leemos el archivo comprimido y extraemos el contenido (bits) y la tabla de códigos
-        bits, tabla_codigo_char = self.leer_archivo(self.ruta_archivo_comprimido)
+        # En el formato original, los bits de relleno del último byte no forman parte del contenido
+        tamano = os.path.getsize(self.ruta_archivo_comprimido)
+        restantes = (tamano - archivo_comprimido.tell()) * 8 - len_padding
 
         # Abrimos el archivo de salida para escribir los datos descomprimidos
-        nombre_archivo, _ = os.path.splitext(self.ruta_archivo_comprimido)
-        archivo_descomprimido = open(nombre_archivo, 'wb')
-
-        # Descomprimimos los datos usando la tabla de códigos, cuyas claves son los códigos y
-        # los valores son los bytes, escribiendo en lotes para no saturar la memoria
-        batch_size = 8000
-        content = ''
-        codigo = ''
-        for bit in bits:
-            codigo += bit
-            if codigo in tabla_codigo_char:
-                content += tabla_codigo_char[codigo]
-                if len(content) >= batch_size:
-                    archivo_descomprimido.write(content)
-                    content = ''
-                codigo = ''
-        archivo_descomprimido.write(content)
-        archivo_descomprimido.close()
-
-""" Crea una instancia del DescompresorHuffman y descomprime el archivo. """
-def descomprimir_archivo_huffman(ruta_archivo_comprimido):
-    # Si el archivo comprimido está vacío, crear uno vacío con la extensión original
+        archivo_descomprimido = salida
+        if salida is None:
+            nombre_archivo, _ = os.path.splitext(self.ruta_archivo_comprimido)
+            archivo_descomprimido = open(nombre_archivo, 'wb')
+
+        mapa = None
+        if self.usar_mmap and tamano > archivo_comprimido.tell():
+            mapa = mmap.mmap(archivo_comprimido.fileno(), 0, access=mmap.ACCESS_READ)
+
+        posicion = archivo_comprimido.tell() # Posición en el archivo del primer byte pendiente
+        pendientes = '' # Bytes del bloque anterior que aún no se han decodificado por completo
+        desfase = 0     # Bits del primer byte pendiente que ya se han decodificado
+        inicio = time.time()
+        while posicion + len(pendientes) < tamano:
+            if mapa is not None:
+                datos = buffer(mapa, posicion, len(pendientes) + self.tam_buffer)
+            else:
+                datos = pendientes + archivo_comprimido.read(self.tam_buffer)
+            inicio = estadisticas.sumar('lectura', inicio)
+            disponibles = min(restantes, len(datos) * 8 - desfase)
+            content, consumidos = decodificador.decodificar(datos, disponibles, desfase, disponibles == restantes)
+            if faltan is not None: # Bytes originales que faltan por escribir, si se conoce la longitud
+                content = content[:faltan]
+                faltan -= len(content)
+            inicio = estadisticas.sumar('decodificacion', inicio)
+            archivo_descomprimido.write(content)
+            inicio = estadisticas.sumar('escritura', inicio)
+
+            restantes -= consumidos
+            desfase += consumidos
+            posicion += desfase // 8
+            pendientes = datos[desfase // 8:]
+            desfase %= 8
+
+        if mapa is not None:
+            mapa.close()
+        archivo_comprimido.close()
+        if salida is None:
+            archivo_descomprimido.close()
+        if faltan:
+            raise ValueError("El contenido comprimido está dañado: no llega a la longitud original")
+
+""" 
+    Crea una instancia del DescompresorHuffman y descomprime el archivo. La cabecera se comprueba antes de crear 
+    ningún archivo, y los datos se escriben en un archivo temporal del mismo directorio que solo sustituye al archivo 
+    con el nombre original cuando la descompresión termina bien, de modo que un error no lo deja a medias ni 
+    destruye el que hubiera. El tiempo de cada fase se suma a las estadísticas, que se emiten al terminar si están 
+    activas. 
+"""
+def descomprimir_archivo_huffman(ruta_archivo_comprimido, tam_buffer=TAM_BUFFER, trabajos=1, usar_mmap=False,
+                                 diccionario=None):
+    estadisticas.iniciar('descomprimir', ruta_archivo_comprimido)
+
+    # Si el archivo comprimido está vacío, el archivo con la extensión original se queda vacío. Si se conoce la 
+    # longitud de los datos originales, el archivo se crea directamente con ese tamaño
+    nombre_archivo, _ = os.path.splitext(ruta_archivo_comprimido)
+    longitud = None
+    if os.path.getsize(ruta_archivo_comprimido):
+        comprobar_formato(ruta_archivo_comprimido, diccionario)
+        longitud = longitud_original(ruta_archivo_comprimido)
+
+    ruta_temporal = crear_temporal(nombre_archivo)
+    try:
+        if longitud is None:
+            archivo_descomprimido = open(ruta_temporal, 'wb')
+        else:
+            archivo_descomprimido = SalidaPreasignada(ruta_temporal, longitud)
+        try:
+            descomprimir_huffman(ruta_archivo_comprimido, archivo_descomprimido, tam_buffer, trabajos, usar_mmap,
+                                 diccionario)
+        finally:
+            archivo_descomprimido.close()
+        if longitud is not None:
+            archivo_descomprimido.comprobar()
+    except:
+        os.remove(ruta_temporal)
+        raise
+    os.rename(ruta_temporal, nombre_archivo)
+
+    estadisticas.emitir(os.path.getsize(ruta_archivo_comprimido), os.path.getsize(nombre_archivo))
+
+""" 
+    Crea un archivo temporal vacío en el mismo directorio que ruta_archivo, para poder renombrarlo a ruta_archivo al 
+    terminar de escribirlo, y devuelve su ruta. Sus permisos son los que tendría un archivo nuevo creado con open. 
+"""
+def crear_temporal(ruta_archivo):
+    directorio, nombre = os.path.split(ruta_archivo)
+    descriptor, ruta_temporal = tempfile.mkstemp(prefix='.%s.' % nombre, dir=directorio or '.')
+    os.close(descriptor)
+    mascara = os.umask(0)
+    os.umask(mascara)
+    os.chmod(ruta_temporal, 0666 & ~mascara)
+    return ruta_temporal
+
+""" 
+    Comprueba, sin descomprimirlo, que el archivo comprimido está en un formato que se puede descomprimir con 
+    descomprimir_huffman y, si se comprimió con un diccionario, que es el indicado. Lanza ValueError si no. 
+"""
+def comprobar_formato(ruta_archivo_comprimido, diccionario=None):
+    version, inicio, _, _ = leer_formato(ruta_archivo_comprimido)
+    if version == VERSION_ARCHIVO:
+        raise ValueError("El archivo es un contenedor de varios archivos (opción -x para extraerlos)")
+    if version not in (None, VERSION_CANONICA, VERSION_BLOQUES, VERSION_ADAPTATIVA, VERSION_DICCIONARIO,
+                       VERSION_ALMACENADA):
+        raise ValueError("Versión de archivo comprimido no soportada: %d" % version)
+    if version == VERSION_DICCIONARIO:
+        archivo_comprimido = open(ruta_archivo_comprimido, 'rb')
+        archivo_comprimido.seek(inicio + len(MAGICO) + 1)
+        identificador = archivo_comprimido.read(4)
+        archivo_comprimido.close()
+        if len(identificador) < 4:
+            raise ValueError("El archivo comprimido está truncado")
+        identificador = bytes4_to_int(identificador)
+        if diccionario is None:
+            raise ValueError("El archivo se comprimió con un diccionario (opción --diccionario)")
+        if identificador != diccionario.identificador:
+            raise ValueError("El archivo se comprimió con un diccionario distinto del indicado")
+
+""" Descomprime el archivo en cualquiera de sus formatos (salvo el contenedor) y escribe los datos, a medida que se 
+    decodifican, en el objeto salida, que solo necesita el método write. Si el archivo tiene suma de verificación, se 
+    comprueba al terminar y se lanza ValueError si los datos no coinciden. """
+def descomprimir_huffman(ruta_archivo_comprimido, salida, tam_buffer=TAM_BUFFER, trabajos=1, usar_mmap=False,
+                         diccionario=None):
     if os.stat(ruta_archivo_comprimido).st_size == 0:
-        nombre_archivo, _ = os.path.splitext(ruta_archivo_comprimido)
-        open(nombre_archivo, 'w').close()
         return
-    descompresor = DescompresorHuffman(ruta_archivo_comprimido)
-    descompresor.descomprimir_archivo()
+
+    version, inicio, crc, longitud = leer_formato(ruta_archivo_comprimido)
+    if crc is None:
+        descomprimir_version(ruta_archivo_comprimido, salida, version, inicio, tam_buffer, trabajos, usar_mmap,
+                             diccionario)
+        return
+    verificador = VerificadorSalida(salida)
+    descomprimir_version(ruta_archivo_comprimido, verificador, version, inicio, tam_buffer, trabajos, usar_mmap,
+                         diccionario)
+    verificador.comprobar(crc, longitud)
+
+""" Descomprime el archivo de la versión indicada, cuya cabecera empieza en la posición inicio, y escribe los datos 
+    en el objeto salida. """
+def descomprimir_version(ruta_archivo_comprimido, salida, version, inicio, tam_buffer=TAM_BUFFER, trabajos=1,
+                         usar_mmap=False, diccionario=None):
+    # Los archivos en formato por bloques pueden descomprimirse en paralelo
+    if version == VERSION_BLOQUES:
+        DescompresorBloques(ruta_archivo_comprimido, trabajos, inicio).descomprimir_archivo(salida)
+        return
+
+    if version == VERSION_ALMACENADA:
+        reloj = time.time()
+        for bloque in leer_bloques(ruta_archivo_comprimido, tam_buffer, usar_mmap, inicio + len(MAGICO) + 1):
+            reloj = estadisticas.sumar('lectura', reloj)
+            salida.write(bloque)
+            reloj = estadisticas.sumar('escritura', reloj)
+        return
+
+    if version == VERSION_ADAPTATIVA:
+        archivo_comprimido = open(ruta_archivo_comprimido, 'rb')
+        archivo_comprimido.seek(inicio + len(MAGICO) + 1)
+        estadisticas.medir('adaptativo', descomprimir_adaptativo, archivo_comprimido, salida)
+        archivo_comprimido.close()
+        return
+
+    if version == VERSION_ARCHIVO:
+        raise ValueError("El archivo es un contenedor de varios archivos (opción -x para extraerlos)")
+
+    descompresor = DescompresorHuffman(ruta_archivo_comprimido, tam_buffer, usar_mmap, diccionario, inicio)
+    descompresor.descomprimir_archivo(salida)
+
+""" 
+    Longitud de los datos originales del archivo comprimido si se conoce sin descomprimirlo, o None: la de la cabecera 
+    de los códigos canónicos y del diccionario, la del directorio del formato por bloques, en el formato almacenado el 
+    tamaño del archivo menos la cabecera o, en los demás, la de la cabecera de VERSION_VERIFICADA. Como con ella se 
+    reserva el archivo de salida, se lanza ValueError si no es coherente con el archivo: la de la cabecera de 
+    VERSION_VERIFICADA debe coincidir con la que se deduce del formato y, en los formatos de un solo flujo codificado, 
+    no puede superar 8 bytes por cada byte comprimido (cada byte original ocupa al menos un bit). 
+"""
+def longitud_original(ruta_archivo_comprimido):
+    version, inicio, _, longitud = leer_formato(ruta_archivo_comprimido)
+    tamano = os.path.getsize(ruta_archivo_comprimido)
+    conocida = None
+    if version == VERSION_ALMACENADA:
+        conocida = tamano - inicio - len(MAGICO) - 1
+    elif version == VERSION_BLOQUES:
+        conocida = DescompresorBloques(ruta_archivo_comprimido, inicio=inicio).longitud_original()
+    elif version in (VERSION_CANONICA, VERSION_DICCIONARIO):
+        archivo_comprimido = open(ruta_archivo_comprimido, 'rb')
+        archivo_comprimido.seek(inicio + len(MAGICO) + 1)
+        if version == VERSION_CANONICA:
+            leer_longitudes(archivo_comprimido)
+        else: # Identificador del diccionario
+            archivo_comprimido.read(4)
+        conocida = leer_longitud_original(archivo_comprimido)
+        archivo_comprimido.close()
+        if conocida > 8 * (tamano - inicio):
+            raise ValueError("La longitud de los datos originales de la cabecera (%d bytes) no corresponde al archivo "
+                             "comprimido" % conocida)
+    if longitud is None:
+        return conocida
+    if (conocida is not None and longitud != conocida) or (conocida is None and longitud > 8 * (tamano - inicio)):
+        raise ValueError("La longitud de los datos originales de la cabecera (%d bytes) no corresponde al archivo "
+                         "comprimido" % longitud)
+    return longitud
+
+'''
+    Archivo de salida cuyo tamaño final se conoce de antemano. Se crea con ese tamaño y se proyecta en memoria, de 
+    manera que cada escritura copia los datos directamente en su sitio, sin que el archivo crezca en cada escritura. 
+    Si los datos superan la longitud, se lanza ValueError al escribirlos; si no llegan a ella, al llamar a comprobar, 
+    que se hace al terminar de descomprimir (close solo libera la proyección y el archivo, para que un error durante 
+    la descompresión no quede tapado por el de la longitud).
+'''
+class SalidaPreasignada:
+    def __init__(self, ruta_archivo, longitud):
+        self.longitud = longitud # Tamaño final del archivo
+        self.posicion = 0        # Bytes escritos
+        self.archivo = open(ruta_archivo, 'w+b')
+        self.archivo.truncate(longitud)
+        self.mapa = None
+        if longitud: # No se puede proyectar un archivo vacío
+            self.mapa = mmap.mmap(self.archivo.fileno(), longitud)
+
+    def write(self, datos):
+        if not datos:
+            return
+        if self.posicion + len(datos) > self.longitud:
+            raise ValueError("Los datos descomprimidos superan la longitud original (%d bytes)" % self.longitud)
+        self.mapa.write(datos)
+        self.posicion += len(datos)
+
+    def flush(self):
+        if self.mapa is not None:
+            self.mapa.flush()
+
+    def close(self):
+        if self.mapa is not None:
+            self.mapa.close()
+        self.archivo.close()
+
+    """ Lanza ValueError si los datos escritos no llegan a la longitud original. """
+    def comprobar(self):
+        if self.posicion != self.longitud:
+            raise ValueError("Los datos descomprimidos (%d bytes) no llegan a la longitud original (%d bytes)" %
+                             (self.posicion, self.longitud))
+
+""" Objeto de salida que calcula el CRC-32 y la longitud de los datos que recibe antes de pasarlos a la salida 
+    indicada, o descartarlos si no se indica ninguna. """
+class VerificadorSalida:
+    def __init__(self, salida=None):
+        self.salida = salida # Objeto en el que se escriben los datos, o None
+        self.crc = 0         # CRC-32 de los datos recibidos
+        self.longitud = 0    # Número de bytes recibidos
+
+    def write(self, datos):
+        self.crc = zlib.crc32(datos, self.crc)
+        self.longitud += len(datos)
+        if self.salida is not None:
+            self.salida.write(datos)
+
+    def flush(self):
+        if self.salida is not None:
+            self.salida.flush()
+
+    """ Lanza ValueError si el CRC-32 o la longitud de los datos recibidos no son los indicados. """
+    def comprobar(self, crc, longitud):
+        if self.crc & 0xFFFFFFFF != crc or self.longitud != longitud:
+            raise ValueError("Los datos descomprimidos no coinciden con la suma de verificación (CRC-32 %08x y %d "
+                             "bytes, se esperaba %08x y %d bytes)" % (self.crc & 0xFFFFFFFF, self.longitud, crc,
+                                                                     longitud))
+
+""" Devuelve los bloques de datos indicados, pasando antes cada uno al verificador (si no es None) para calcular 
+    su suma sin volver a leerlos. """
+def bloques_verificados(bloques, verificador):
+    for bloque in bloques:
+        if verificador is not None:
+            verificador.write(bloque)
+        yield bloque
+
+""" Comprueba el archivo comprimido descomprimiéndolo sin escribir los datos en ningún sitio. Devuelve el CRC-32 y la 
+    longitud de los datos originales y si se han comparado con la suma de verificación del archivo (False si no la 
+    tiene). Si el archivo está dañado, lanza una excepción, ValueError si no coincide la suma de verificación. """
+def probar_huffman(ruta_archivo_comprimido, tam_buffer=TAM_BUFFER, trabajos=1, usar_mmap=False, diccionario=None):
+    verificador = VerificadorSalida()
+    descomprimir_huffman(ruta_archivo_comprimido, verificador, tam_buffer, trabajos, usar_mmap, diccionario)
+    verificado = os.path.getsize(ruta_archivo_comprimido) > 0 and leer_formato(ruta_archivo_comprimido)[2] is not None
+    return verificador.crc & 0xFFFFFFFF, verificador.longitud, verificado
+
+'''
+    Objeto de salida que, en lugar de guardar los datos descomprimidos, busca en ellos el patrón a medida que llegan. 
+    Solo se conservan los últimos bytes recibidos (una ventana deslizante): los len(patron) - 1 necesarios para 
+    encontrar las coincidencias que empiezan en un fragmento y terminan en el siguiente, más contexto bytes antes y 
+    después de cada coincidencia. Cada coincidencia se comunica, en orden, llamando a informar(posicion, fragmento), 
+    donde fragmento es la coincidencia con su contexto; las coincidencias pueden solaparse.
+'''
+class BuscadorPatron:
+    def __init__(self, patron, informar, contexto=0):
+        self.patron = patron     # Bytes que se buscan
+        self.informar = informar # Función a la que se comunica cada coincidencia
+        self.contexto = contexto # Bytes que se muestran antes y después de cada coincidencia
+        self.ventana = ''        # Últimos bytes recibidos
+        self.inicio_ventana = 0  # Posición en los datos originales del primer byte de la ventana
+        self.buscado = 0         # Posición a partir de la cual pueden empezar coincidencias aún no encontradas
+        self.pendientes = []     # Coincidencias cuyo contexto posterior aún no ha llegado
+        self.coincidencias = 0   # Número de coincidencias encontradas
+
+    def write(self, datos):
+        ventana = self.ventana + str(datos) # Con --mmap los datos almacenados llegan como buffer
+        fin = self.inicio_ventana + len(ventana)
+        pos = ventana.find(self.patron, self.buscado - self.inicio_ventana)
+        while pos != -1:
+            self.pendientes.append(self.inicio_ventana + pos)
+            pos = ventana.find(self.patron, pos + 1)
+        self.buscado = max(self.buscado, fin - len(self.patron) + 1)
+        self.ventana = ventana
+
+        # Se comunican las coincidencias que ya tienen todo su contexto posterior
+        n = 0
+        while n < len(self.pendientes) and self.pendientes[n] + len(self.patron) + self.contexto <= fin:
+            self.comunicar(self.pendientes[n])
+            n += 1
+        del self.pendientes[:n]
+
+        # Se descarta lo que ya no puede formar parte de ninguna coincidencia ni de su contexto
+        conservar = self.buscado - self.contexto
+        if self.pendientes:
+            conservar = min(conservar, self.pendientes[0] - self.contexto)
+        if conservar > self.inicio_ventana:
+            self.ventana = self.ventana[conservar - self.inicio_ventana:]
+            self.inicio_ventana = conservar
+
+    def flush(self):
+        pass
+
+    """ Comunica las coincidencias pendientes, con el contexto posterior que haya, al terminar los datos. """
+    def cerrar(self):
+        for posicion in self.pendientes:
+            self.comunicar(posicion)
+        self.pendientes = []
+
+    def comunicar(self, posicion):
+        inicio = max(posicion - self.contexto, self.inicio_ventana) - self.inicio_ventana
+        fin = posicion + len(self.patron) + self.contexto - self.inicio_ventana
+        self.coincidencias += 1
+        self.informar(posicion, self.ventana[inicio:fin])
+
+""" Busca el patrón en los datos originales del archivo comprimido sin escribirlos ni guardarlos enteros en memoria, 
+    descomprimiéndolo a medida que se recorre (ver BuscadorPatron), y devuelve el número de coincidencias. """
+def buscar_huffman(ruta_archivo_comprimido, patron, informar, contexto=0, tam_buffer=TAM_BUFFER, trabajos=1,
+                   usar_mmap=False, diccionario=None):
+    if not patron:
+        raise ValueError("El patrón a buscar no puede estar vacío")
+    buscador = BuscadorPatron(patron, informar, contexto)
+    descomprimir_huffman(ruta_archivo_comprimido, buscador, tam_buffer, trabajos, usar_mmap, diccionario)
+    buscador.cerrar()
+    return buscador.coincidencias
+
+
+"""
+Interfaz en memoria, para usar el compresor desde otros programas sin archivos temporales:
+ - comprimir_datos y descomprimir_datos reciben y devuelven cadenas de bytes, en el mismo formato que los archivos .huf.
+ - Para flujos (objetos con read y write que solo se recorren una vez, como sockets o tuberías), 
+   comprimir_flujo_huffman(entrada, salida) escribe el mismo resultado que comprimir_datos con las mismas opciones, y 
+   comprimir_adaptativo(entrada, salida) y descomprimir_flujo(entrada, salida) trabajan en una sola pasada con el 
+   formato adaptativo.
+"""
+
+""" Comprime la cadena de bytes datos y devuelve el resultado, igual que comprimir_archivo_huffman con las mismas 
+    opciones: con un diccionario, o con el árbol (o los códigos canónicos, limitados a long_max bits si no es None) 
+    de los propios datos, o guardándolos sin comprimir si así no se reducen. Si adaptativo es True, se usa el formato 
+    adaptativo. Si crc es True, se antepone la cabecera de VERSION_VERIFICADA. """
+def comprimir_datos(datos, canonico=False, long_max=None, diccionario=None, adaptativo=False, crc=False):
+    if not datos:
+        return ''
+    if crc:
+        return cabecera_verificada(zlib.crc32(datos), len(datos)) + comprimir_datos(datos, canonico, long_max,
+                                                                                    diccionario, adaptativo)
+    salida = StringIO()
+    if adaptativo:
+        comprimir_adaptativo(StringIO(datos), salida)
+        return salida.getvalue()
+
+    # Los datos se codifican por bloques, como los archivos, para no crear copias de su tamaño
+    bloques = [buffer(datos, inicio, TAM_BUFFER) for inicio in xrange(0, len(datos), TAM_BUFFER)]
+    histograma = None
+    if diccionario is None:
+        histograma = histograma_bloque(datos)
+    escribir_datos_comprimidos(salida, bloques, len(datos), histograma, canonico, long_max, diccionario)
+    return salida.getvalue()
+
+""" Escribe en salida los bloques de datos, que suman longitud bytes, comprimidos como en comprimir_datos (sin el 
+    formato adaptativo ni la cabecera de VERSION_VERIFICADA). Sin diccionario, histograma es el de todos los bloques. """
+def escribir_datos_comprimidos(salida, bloques, longitud, histograma, canonico=False, long_max=None, diccionario=None):
+    compresor = CompresorHuffman(None, canonico=canonico, diccionario=diccionario)
+    if diccionario is not None:
+        compresor.escribir_comprimido(salida, bloques, diccionario.tabla_char_codigo, None, longitud)
+        return
+
+    arbol_huffman = compresor.construir_arbol(frecuencias_histograma(*histograma))
+    tabla_codigos = compresor.generar_codigos(arbol_huffman)
+    if long_max is not None:
+        arbol_huffman, tabla_codigos = compresor.limitar_longitud(arbol_huffman, tabla_codigos, long_max)
+    if canonico:
+        tabla_codigos = codigos_canonicos(longitudes_codigos(tabla_codigos))
+    if compresor.tamano_comprimido(tabla_codigos, arbol_huffman) >= longitud + len(MAGICO) + 1:
+        salida.write(MAGICO + int_to_1byte(VERSION_ALMACENADA))
+        for bloque in bloques:
+            salida.write(bloque)
+        return
+    compresor.escribir_comprimido(salida, bloques, tabla_codigos, arbol_huffman, longitud)
+
+'''
+    Comprime todo lo que se lea del objeto entrada (que solo necesita el método read) y escribe en el objeto salida 
+    (con los métodos write y flush) el mismo resultado que comprimir_datos con las mismas opciones. Salvo el 
+    adaptativo sin suma de verificación, los formatos necesitan conocer las frecuencias, la longitud o el CRC-32 de 
+    los datos antes de escribir la cabecera, así que se hacen dos pasadas:
+     - La entrada se lee en bloques de tam_buffer bytes, que se copian a un archivo temporal mientras se cuentan sus 
+       frecuencias, su longitud y su CRC-32.
+     - Con la cabecera ya escrita, el archivo temporal se codifica leyéndolo de nuevo en bloques.
+    De esta forma la memoria utilizada no depende del tamaño de los datos, pero sí el espacio en disco.
+'''
+def comprimir_flujo_huffman(entrada, salida, canonico=False, long_max=None, diccionario=None, adaptativo=False,
+                            crc=False, tam_buffer=TAM_BUFFER):
+    if adaptativo and not crc:
+        comprimir_adaptativo(entrada, salida)
+        return
+
+    temporal = tempfile.TemporaryFile()
+    try:
+        verificador = VerificadorSalida(temporal)
+        histograma = ([0] * 256, {})
+        bloque = entrada.read(tam_buffer)
+        while bloque:
+            if not adaptativo and diccionario is None:
+                histograma = sumar_histogramas([histograma, histograma_bloque(bloque, verificador.longitud,
+                                                                              histograma[1])])
+            verificador.write(bloque)
+            bloque = entrada.read(tam_buffer)
+        if not verificador.longitud: # Sin datos, el resultado está vacío, como el archivo comprimido de uno vacío
+            return
+
+        if crc:
+            salida.write(cabecera_verificada(verificador.crc, verificador.longitud))
+        temporal.seek(0)
+        if adaptativo:
+            comprimir_adaptativo(temporal, salida)
+            return
+        bloques = iter(lambda: temporal.read(tam_buffer), '')
+        escribir_datos_comprimidos(salida, bloques, verificador.longitud, histograma, canonico, long_max, diccionario)
+        salida.flush()
+    finally:
+        temporal.close()
+
+""" Descomprime la cadena de bytes datos, en cualquiera de los formatos salvo el contenedor, y devuelve los datos 
+    originales. Los archivos comprimidos con un diccionario necesitan el mismo diccionario. Si los datos tienen suma 
+    de verificación y no coincide, se lanza ValueError. Si se indica tablas, es la caché de decodificadores de 
+    DescompresorHuffman.leer_decodificador. """
+def descomprimir_datos(datos, diccionario=None, trabajos=1, tablas=None):
+    if not datos:
+        return ''
+    version = version_cabecera(datos)
+    if version == VERSION_VERIFICADA:
+        crc, longitud = struct.unpack('>IQ', datos[len(MAGICO) + 1:LONGITUD_VERIFICADA])
+        content = descomprimir_datos(datos[LONGITUD_VERIFICADA:], diccionario, trabajos, tablas)
+        verificador = VerificadorSalida()
+        verificador.write(content)
+        verificador.comprobar(crc, longitud)
+        return content
+    if version == VERSION_ALMACENADA:
+        return datos[len(MAGICO) + 1:]
+    if version == VERSION_ARCHIVO:
+        raise ValueError("Los datos son un contenedor de varios archivos (opción -x para extraerlos)")
+
+    entrada = StringIO(datos)
+    salida = StringIO()
+    if version == VERSION_BLOQUES:
+        entrada.seek(len(MAGICO) + 1 + 4) # Identificador del formato y tamaño de bloque
+        DescompresorBloques(None, trabajos).descomprimir_bloques(entrada, salida)
+    elif version == VERSION_ADAPTATIVA:
+        entrada.seek(len(MAGICO) + 1)
+        descomprimir_adaptativo(entrada, salida)
+    else:
+        descompresor = DescompresorHuffman(None, diccionario=diccionario)
+        if tablas is None:
+            tabla_char_codigo, len_padding, longitud = descompresor.leer_cabecera(entrada)
+            decodificador = DecodificadorHuffman(tabla_char_codigo)
+        else:
+            decodificador, len_padding, longitud = descompresor.leer_decodificador(entrada, tablas)
+        inicio = entrada.tell()
+        if longitud is not None:
+            return decodificador.decodificar_longitud(buffer(datos, inicio), longitud)
+        content, _ = decodificador.decodificar(buffer(datos, inicio), (len(datos) - inicio) * 8 - len_padding)
+        return content
+    return salida.getvalue()
+
+""" Descomprime y devuelve los bytes [inicio, inicio + longitud) del archivo original, sin descomprimirlo entero. Solo 
+    está disponible para el formato por bloques, y es más rápido si el archivo se comprimió con índice. """
+def descomprimir_rango_huffman(ruta_archivo_comprimido, inicio, longitud):
+    if os.stat(ruta_archivo_comprimido).st_size == 0:
+        return ''
+    version, posicion, _, _ = leer_formato(ruta_archivo_comprimido)
+    if version != VERSION_BLOQUES:
+        raise ValueError("La descompresión de un rango requiere el formato por bloques (opción -j al comprimir)")
+    return DescompresorBloques(ruta_archivo_comprimido, inicio=posicion).descomprimir_rango(inicio, longitud)
+
+""" Devuelve la versión del formato de unos bytes de cabecera, o None si es el formato original sin versión. """
+def version_cabecera(cabecera):
+    if len(cabecera) >= 4 and cabecera[:3] == MAGICO:
+        return bytes1_to_int(cabecera[3])
+    return None
+
+""" 
+    Devuelve la versión del formato de un archivo comprimido (None si es el formato original sin versión), la posición 
+    en la que empieza su cabecera y el CRC-32 y la longitud de los datos originales. Si el archivo tiene suma de 
+    verificación, la versión es la del archivo que sigue a la cabecera de VERSION_VERIFICADA; si no, la posición es 
+    0 y el CRC-32 y la longitud son None. 
+"""
+def leer_formato(ruta_archivo_comprimido):
+    archivo_comprimido = open(ruta_archivo_comprimido, 'rb')
+    cabecera = archivo_comprimido.read(LONGITUD_VERIFICADA + 4)
+    archivo_comprimido.close()
+    version = version_cabecera(cabecera)
+    if version == VERSION_VERIFICADA:
+        crc, longitud = struct.unpack('>IQ', cabecera[len(MAGICO) + 1:LONGITUD_VERIFICADA])
+        return version_cabecera(cabecera[LONGITUD_VERIFICADA:]), LONGITUD_VERIFICADA, crc, longitud
+    return version, 0, None, None
+
+""" Cabecera de VERSION_VERIFICADA con el CRC-32 y la longitud de los datos originales. """
+def cabecera_verificada(crc, longitud):
+    return MAGICO + int_to_1byte(VERSION_VERIFICADA) + struct.pack('>IQ', crc & 0xFFFFFFFF, longitud)
+
+""" Sustituye la cabecera de VERSION_VERIFICADA reservada al principio del archivo comprimido por la que corresponde 
+    al CRC-32 y la longitud calculados por el verificador. """
+def completar_cabecera_verificada(ruta_archivo_comprimido, verificador):
+    archivo_comprimido = open(ruta_archivo_comprimido, 'r+b')
+    archivo_comprimido.write(cabecera_verificada(verificador.crc, verificador.longitud))
+    archivo_comprimido.close()
+
+
+"""
+Formato por bloques. El archivo se divide en bloques de tamaño fijo que se codifican de forma independiente, cada uno 
+con su propia tabla de códigos canónicos, por lo que pueden comprimirse y descomprimirse en paralelo:
+ - Cabecera: MAGICO, la versión VERSION_BLOQUES y el tamaño de bloque (4 bytes).
+ - Cada bloque: su longitud original (4 bytes), la longitud de su cuerpo comprimido (4 bytes) y el cuerpo, formado por 
+   las longitudes serializadas de los códigos y el contenido, con el último byte completado con ceros. Como se conoce 
+   la longitud original, no hace falta guardar cuántos bits de relleno tiene: los bytes que producen se descartan.
+ - Un bloque de longitud original 0 marca el final de los bloques.
+ - Los bloques que no se pueden comprimir se guardan tal cual, marcados con el bit BLOQUE_ALMACENADO en la longitud de 
+   su cuerpo; al descomprimirlos solo hay que copiarlos.
+ - Los bloques con una distribución parecida a la de un bloque anterior pueden repetir su tabla, marcados con el bit 
+   BLOQUE_REPETIDO: su cuerpo empieza por el número del bloque de origen (4 bytes) en lugar de por las longitudes.
+ - Los bloques comprimidos con LZ77 antes de Huffman se marcan con el bit BLOQUE_LZ (ver comprimir_bloque_lz), y los 
+   codificados con el modelo de orden 1 con el bit BLOQUE_CONTEXTO (ver comprimir_bloque_contexto).
+ - Directorio: la longitud original de todos los bloques (8 bytes), con la que se reserva el archivo de salida, y la 
+   posición en el archivo de cada bloque (8 bytes cada una), para poder acceder a ellos directamente.
+ - Índice de acceso aleatorio, opcional: el intervalo N (4 bytes) y, para cada bloque, el número de puntos de control 
+   (4 bytes) seguido de los puntos (4 bytes cada uno). El punto i es el bit del contenido del bloque en el que empieza 
+   el byte original (i+1)*N del bloque. Como los códigos de un bloque son fijos, es todo lo que necesita el 
+   decodificador para empezar a decodificar en ese punto.
+ - Los 12 últimos bytes son la posición del directorio (8 bytes) y el número de bloques (4 bytes).
+"""
+
+""" Entropía en bits por byte de un histograma: el número medio de bits por byte por debajo del cual no puede bajar 
+    ningún código que asigne a cada byte un número entero de bits, como el de Huffman. """
+def entropia(cuentas):
+    total = float(sum(cuentas))
+    bits = 0.0
+    for cuenta in cuentas:
+        if cuenta:
+            bits -= cuenta * math.log(cuenta / total, 2)
+    return bits / total
+
+""" Lee la longitud del cuerpo de un bloque y el cuerpo. Devuelve el cuerpo y su marca: BLOQUE_ALMACENADO, 
+    BLOQUE_REPETIDO, BLOQUE_LZ o 0 si es un bloque comprimido con su propia tabla. """
+def leer_cuerpo(archivo_comprimido):
+    len_cuerpo = bytes4_to_int(archivo_comprimido.read(4))
+    marca = len_cuerpo & MARCAS_BLOQUE
+    return archivo_comprimido.read(len_cuerpo & ~marca), marca
+
+""" Longitud del cuerpo de un bloque con su marca en los bits altos, en 4 bytes, como la lee leer_cuerpo. """
+def longitud_cuerpo(cuerpo, marca):
+    if len(cuerpo) >= LONGITUD_CUERPO_MAX:
+        raise ValueError("El cuerpo de un bloque ocupa %d bytes y el formato solo admite menos de %d; use un tamaño de "
+                         "bloque (-b) menor" % (len(cuerpo), LONGITUD_CUERPO_MAX))
+    return int_to_4bytes(len(cuerpo) | marca)
+
+""" Número de bits que ocupan los datos de un histograma codificados con las longitudes de código indicadas, o None 
+    si algún byte presente no tiene código. """
+def bits_codificados(longitudes, cuentas):
+    bits = 0
+    for valor in range(256):
+        if cuentas[valor]:
+            if chr(valor) not in longitudes:
+                return None
+            bits += cuentas[valor] * longitudes[chr(valor)]
+    return bits
+
+""" Longitudes de los códigos canónicos de un bloque a partir de su histograma, limitadas a long_max bits si no es 
+    None. """
+def longitudes_bloque(cuentas, primeras, long_max=None):
+    compresor = CompresorHuffman(None)
+    arbol_huffman = compresor.construir_arbol(frecuencias_histograma(cuentas, primeras))
+    tabla_codigos = compresor.generar_codigos(arbol_huffman)
+    if long_max is not None:
+        arbol_huffman, tabla_codigos = compresor.limitar_longitud(arbol_huffman, tabla_codigos, long_max)
+    return longitudes_codigos(tabla_codigos)
+
+""" 
+    Comprime un bloque de datos y devuelve su cuerpo, los puntos de control del índice cada intervalo bytes (si 
+    intervalo no es None) y la marca del bloque:
+     - Si no se indican las longitudes de los códigos, el bloque usa su propia tabla de códigos canónicos, limitados a 
+       long_max bits si no es None. Se guarda sin comprimir (marca BLOQUE_ALMACENADO, y el cuerpo son los propios 
+       datos) si su entropía indica que no se puede comprimir, sin llegar a construir el árbol, o si el cuerpo 
+       comprimido no es menor que los datos.
+     - Si se indican, se codifica con ellas. Si además se indica origen, el número del bloque del que son, el cuerpo 
+       empieza por ese número en lugar de por las longitudes (marca BLOQUE_REPETIDO).
+    Si entrelazado es True, el contenido se reparte en flujos intercalados (ver codificar_entrelazado) y se añade la 
+    marca BLOQUE_ENTRELAZADO; estos bloques no tienen puntos de control.
+"""
+def comprimir_bloque(datos, long_max=None, intervalo=None, longitudes=None, origen=None, entrelazado=False):
+    if longitudes is None:
+        cuentas, primeras = histograma_bloque(datos)
+        if entropia(cuentas) >= ENTROPIA_ALMACENADO:
+            return datos, [], BLOQUE_ALMACENADO
+        longitudes = longitudes_bloque(cuentas, primeras, long_max)
+
+    tabla_enteros = CompresorHuffman.codigos_enteros(codigos_canonicos(longitudes))
+    if entrelazado:
+        content = codificar_entrelazado(datos, tabla_enteros)
+        marca = BLOQUE_ENTRELAZADO
+    else:
+        content, buffer_bits, n_bits = CompresorHuffman.elegir_codificador(tabla_enteros)(datos, tabla_enteros)
+
+        # Completar el último byte con ceros
+        if n_bits:
+            content += int_to_1byte(buffer_bits << (8 - n_bits))
+        marca = 0
+
+    # Bits que ocupan los códigos de cada tramo de intervalo bytes, traduciendo cada byte a la longitud de su código
+    puntos = []
+    if intervalo is not None and not entrelazado:
+        tabla_longitudes = ''.join([chr(longitudes.get(chr(byte), 0)) for byte in range(256)])
+        bits = 0
+        for inicio in range(intervalo, len(datos), intervalo):
+            bits += sum(map(ord, datos[inicio - intervalo:inicio].translate(tabla_longitudes)))
+            puntos.append(bits)
+
+    if origen is not None:
+        return int_to_4bytes(origen) + content, puntos, BLOQUE_REPETIDO | marca
+
+    cuerpo = bits_to_bytes(serializar_longitudes(longitudes)) + content
+    if len(cuerpo) >= len(datos):
+        return datos, [], BLOQUE_ALMACENADO
+    return cuerpo, puntos, marca
+
+'''
+    Codifica los datos con la tabla en FLUJOS_ENTRELAZADOS flujos independientes: el byte i va al flujo 
+    i % FLUJOS_ENTRELAZADOS. Devuelve una tabla de saltos con el número de bits de cada flujo (4 bytes por flujo) 
+    seguida de los flujos, cada uno completado con ceros hasta el siguiente byte. Como cada flujo empieza en un byte 
+    conocido, el descompresor puede decodificarlos por separado o repartirlos entre procesos.
+'''
+def codificar_entrelazado(datos, tabla_enteros):
+    codificador = CompresorHuffman.elegir_codificador(tabla_enteros)
+    saltos = []
+    flujos = []
+    for flujo in range(FLUJOS_ENTRELAZADOS):
+        content, buffer_bits, n_bits = codificador(datos[flujo::FLUJOS_ENTRELAZADOS], tabla_enteros)
+        saltos.append(int_to_4bytes(len(content) * 8 + n_bits))
+        if n_bits:
+            content += int_to_1byte(buffer_bits << (8 - n_bits))
+        flujos.append(content)
+    return ''.join(saltos) + ''.join(flujos)
+
+""" Separa los flujos de un contenido entrelazado a partir de su tabla de saltos y devuelve una lista de tuplas 
+    (bytes del flujo, número de bits). """
+def separar_flujos(content):
+    flujos = []
+    inicio = 4 * FLUJOS_ENTRELAZADOS
+    for flujo in range(FLUJOS_ENTRELAZADOS):
+        total_bits = bytes4_to_int(content[4 * flujo:4 * flujo + 4])
+        fin = inicio + (total_bits + 7) // 8
+        flujos.append((content[inicio:fin], total_bits))
+        inicio = fin
+    return flujos
+
+""" Convierte el cuerpo de un bloque entrelazado de longitud original longitud en los cuerpos de bloques normales 
+    (longitudes serializadas y contenido) de cada uno de sus flujos, junto con la longitud original de cada flujo, 
+    para que se puedan descomprimir por separado con descomprimir_bloque. """
+def cuerpos_flujos(cuerpo, longitud):
+    lector = StringIO(cuerpo)
+    leer_longitudes(lector)
+    serializadas = cuerpo[:lector.tell()]
+    flujos = separar_flujos(cuerpo[lector.tell():])
+    return [(serializadas + flujos[flujo][0], len(xrange(flujo, longitud, FLUJOS_ENTRELAZADOS)))
+            for flujo in range(len(flujos))]
+
+""" Vuelve a intercalar los bytes decodificados de cada flujo en su orden original. """
+def intercalar_flujos(partes):
+    salida = [None] * sum(map(len, partes))
+    for flujo in range(len(partes)):
+        salida[flujo::len(partes)] = partes[flujo]
+    return ''.join(salida)
+
+""" Último decodificador construido al descomprimir una serie de bloques, junto con las longitudes serializadas de 
+    las que procede, para no volver a construirlo en los bloques que repiten la tabla. Cada serie de bloques usa el 
+    suyo, de manera que varias descompresiones pueden ejecutarse a la vez en distintos hilos. """
+class UltimoDecodificador:
+    def __init__(self):
+        self.serializadas = None
+        self.decodificador = None
+
+    """ Devuelve el decodificador de las longitudes, construyéndolo solo si no procede de las mismas longitudes 
+        serializadas que el anterior. """
+    def obtener(self, serializadas, longitudes):
+        if self.serializadas != serializadas:
+            self.decodificador = DecodificadorHuffman(codigos_canonicos(longitudes))
+            self.serializadas = serializadas
+        return self.decodificador
+
+""" Descomprime el cuerpo de un bloque de longitud original longitud y devuelve sus datos originales. Los bloques que 
+    repiten la tabla de otro deben llegar con el número del bloque de origen ya sustituido por las longitudes 
+    serializadas de su tabla. Si se indica ultimo (un UltimoDecodificador), se reutiliza su decodificador cuando la 
+    tabla es la misma. """
+def descomprimir_bloque(cuerpo, marca, longitud, ultimo=None):
+    if ultimo is None:
+        ultimo = UltimoDecodificador()
+    if marca == BLOQUE_ALMACENADO:
+        return cuerpo
+    if marca == BLOQUE_LZ:
+        return descomprimir_bloque_lz(cuerpo)
+    if marca == BLOQUE_CONTEXTO:
+        return descomprimir_bloque_contexto(cuerpo)
+    if marca == BLOQUE_ENTRELAZADO:
+        return intercalar_flujos([descomprimir_bloque(flujo, 0, longitud_flujo, ultimo)
+                                  for flujo, longitud_flujo in cuerpos_flujos(cuerpo, longitud)])
+
+    lector = StringIO(cuerpo)
+    longitudes = leer_longitudes(lector)
+    decodificador = ultimo.obtener(cuerpo[:lector.tell()], longitudes)
+    return decodificador.decodificar_longitud(buffer(cuerpo, lector.tell()), longitud)
+
+# Versión de comprimir_bloque que recibe sus argumentos en una tupla, para repartirla entre los procesos del pool
+def comprimir_bloque_tarea(tarea):
+    return comprimir_bloque(*tarea)
+
+# Versión de descomprimir_bloque que recibe sus argumentos en una tupla, para repartirla entre los procesos del pool
+def descomprimir_bloque_tarea(tarea):
+    return descomprimir_bloque(*tarea)
+
+""" 
+    Descomprime un lote de bloques (tuplas de cuerpo, marca y longitud original) y devuelve sus datos en orden. Sin 
+    pool, los bloques se descomprimen seguidos con un mismo UltimoDecodificador. Con pool, cada proceso construye el de 
+    su bloque, y los flujos de los bloques entrelazados se reparten entre los procesos como bloques independientes y se 
+    vuelven a intercalar al recibirlos, de manera que incluso un único bloque se decodifica en paralelo. 
+"""
+def descomprimir_lote(pool, lote):
+    if pool is None:
+        ultimo = UltimoDecodificador()
+        return [descomprimir_bloque(cuerpo, marca, longitud, ultimo) for cuerpo, marca, longitud in lote]
+
+    tareas = []
+    flujos = [] # Número de flujos de cada bloque, o None si no es entrelazado
+    for cuerpo, marca, longitud in lote:
+        if marca == BLOQUE_ENTRELAZADO:
+            partes = cuerpos_flujos(cuerpo, longitud)
+            tareas.extend([(parte, 0, longitud_parte) for parte, longitud_parte in partes])
+            flujos.append(len(partes))
+        else:
+            tareas.append((cuerpo, marca, longitud))
+            flujos.append(None)
+    resultados = pool.map(descomprimir_bloque_tarea, tareas, 1)
+
+    salida = []
+    i = 0
+    for n in flujos:
+        if n is None:
+            salida.append(resultados[i])
+            i += 1
+        else:
+            salida.append(intercalar_flujos(resultados[i:i + n]))
+            i += n
+    return salida
+
+""" Crea el pool de procesos para el número de trabajos indicado, o None si se deben procesar en este proceso. """
+def crear_pool(trabajos):
+    if trabajos > 1 and multiprocessing is not None:
+        return multiprocessing.Pool(trabajos)
+    return None
+
+""" Aplica la función a cada tarea, en el pool de procesos si lo hay, y devuelve los resultados en orden. """
+def aplicar(pool, funcion, tareas):
+    if pool is None:
+        return [funcion(tarea) for tarea in tareas]
+    return pool.map(funcion, tareas)
+
+""" Clase encargada de comprimir un archivo en el formato por bloques, repartiendo los bloques entre un pool de procesos. 
+    Los bloques se leen por lotes de dos por proceso, de manera que la memoria utilizada no depende del tamaño del 
+    archivo, y se escriben en su orden original. """
+class CompresorBloques:
+    def __init__(self, ruta_archivo, tam_bloque=TAM_BUFFER, long_max=None, trabajos=1, intervalo=None, nivel=None,
+                 ventana=VENTANA_LZ, tablas_contexto=None, entrelazado=False):
+        self.ruta_archivo = ruta_archivo # Ruta del archivo de entrada
+        self.tam_bloque = tam_bloque     # Número de bytes de cada bloque
+        self.long_max = long_max         # Longitud máxima de los códigos, o None si no se limita
+        self.trabajos = trabajos         # Número de procesos que comprimen bloques en paralelo
+        self.intervalo = intervalo       # Bytes entre puntos de control del índice, o None si no se genera
+        self.nivel = nivel               # Nivel de LZ77 (1 a 9) aplicado a cada bloque, o None si no se aplica
+        self.ventana = ventana           # Distancia máxima de las coincidencias de LZ77
+        self.tablas_contexto = tablas_contexto # Tablas del modelo de orden 1, o None si no se usa
+        self.entrelazado = entrelazado   # Si los bloques se codifican en flujos intercalados
+
+    def comprimir_archivo(self, ruta_archivo_comprimido, prefijo='', verificador=None):
+        archivo = open(self.ruta_archivo, 'rb')
+        archivo_comprimido = open(ruta_archivo_comprimido, 'wb')
+        archivo_comprimido.write(prefijo + MAGICO + int_to_1byte(VERSION_BLOQUES) + int_to_4bytes(self.tam_bloque))
+
+        posiciones = [] # Posición de cada bloque en el archivo comprimido
+        indice = []     # Puntos de control de cada bloque
+        longitud = 0    # Longitud original de todos los bloques
+        self.longitudes_anteriores = None # Longitudes del último bloque con tabla propia
+        self.cabecera_anterior = 0        # Bytes que ocupan esas longitudes serializadas
+        self.origen = None                # Número de ese bloque
+        pool = crear_pool(self.trabajos)
+        try:
+            lote = []
+            n_bloque = 0
+            inicio = time.time()
+            bloque = archivo.read(self.tam_bloque)
+            funcion = comprimir_bloque_tarea
+            if self.nivel is not None: funcion = comprimir_bloque_lz_tarea
+            elif self.tablas_contexto is not None: funcion = comprimir_bloque_contexto_tarea
+            while bloque:
+                if verificador is not None:
+                    verificador.write(bloque)
+                inicio = estadisticas.sumar('lectura', inicio)
+                if self.nivel is not None:
+                    lote.append((bloque, self.nivel, self.ventana, self.long_max))
+                elif self.tablas_contexto is not None:
+                    lote.append((bloque, self.tablas_contexto, self.long_max))
+                else:
+                    lote.append(self.elegir_tabla(bloque, n_bloque))
+                    inicio = estadisticas.sumar('elegir_tabla', inicio)
+                n_bloque += 1
+                bloque = archivo.read(self.tam_bloque)
+                if len(lote) == 2 * self.trabajos or not bloque:
+                    inicio = estadisticas.sumar('lectura', inicio)
+                    resultados = aplicar(pool, funcion, lote)
+                    inicio = estadisticas.sumar('codificacion', inicio)
+                    for tarea, (cuerpo, puntos, marca) in zip(lote, resultados):
+                        posiciones.append(archivo_comprimido.tell())
+                        indice.append(puntos)
+                        archivo_comprimido.write(int_to_4bytes(len(tarea[0])) + longitud_cuerpo(cuerpo, marca) + cuerpo)
+                        longitud += len(tarea[0])
+                    inicio = estadisticas.sumar('escritura', inicio)
+                    lote = []
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        archivo.close()
+
+        # Marca de fin de bloques, directorio y posición del directorio
+        archivo_comprimido.write(int_to_4bytes(0))
+        pos_directorio = archivo_comprimido.tell()
+        archivo_comprimido.write(int_to_8bytes(longitud))
+        archivo_comprimido.write(''.join([struct.pack('>Q', posicion) for posicion in posiciones]))
+        if self.intervalo is not None:
+            archivo_comprimido.write(int_to_4bytes(self.intervalo))
+            for puntos in indice:
+                archivo_comprimido.write(int_to_4bytes(len(puntos)) + ''.join([int_to_4bytes(punto) for punto in puntos]))
+        archivo_comprimido.write(struct.pack('>QI', pos_directorio, len(posiciones)))
+        archivo_comprimido.close()
+
+    '''
+        Decide en este proceso, a partir del histograma del bloque n_bloque, con qué tabla se codifica, y devuelve la 
+        tarea de comprimir_bloque correspondiente. Se compara el tamaño del bloque codificado con la tabla del último 
+        bloque que tenía tabla propia (4 bytes con el número de ese bloque más el contenido) con el de una tabla nueva:
+         - Si repetir la tabla no ocupa más que la estimación de una tabla nueva (la entropía del bloque, que es una 
+           cota inferior del contenido, más lo que ocupaban las longitudes de la tabla anterior), se repite sin llegar 
+           a construir el árbol.
+         - Si no, se construye la tabla nueva y se elige la opción que ocupe menos, o guardar el bloque sin comprimir.
+        La codificación, que es la parte costosa, se sigue haciendo en paralelo en el pool.
+    '''
+    def elegir_tabla(self, datos, n_bloque):
+        cuentas, primeras = histograma_bloque(datos)
+        bits_por_byte = entropia(cuentas)
+        if bits_por_byte >= ENTROPIA_ALMACENADO:
+            return (datos, self.long_max, self.intervalo, None, None, self.entrelazado)
+
+        coste_repetir = None
+        if self.longitudes_anteriores is not None:
+            bits = bits_codificados(self.longitudes_anteriores, cuentas)
+            if bits is not None:
+                coste_repetir = 4 + (bits + 7) // 8
+        if coste_repetir is not None and coste_repetir <= bits_por_byte * len(datos) / 8 + self.cabecera_anterior:
+            return (datos, self.long_max, self.intervalo, self.longitudes_anteriores, self.origen, self.entrelazado)
+
+        longitudes = longitudes_bloque(cuentas, primeras, self.long_max)
+        cabecera = len(bits_to_bytes(serializar_longitudes(longitudes)))
+        coste_nuevo = cabecera + (bits_codificados(longitudes, cuentas) + 7) // 8
+        if coste_repetir is not None and coste_repetir <= coste_nuevo and coste_repetir < len(datos):
+            return (datos, self.long_max, self.intervalo, self.longitudes_anteriores, self.origen, self.entrelazado)
+        if coste_nuevo >= len(datos):
+            return (datos, self.long_max, self.intervalo, None, None, self.entrelazado)
+
+        self.longitudes_anteriores = longitudes
+        self.cabecera_anterior = cabecera
+        self.origen = n_bloque
+        return (datos, self.long_max, self.intervalo, longitudes, None, self.entrelazado)
+
+""" Clase encargada de descomprimir un archivo en el formato por bloques, repartiendo los bloques entre un pool de 
+    procesos. Los bloques se leen por lotes de dos por proceso y se escriben en su orden original. """
+class DescompresorBloques:
+    def __init__(self, ruta_archivo_comprimido, trabajos=1, inicio=0):
+        self.ruta_archivo_comprimido = ruta_archivo_comprimido
+        self.trabajos = trabajos # Número de procesos que descomprimen bloques en paralelo
+        self.inicio = inicio     # Posición de la cabecera (tras la de VERSION_VERIFICADA, si la hay)
+
+    """ Descomprime el archivo entero y escribe los datos en salida si se indica, o en el archivo con el nombre 
+        original. """
+    def descomprimir_archivo(self, salida=None):
+        archivo_comprimido = open(self.ruta_archivo_comprimido, 'rb')
+        archivo_comprimido.seek(self.inicio + len(MAGICO) + 1 + 4) # Identificador del formato y tamaño de bloque
+
+        archivo_descomprimido = salida
+        if salida is None:
+            nombre_archivo, _ = os.path.splitext(self.ruta_archivo_comprimido)
+            archivo_descomprimido = open(nombre_archivo, 'wb')
+
+        self.descomprimir_bloques(archivo_comprimido, archivo_descomprimido)
+
+        archivo_comprimido.close()
+        if salida is None:
+            archivo_descomprimido.close()
+
+    """ Descomprime los bloques leídos de archivo_comprimido, situado justo después de la cabecera, y escribe los 
+        datos en salida. """
+    def descomprimir_bloques(self, archivo_comprimido, archivo_descomprimido):
+        tablas = {} # Longitudes serializadas de los bloques con tabla propia, por número de bloque
+        pool = crear_pool(self.trabajos)
+        try:
+            lote = []
+            n_bloque = 0
+            inicio = time.time()
+            len_original = bytes4_to_int(archivo_comprimido.read(4))
+            while len_original:
+                cuerpo, marca = leer_cuerpo(archivo_comprimido)
+                lote.append(self.resolver_tabla(cuerpo, marca, n_bloque, tablas) + (len_original,))
+                n_bloque += 1
+                len_original = bytes4_to_int(archivo_comprimido.read(4))
+                if len(lote) == 2 * self.trabajos or not len_original:
+                    inicio = estadisticas.sumar('lectura', inicio)
+                    resultados = descomprimir_lote(pool, lote)
+                    inicio = estadisticas.sumar('decodificacion', inicio)
+                    for content in resultados:
+                        archivo_descomprimido.write(content)
+                    inicio = estadisticas.sumar('escritura', inicio)
+                    lote = []
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    """ Longitud original de todos los bloques, leída del directorio. Lanza ValueError si no corresponde a su número de 
+        bloques: todos tienen el tamaño de bloque salvo el último, que puede ser menor. """
+    def longitud_original(self):
+        archivo_comprimido = open(self.ruta_archivo_comprimido, 'rb')
+        tam_bloque, longitud, posiciones, _, _ = self.leer_directorio(archivo_comprimido)
+        archivo_comprimido.close()
+        if not (len(posiciones) - 1) * tam_bloque < longitud <= len(posiciones) * tam_bloque:
+            raise ValueError("La longitud original del directorio (%d bytes) no corresponde a sus %d bloques" %
+                             (longitud, len(posiciones)))
+        return longitud
+
+    """ Prepara el cuerpo del bloque n_bloque para descomprimir_bloque: guarda en tablas las longitudes serializadas de 
+        los bloques con tabla propia y, en los que repiten la de otro, sustituye el número del bloque de origen por 
+        ellas. """
+    def resolver_tabla(self, cuerpo, marca, n_bloque, tablas):
+        if marca & BLOQUE_REPETIDO:
+            return tablas[bytes4_to_int(cuerpo[:4])] + cuerpo[4:], marca & ~BLOQUE_REPETIDO
+        if marca & ~BLOQUE_ENTRELAZADO == 0:
+            lector = StringIO(cuerpo)
+            leer_longitudes(lector)
+            tablas[n_bloque] = cuerpo[:lector.tell()]
+        return cuerpo, marca
+
+    """ Devuelve las longitudes serializadas de la tabla del bloque que empieza en la posición indicada. """
+    def leer_tabla(self, archivo_comprimido, posicion):
+        archivo_comprimido.seek(posicion + 8)
+        leer_longitudes(archivo_comprimido)
+        fin = archivo_comprimido.tell()
+        archivo_comprimido.seek(posicion + 8)
+        return archivo_comprimido.read(fin - posicion - 8)
+
+    '''
+        Lee el directorio del archivo comprimido y devuelve el tamaño de bloque, la longitud original de todos los 
+        bloques, la posición de cada uno y, si el archivo tiene índice, su intervalo y los puntos de control de cada 
+        bloque (None y [] en otro caso).
+    '''
+    def leer_directorio(self, archivo_comprimido):
+        archivo_comprimido.seek(self.inicio + len(MAGICO) + 1)
+        tam_bloque = bytes4_to_int(archivo_comprimido.read(4))
+
+        archivo_comprimido.seek(-12, 2)
+        fin_directorio = archivo_comprimido.tell()
+        pos_directorio, n_bloques = struct.unpack('>QI', archivo_comprimido.read(12))
+        if pos_directorio + 8 + 8 * n_bloques > fin_directorio:
+            raise ValueError("El directorio de bloques del archivo comprimido está dañado")
+
+        archivo_comprimido.seek(pos_directorio)
+        longitud = bytes8_to_int(archivo_comprimido.read(8))
+        posiciones = list(struct.unpack('>%dQ' % n_bloques, archivo_comprimido.read(8 * n_bloques)))
+
+        intervalo = None
+        indice = []
+        if archivo_comprimido.tell() < fin_directorio:
+            intervalo = bytes4_to_int(archivo_comprimido.read(4))
+            for i in range(n_bloques):
+                n_puntos = bytes4_to_int(archivo_comprimido.read(4))
+                indice.append(list(struct.unpack('>%dI' % n_puntos, archivo_comprimido.read(4 * n_puntos))))
+        return tam_bloque, longitud, posiciones, intervalo, indice
+
+    '''
+        Descomprime solo los bytes [inicio, inicio + longitud) del archivo original y los devuelve. Se recorren únicamente 
+        los bloques que contienen el rango y, dentro de cada uno, se empieza a decodificar en el punto de control 
+        anterior al rango y se termina en el siguiente, de manera que el tiempo es proporcional a la longitud del rango 
+        (más el intervalo del índice) y no al tamaño del archivo.
+    '''
+    def descomprimir_rango(self, inicio, longitud):
+        archivo_comprimido = open(self.ruta_archivo_comprimido, 'rb')
+        tam_bloque, _, posiciones, intervalo, indice = self.leer_directorio(archivo_comprimido)
+
+        salida = []
+        fin = inicio + longitud
+        n_bloque = inicio // tam_bloque
+        while n_bloque < len(posiciones) and n_bloque * tam_bloque < fin:
+            archivo_comprimido.seek(posiciones[n_bloque])
+            len_original = bytes4_to_int(archivo_comprimido.read(4))
+            len_cuerpo = bytes4_to_int(archivo_comprimido.read(4))
+            fin_cuerpo = archivo_comprimido.tell() + (len_cuerpo & ~MARCAS_BLOQUE)
+
+            # Rango dentro del bloque
+            inicio_bloque = max(inicio - n_bloque * tam_bloque, 0)
+            fin_bloque = min(fin - n_bloque * tam_bloque, len_original)
+
+            # Los bloques guardados sin comprimir se leen directamente, y los de LZ77 o por contexto se descomprimen enteros
+            if len_cuerpo & BLOQUE_ALMACENADO:
+                archivo_comprimido.seek(inicio_bloque, 1)
+                salida.append(archivo_comprimido.read(fin_bloque - inicio_bloque))
+                n_bloque += 1
+                continue
+            if len_cuerpo & (BLOQUE_LZ | BLOQUE_CONTEXTO | BLOQUE_ENTRELAZADO):
+                cuerpo = archivo_comprimido.read(fin_cuerpo - archivo_comprimido.tell())
+                marca = len_cuerpo & MARCAS_BLOQUE
+                if marca & BLOQUE_REPETIDO:
+                    cuerpo = self.leer_tabla(archivo_comprimido, posiciones[bytes4_to_int(cuerpo[:4])]) + cuerpo[4:]
+                    marca &= ~BLOQUE_REPETIDO
+                salida.append(descomprimir_bloque(cuerpo, marca, len_original)[inicio_bloque:fin_bloque])
+                n_bloque += 1
+                continue
+
+            # Cabecera del bloque; si repite la tabla de otro bloque, se lee la de ese
+            if len_cuerpo & BLOQUE_REPETIDO:
+                origen = bytes4_to_int(archivo_comprimido.read(4))
+                pos_contenido = archivo_comprimido.tell()
+                archivo_comprimido.seek(posiciones[origen] + 8)
+                tabla_char_codigo = codigos_canonicos(leer_longitudes(archivo_comprimido))
+            else:
+                tabla_char_codigo = codigos_canonicos(leer_longitudes(archivo_comprimido))
+                pos_contenido = archivo_comprimido.tell()
+
+            # Los bits de relleno del último byte también se decodifican; los bytes que producen quedan fuera del rango
+            total_bits = (fin_cuerpo - pos_contenido) * 8
+
+            # Puntos de control entre los que está el rango (el byte 0 empieza en el bit 0)
+            puntos = [0]
+            paso = len_original
+            if intervalo is not None:
+                puntos += indice[n_bloque]
+                paso = intervalo
+            primero = min(inicio_bloque // paso, len(puntos) - 1)
+            ultimo = (fin_bloque - 1) // paso + 1
+            bit_inicial = puntos[primero]
+            bit_final = total_bits
+            if ultimo < len(puntos):
+                bit_final = puntos[ultimo]
+
+            # Leemos solo los bytes del contenido entre ambos puntos y los decodificamos
+            archivo_comprimido.seek(pos_contenido + bit_inicial // 8)
+            datos = archivo_comprimido.read((bit_final + 7) // 8 - bit_inicial // 8)
+            decodificador = DecodificadorHuffman(tabla_char_codigo)
+            content, _ = decodificador.decodificar(datos, bit_final - bit_inicial, bit_inicial % 8)
+
+            desplazamiento = primero * paso
+            salida.append(content[inicio_bloque - desplazamiento:fin_bloque - desplazamiento])
+            n_bloque += 1
+
+        archivo_comprimido.close()
+        return ''.join(salida)
+
+
+"""
+LZ77. Opcionalmente, cada bloque del formato por bloques pasa antes de Huffman por un buscador de coincidencias con 
+cadenas de posiciones (como DEFLATE): el bloque se convierte en una secuencia de (literales, coincidencia), donde cada 
+coincidencia copia 'longitud' bytes que empiezan 'distancia' bytes antes, dentro de la ventana. Como en los formatos 
+con secuencias separadas, los símbolos se agrupan en flujos homogéneos que se codifican con la maquinaria de Huffman 
+existente (comprimir_bloque, con su tabla propia o guardados sin comprimir), de manera que también se decodifican con 
+las tablas de k bits:
+ - Literales: los bytes que no forman parte de ninguna coincidencia.
+ - Códigos de las longitudes de las series de literales, de las longitudes de las coincidencias (menos LZ_MIN) y de las 
+   distancias (menos 1), un byte por secuencia en cada flujo. Cada valor se representa con un código y unos bits 
+   extra, como en DEFLATE (ver codigo_lz).
+ - Bits extra de todas las secuencias.
+Los literales que quedan tras la última coincidencia son los que sobran en el flujo de literales. El cuerpo del bloque 
+son los cinco flujos, cada uno con su longitud original (4 bytes), la longitud de su cuerpo con su marca (4 bytes) y su 
+cuerpo.
+"""
+
+""" Código de un valor de LZ77 y sus bits extra, en forma (código, valor extra, número de bits extra). Los valores 
+    menores que 8 son su propio código; el resto se agrupan por su bit más alto k y el siguiente, con k - 1 bits extra. """
+def codigo_lz(valor):
+    if valor < 8:
+        return valor, 0, 0
+    k = 3
+    while valor >> (k + 1):
+        k += 1
+    return 8 + 2 * (k - 3) + ((valor >> (k - 1)) & 1), valor & ((1 << (k - 1)) - 1), k - 1
+
+""" Valor de LZ77 a partir de su código, leyendo sus bits extra del lector. """
+def valor_lz(codigo, lector_bits):
+    if codigo < 8:
+        return codigo
+    k = (codigo - 8) // 2 + 3
+    return ((2 | ((codigo - 8) & 1)) << (k - 1)) | lector_bits.leer(k - 1)
+
+""" Escritor de un flujo de bits, de más a menos significativo, con los bits del último byte completados con ceros. """
+class EscritorBits:
+    def __init__(self):
+        self.partes = []    # Bytes completos
+        self.buffer_bits = 0
+        self.n_bits = 0
+
+    def escribir(self, valor, longitud):
+        self.buffer_bits = (self.buffer_bits << longitud) | valor
+        self.n_bits += longitud
+        while self.n_bits >= 8:
+            self.n_bits -= 8
+            self.partes.append(chr(self.buffer_bits >> self.n_bits))
+            self.buffer_bits &= (1 << self.n_bits) - 1
+
+    def contenido(self):
+        if self.n_bits:
+            return ''.join(self.partes) + chr(self.buffer_bits << (8 - self.n_bits))
+        return ''.join(self.partes)
+
+""" Lector de un flujo de bits escrito con EscritorBits. """
+class LectorBits:
+    def __init__(self, datos):
+        self.datos = datos
+        self.pos = 0
+        self.buffer_bits = 0
+        self.n_bits = 0
+
+    def leer(self, longitud):
+        while self.n_bits < longitud:
+            self.buffer_bits = (self.buffer_bits << 8) | ord(self.datos[self.pos])
+            self.pos += 1
+            self.n_bits += 8
+        self.n_bits -= longitud
+        valor = self.buffer_bits >> self.n_bits
+        self.buffer_bits &= (1 << self.n_bits) - 1
+        return valor
+
+""" Longitud del prefijo común de datos[a:] y datos[b:], con a < b, sabiendo que es al menos conocida y sin pasar de 
+    maximo. Se comparan tramos de 32 bytes de una vez y después byte a byte. """
+def longitud_comun(datos, a, b, conocida, maximo):
+    longitud = conocida
+    while longitud + 32 <= maximo and datos[a + longitud:a + longitud + 32] == datos[b + longitud:b + longitud + 32]:
+        longitud += 32
+    while longitud < maximo and datos[a + longitud] == datos[b + longitud]:
+        longitud += 1
+    return longitud
+
+""" 
+    Busca las coincidencias de LZ77 de un bloque y devuelve la lista de secuencias (número de literales, longitud de la 
+    coincidencia, distancia). Las posiciones anteriores con los mismos LZ_MIN bytes se encadenan: 'cabezas' guarda la 
+    última posición de cada grupo de LZ_MIN bytes y 'anteriores' la anterior posición con los mismos bytes, por lo que 
+    todos los candidatos de la cadena coinciden al menos en LZ_MIN bytes. El nivel indica cuántos candidatos se prueban.
+"""
+def buscar_coincidencias(datos, nivel, ventana):
+    cadena_max, suficiente, insertar = NIVELES_LZ[nivel]
+    cabezas = {}
+    anteriores = [-1] * len(datos)
+    secuencias = []
+
+    limite = len(datos) - LZ_MIN + 1 # Última posición en la que puede empezar una coincidencia, más uno
+    inicio_literales = 0
+    i = 0
+    while i < limite:
+        clave = datos[i:i + LZ_MIN]
+        candidato = cabezas.get(clave, -1)
+        anteriores[i] = candidato
+        cabezas[clave] = i
+
+        mejor_longitud = 0
+        mejor_distancia = 0
+        maximo = min(LZ_MAX, len(datos) - i)
+        intentos = cadena_max
+        while candidato >= 0 and i - candidato <= ventana and intentos:
+            # Solo puede mejorar si coincide también el byte siguiente a la mejor coincidencia encontrada
+            if mejor_longitud == 0 or (mejor_longitud < maximo and datos[candidato + mejor_longitud] == datos[i + mejor_longitud]):
+                longitud = longitud_comun(datos, candidato, i, LZ_MIN, maximo)
+                if longitud > mejor_longitud:
+                    mejor_longitud = longitud
+                    mejor_distancia = i - candidato
+                    if longitud >= suficiente or longitud == maximo:
+                        break
+            candidato = anteriores[candidato]
+            intentos -= 1
+
+        if mejor_longitud < LZ_MIN:
+            i += 1
+            continue
+
+        secuencias.append((i - inicio_literales, mejor_longitud, mejor_distancia))
+        fin = i + mejor_longitud
+        if insertar:
+            for j in range(i + 1, min(fin, limite)):
+                clave = datos[j:j + LZ_MIN]
+                anteriores[j] = cabezas.get(clave, -1)
+                cabezas[clave] = j
+        i = fin
+        inicio_literales = fin
+
+    return secuencias
+
+# Comprime un flujo con comprimir_bloque y lo devuelve con su longitud original y la de su cuerpo con su marca
+def comprimir_flujo(datos, long_max):
+    if not datos:
+        return int_to_4bytes(0) + int_to_4bytes(0)
+    cuerpo, _, marca = comprimir_bloque(datos, long_max)
+    return int_to_4bytes(len(datos)) + longitud_cuerpo(cuerpo, marca) + cuerpo
+
+# Lee y descomprime n flujos escritos con comprimir_flujo
+def descomprimir_flujos(lector, n):
+    flujos = []
+    for i in range(n):
+        len_original = bytes4_to_int(lector.read(4))
+        cuerpo, marca = leer_cuerpo(lector)
+        if len_original:
+            flujos.append(descomprimir_bloque(cuerpo, marca, len_original))
+        else:
+            flujos.append('')
+    return flujos
+
+""" Comprime un bloque con LZ77 y Huffman, con el nivel y la ventana indicados. Devuelve su cuerpo, sus puntos de 
+    control (ninguno, ya que los bloques LZ77 se descomprimen enteros) y su marca: BLOQUE_LZ si el resultado es menor 
+    que el del bloque comprimido solo con Huffman y, si no, el de comprimir_bloque. Los bloques cuya entropía indica que 
+    no se pueden comprimir y en cuyos primeros MUESTRA_LZ bytes casi no hay coincidencias (menos de 1 byte de cada 256) 
+    se guardan sin recorrerlos enteros. """
+def comprimir_bloque_lz(datos, nivel, ventana=VENTANA_LZ, long_max=None):
+    if entropia(histograma_bloque(datos)[0]) >= ENTROPIA_ALMACENADO:
+        muestra = datos[:MUESTRA_LZ]
+        if 256 * sum([longitud for _, longitud, _ in buscar_coincidencias(muestra, 1, ventana)]) < len(muestra):
+            return datos, [], BLOQUE_ALMACENADO
+
+    literales = []
+    series = []
+    longitudes = []
+    distancias = []
+    extra = EscritorBits()
+
+    posicion = 0
+    for n_literales, longitud, distancia in buscar_coincidencias(datos, nivel, ventana):
+        literales.append(datos[posicion:posicion + n_literales])
+        posicion += n_literales + longitud
+        for flujo, valor in ((series, n_literales), (longitudes, longitud - LZ_MIN), (distancias, distancia - 1)):
+            codigo, valor_extra, n_extra = codigo_lz(valor)
+            flujo.append(chr(codigo))
+            if n_extra: extra.escribir(valor_extra, n_extra)
+    literales.append(datos[posicion:])
+
+    cuerpo = ''.join([comprimir_flujo(''.join(flujo), long_max)
+                      for flujo in (literales, series, longitudes, distancias)]) + \
+             comprimir_flujo(extra.contenido(), long_max)
+
+    # En datos con pocas repeticiones las coincidencias cortas pueden salir más caras que los literales
+    resultado = comprimir_bloque(datos, long_max)
+    if len(cuerpo) < len(resultado[0]):
+        return cuerpo, [], BLOQUE_LZ
+    return resultado
+
+# Versión de comprimir_bloque_lz que recibe sus argumentos en una tupla, para repartirla entre los procesos del pool
+def comprimir_bloque_lz_tarea(tarea):
+    return comprimir_bloque_lz(*tarea)
+
+""" Descomprime el cuerpo de un bloque comprimido con LZ77 y devuelve sus datos originales. """
+def descomprimir_bloque_lz(cuerpo):
+    literales, series, longitudes, distancias, extra = descomprimir_flujos(StringIO(cuerpo), 5)
+    lector_bits = LectorBits(extra)
+
+    salida = array('c')
+    posicion = 0 # Literales ya copiados
+    for k in range(len(series)):
+        n_literales = valor_lz(ord(series[k]), lector_bits)
+        longitud = valor_lz(ord(longitudes[k]), lector_bits) + LZ_MIN
+        distancia = valor_lz(ord(distancias[k]), lector_bits) + 1
+
+        salida.fromstring(literales[posicion:posicion + n_literales])
+        posicion += n_literales
+
+        # Si la coincidencia se solapa con lo que copia, el tramo se repite
+        inicio = len(salida) - distancia
+        if longitud <= distancia:
+            salida.extend(salida[inicio:inicio + longitud])
+        else:
+            tramo = salida[inicio:]
+            salida.extend((tramo * (longitud // distancia + 1))[:longitud])
+    salida.fromstring(literales[posicion:])
+    return salida.tostring()
+
+"""
+Modelo de orden 1. La tabla con la que se codifica cada byte depende del byte anterior (su contexto), lo que aprovecha 
+la estructura del texto que un único árbol no puede capturar. Para que la cabecera no crezca con 256 tablas, los 
+contextos se agrupan en unas pocas tablas compartidas con un algoritmo de tipo k-medias: cada contexto se asigna a la 
+tabla con la que sus bytes ocuparían menos bits, y cada tabla se recalcula con los contextos que tiene asignados.
+Los bytes de cada tabla forman un flujo que se codifica con comprimir_bloque, por lo que se decodifica con las tablas 
+de k bits; al descomprimir, los flujos se vuelven a intercalar siguiendo el byte anterior. El cuerpo del bloque es:
+ - El número de tablas (1 byte) y la tabla de cada uno de los 256 contextos (1 byte cada uno). El contexto del primer 
+   byte del bloque es el byte 0.
+ - El flujo de cada tabla, con su longitud original (4 bytes), la longitud de su cuerpo con su marca (4 bytes) y su 
+   cuerpo.
+"""
+
+""" Cuenta los pares (byte anterior, byte) de un bloque. Devuelve una lista con las 256 cuentas de cada contexto. """
+def histograma_contextos(datos):
+    if numpy is not None:
+        bytes_entrada = numpy.frombuffer(datos, dtype=numpy.uint8).astype(numpy.int64)
+        anteriores = numpy.concatenate(([0], bytes_entrada[:-1]))
+        cuentas = numpy.bincount(anteriores * 256 + bytes_entrada, minlength=65536).tolist()
+        return [cuentas[contexto * 256:(contexto + 1) * 256] for contexto in range(256)]
+
+    matriz = [[0] * 256 for contexto in range(256)]
+    anterior = 0
+    for byte in datos:
+        valor = ord(byte)
+        matriz[anterior][valor] += 1
+        anterior = valor
+    return matriz
+
+""" 
+    Agrupa los contextos de la matriz de cuentas en n_tablas tablas como máximo y devuelve la tabla de cada contexto. 
+    Se empieza con los n_tablas contextos más frecuentes como centros. En cada iteración, el coste de un contexto con 
+    una tabla son los bits que ocuparían sus bytes con las probabilidades de la tabla, suavizadas para que los bytes 
+    que no aparecen en ella no tengan coste infinito.
+"""
+def agrupar_contextos(matriz, n_tablas):
+    totales = [sum(cuentas) for cuentas in matriz]
+    activos = [contexto for contexto in range(256) if totales[contexto]]
+    orden = [(-totales[contexto], contexto) for contexto in activos]
+    orden.sort()
+    centros = [matriz[contexto] for _, contexto in orden[:n_tablas]]
+
+    asignacion = [0] * 256
+    for iteracion in range(ITERACIONES_CONTEXTO):
+        # Bits por byte de cada tabla, con medio byte de más para los que no aparecen
+        costes = []
+        for centro in centros:
+            total = float(sum(centro)) + 128
+            costes.append([-math.log((cuenta + 0.5) / total, 2) for cuenta in centro])
+
+        for contexto in activos:
+            presentes = [(valor, cuenta) for valor, cuenta in enumerate(matriz[contexto]) if cuenta]
+            mejor = None
+            for tabla in range(len(centros)):
+                coste = 0.0
+                for valor, cuenta in presentes:
+                    coste += cuenta * costes[tabla][valor]
+                if mejor is None or coste < mejor:
+                    mejor = coste
+                    asignacion[contexto] = tabla
+
+        # Nuevos centros: la suma de los contextos de cada tabla, descartando las tablas vacías
+        sumas = [[0] * 256 for centro in centros]
+        for contexto in activos:
+            suma = sumas[asignacion[contexto]]
+            for valor, cuenta in enumerate(matriz[contexto]):
+                suma[valor] += cuenta
+        usadas = [tabla for tabla in range(len(centros)) if sum(sumas[tabla])]
+        renumeracion = dict([(tabla, nueva) for nueva, tabla in enumerate(usadas)])
+        asignacion = [renumeracion.get(tabla, 0) for tabla in asignacion]
+        centros = [sumas[tabla] for tabla in usadas]
+
+    return asignacion
+
+""" Separa los bytes de un bloque en un flujo por tabla, según la tabla del contexto de cada uno. """
+def separar_contextos(datos, asignacion, n_tablas):
+    if numpy is not None:
+        bytes_entrada = numpy.frombuffer(datos, dtype=numpy.uint8)
+        tablas = numpy.array(asignacion, dtype=numpy.uint8)[numpy.concatenate(([0], bytes_entrada[:-1]))]
+        return [bytes_entrada[tablas == tabla].tostring() for tabla in range(n_tablas)]
+
+    flujos = [[] for tabla in range(n_tablas)]
+    anterior = 0
+    for byte in datos:
+        flujos[asignacion[anterior]].append(byte)
+        anterior = ord(byte)
+    return [''.join(flujo) for flujo in flujos]
+
+""" Comprime un bloque con el modelo de orden 1, agrupando los contextos en n_tablas tablas como máximo. Devuelve su 
+    cuerpo, sus puntos de control (ninguno, ya que estos bloques se descomprimen enteros) y su marca: BLOQUE_CONTEXTO 
+    si el resultado es menor que el del bloque comprimido con una sola tabla y, si no, el de comprimir_bloque. """
+def comprimir_bloque_contexto(datos, n_tablas=TABLAS_CONTEXTO, long_max=None):
+    resultado = comprimir_bloque(datos, long_max)
+    if resultado[2] == BLOQUE_ALMACENADO:
+        return resultado
+
+    asignacion = agrupar_contextos(histograma_contextos(datos), n_tablas)
+    n_tablas = max(asignacion) + 1
+    cuerpo = int_to_1byte(n_tablas) + ''.join([chr(tabla) for tabla in asignacion]) + \
+             ''.join([comprimir_flujo(flujo, long_max) for flujo in separar_contextos(datos, asignacion, n_tablas)])
+    if len(cuerpo) < len(resultado[0]):
+        return cuerpo, [], BLOQUE_CONTEXTO
+    return resultado
+
+# Versión de comprimir_bloque_contexto que recibe sus argumentos en una tupla, para repartirla entre los procesos del pool
+def comprimir_bloque_contexto_tarea(tarea):
+    return comprimir_bloque_contexto(*tarea)
+
+""" Descomprime el cuerpo de un bloque comprimido con el modelo de orden 1 y devuelve sus datos originales. Cada byte 
+    se toma del flujo de la tabla de su contexto, que es el byte anterior ya descomprimido. """
+def descomprimir_bloque_contexto(cuerpo):
+    lector = StringIO(cuerpo)
+    n_tablas = bytes1_to_int(lector.read(1))
+    asignacion = lector.read(256)
+    flujos = descomprimir_flujos(lector, n_tablas)
+
+    # Para cada byte anterior, la función que devuelve el siguiente byte del flujo de su tabla
+    siguientes = [iter(flujo).next for flujo in flujos]
+    siguiente = {}
+    for contexto in range(256):
+        siguiente[chr(contexto)] = siguientes[ord(asignacion[contexto])]
+
+    salida = []
+    byte = chr(0)
+    for i in xrange(sum([len(flujo) for flujo in flujos])):
+        byte = siguiente[byte]()
+        salida.append(byte)
+    return ''.join(salida)
+
+"""
+Archivo de varios miembros. Los archivos de entrada (o los de los directorios indicados) se comprimen en un único 
+contenedor, dividiéndolos en bloques que se codifican como los del formato por bloques. Los bloques de todos los 
+miembros se reparten entre un pool de procesos, de manera que también los archivos pequeños se comprimen en paralelo:
+ - Cabecera: MAGICO, la versión VERSION_ARCHIVO y el tamaño de bloque (4 bytes).
+ - Los bloques de cada miembro, uno tras otro: su longitud original (4 bytes), la longitud de su cuerpo (4 bytes) y el 
+   cuerpo, igual que en el formato por bloques.
+ - Índice de miembros: para cada uno, la longitud de su nombre (4 bytes), el nombre, su tamaño original (8 bytes), el 
+   número de bloques (4 bytes) y la posición de cada bloque (8 bytes cada una).
+ - Los 12 últimos bytes son la posición del índice (8 bytes) y el número de miembros (4 bytes).
+"""
+
+""" Nombre con el que se guarda un archivo en el contenedor: su ruta relativa con '/' como separador, sin componentes 
+    vacíos, '.' ni '..', para que al extraerlo no se pueda escribir fuera del directorio de destino. """
+def nombre_miembro(ruta):
+    return '/'.join([parte for parte in os.path.normpath(ruta).split(os.sep) if parte not in ('', '.', '..')])
+
+""" Nombres que aparecen más de una vez en la lista, en el orden de su primera repetición. """
+def nombres_repetidos(nombres):
+    vistos = {}
+    repetidos = []
+    for nombre in nombres:
+        if nombre in vistos and nombre not in repetidos:
+            repetidos.append(nombre)
+        vistos[nombre] = True
+    return repetidos
+
+""" Devuelve las rutas de los archivos indicados, sustituyendo cada directorio por los archivos que contiene 
+    (recursivamente y en orden alfabético). """
+def listar_miembros(rutas):
+    archivos = []
+    for ruta in rutas:
+        if not os.path.isdir(ruta):
+            archivos.append(ruta)
+            continue
+        for raiz, directorios, nombres in os.walk(ruta):
+            directorios.sort()
+            nombres.sort()
+            archivos.extend([os.path.join(raiz, nombre) for nombre in nombres])
+    return archivos
+
+""" Clase encargada de comprimir varios archivos en un contenedor, repartiendo sus bloques entre un pool de procesos. 
+    Los bloques se leen por lotes de dos por proceso y se escriben en su orden original. """
+class CompresorArchivo:
+    def __init__(self, rutas, tam_bloque=TAM_BUFFER, long_max=None, trabajos=1):
+        self.rutas = listar_miembros(rutas) # Archivos que se guardan en el contenedor
+        self.tam_bloque = tam_bloque        # Número de bytes de cada bloque
+        self.long_max = long_max            # Longitud máxima de los códigos, o None si no se limita
+        self.trabajos = trabajos            # Número de procesos que comprimen bloques en paralelo
+
+    # Recorre los bloques de todos los archivos, devolviendo el número de miembro y los datos de cada uno
+    def leer_bloques_miembros(self):
+        for miembro in range(len(self.rutas)):
+            archivo = open(self.rutas[miembro], 'rb')
+            bloque = archivo.read(self.tam_bloque)
+            while bloque:
+                yield miembro, bloque
+                bloque = archivo.read(self.tam_bloque)
+            archivo.close()
+
+    def comprimir_archivo(self, ruta_archivo_comprimido):
+        # Dos miembros con el mismo nombre se extraerían en el mismo archivo, así que se rechazan antes de empezar
+        repetidos = nombres_repetidos([nombre_miembro(ruta) for ruta in self.rutas])
+        if repetidos:
+            raise ValueError("Varios archivos se guardarían en el contenedor con el mismo nombre: %s" %
+                             ', '.join(repetidos))
+
+        archivo_comprimido = open(ruta_archivo_comprimido, 'wb')
+        archivo_comprimido.write(MAGICO + int_to_1byte(VERSION_ARCHIVO) + int_to_4bytes(self.tam_bloque))
+
+        tamanos = [0] * len(self.rutas)          # Tamaño original de cada miembro
+        posiciones = [[] for ruta in self.rutas] # Posición de los bloques de cada miembro
+        pool = crear_pool(self.trabajos)
+        try:
+            lote = []
+            for miembro, bloque in self.leer_bloques_miembros():
+                lote.append((miembro, bloque))
+                if len(lote) == 2 * self.trabajos:
+                    self.escribir_lote(pool, lote, archivo_comprimido, tamanos, posiciones)
+                    lote = []
+            self.escribir_lote(pool, lote, archivo_comprimido, tamanos, posiciones)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        # Índice de miembros y posición del índice
+        pos_indice = archivo_comprimido.tell()
+        for ruta, tamano, posiciones_miembro in zip(self.rutas, tamanos, posiciones):
+            nombre = nombre_miembro(ruta)
+            archivo_comprimido.write(int_to_4bytes(len(nombre)) + nombre + struct.pack('>QI', tamano, len(posiciones_miembro)))
+            archivo_comprimido.write(''.join([struct.pack('>Q', posicion) for posicion in posiciones_miembro]))
+        archivo_comprimido.write(struct.pack('>QI', pos_indice, len(self.rutas)))
+        archivo_comprimido.close()
+
+    # Comprime un lote de bloques (pares miembro, datos) y los escribe en orden, anotando su posición y tamaño
+    def escribir_lote(self, pool, lote, archivo_comprimido, tamanos, posiciones):
+        tareas = [(datos, self.long_max, None) for _, datos in lote]
+        for (miembro, datos), (cuerpo, _, marca) in zip(lote, aplicar(pool, comprimir_bloque_tarea, tareas)):
+            posiciones[miembro].append(archivo_comprimido.tell())
+            tamanos[miembro] += len(datos)
+            archivo_comprimido.write(int_to_4bytes(len(datos)) + longitud_cuerpo(cuerpo, marca) + cuerpo)
+
+""" Clase encargada de extraer los miembros de un contenedor, repartiendo sus bloques entre un pool de procesos. 
+    Se puede extraer solo un subconjunto de miembros; los bloques de un único miembro también se descomprimen en 
+    paralelo. """
+class DescompresorArchivo:
+    def __init__(self, ruta_archivo_comprimido, trabajos=1):
+        self.ruta_archivo_comprimido = ruta_archivo_comprimido
+        self.trabajos = trabajos # Número de procesos que descomprimen bloques en paralelo
+
+    """ Lee el índice del contenedor y devuelve, para cada miembro, su nombre, su tamaño original y la posición de cada 
+        uno de sus bloques. """
+    def leer_indice(self, archivo_comprimido):
+        archivo_comprimido.seek(-12, 2)
+        pos_indice, n_miembros = struct.unpack('>QI', archivo_comprimido.read(12))
+
+        archivo_comprimido.seek(pos_indice)
+        miembros = []
+        for i in range(n_miembros):
+            nombre = archivo_comprimido.read(bytes4_to_int(archivo_comprimido.read(4)))
+            tamano, n_bloques = struct.unpack('>QI', archivo_comprimido.read(12))
+            posiciones = list(struct.unpack('>%dQ' % n_bloques, archivo_comprimido.read(8 * n_bloques)))
+            miembros.append((nombre, tamano, posiciones))
+        return miembros
+
+    """ Crea (con los directorios que falten) el archivo de salida de un miembro dentro del directorio destino. """
+    def abrir_salida(self, nombre, destino):
+        ruta = os.path.join(destino, *nombre_miembro(nombre).split('/'))
+        directorio = os.path.dirname(ruta)
+        if directorio and not os.path.isdir(directorio):
+            os.makedirs(directorio)
+        return open(ruta, 'wb')
+
+    """ Extrae los miembros con los nombres indicados (todos si nombres es None) en el directorio destino. """
+    def extraer(self, nombres=None, destino='.'):
+        archivo_comprimido = open(self.ruta_archivo_comprimido, 'rb')
+        miembros = self.leer_indice(archivo_comprimido)
+        if nombres is not None:
+            desconocidos = [nombre for nombre in nombres if nombre not in [miembro[0] for miembro in miembros]]
+            if desconocidos:
+                raise ValueError("El contenedor no tiene los miembros: %s" % ', '.join(desconocidos))
+            miembros = [miembro for miembro in miembros if miembro[0] in nombres]
+
+        # Un contenedor dañado (o creado por otro programa) podría tener dos miembros que se extraen en la misma ruta: 
+        # se rechaza antes de escribir nada en lugar de sobrescribir uno con otro
+        repetidos = nombres_repetidos([nombre_miembro(nombre) for nombre, _, _ in miembros])
+        if repetidos:
+            raise ValueError("El contenedor tiene varios miembros con el mismo nombre: %s" % ', '.join(repetidos))
+
+        # Los miembros vacíos no tienen bloques
+        for nombre, tamano, posiciones in miembros:
+            if not posiciones:
+                self.abrir_salida(nombre, destino).close()
+
+        tareas = [] # Bloques de todos los miembros: (número de miembro, posición)
+        for i in range(len(miembros)):
+            tareas.extend([(i, posicion) for posicion in miembros[i][2]])
+
+        salida = None
+        actual = None
+        pool = crear_pool(self.trabajos)
+        try:
+            for inicio in range(0, len(tareas), 2 * self.trabajos):
+                lote = tareas[inicio:inicio + 2 * self.trabajos]
+                cuerpos = []
+                for _, posicion in lote:
+                    archivo_comprimido.seek(posicion)
+                    len_original = bytes4_to_int(archivo_comprimido.read(4))
+                    cuerpos.append(leer_cuerpo(archivo_comprimido) + (len_original,))
+
+                for (i, _), content in zip(lote, descomprimir_lote(pool, cuerpos)):
+                    if i != actual:
+                        if salida is not None: salida.close()
+                        salida = self.abrir_salida(miembros[i][0], destino)
+                        actual = i
+                    salida.write(content)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if salida is not None:
+                salida.close()
+        archivo_comprimido.close()
+
+"""
+Modo adaptativo, en una sola pasada. No se cuentan las frecuencias de antemano ni se guarda ninguna tabla: compresor y 
+descompresor parten del mismo modelo (todas las frecuencias a 1) y lo actualizan de la misma forma con los datos ya 
+procesados, por lo que pueden trabajar sobre flujos (tuberías, entrada y salida estándar) sin conocer su tamaño:
+ - Cabecera: MAGICO y la versión VERSION_ADAPTATIVA.
+ - Los datos se dividen en segmentos, que se codifican con los códigos canónicos del modelo construido a partir de los 
+   segmentos anteriores; después se suman sus frecuencias al modelo. El primer segmento tiene SEGMENTO_MIN bytes y cada 
+   uno duplica el tamaño del anterior hasta SEGMENTO_MAX, para que el modelo se ajuste pronto a los datos.
+ - Cada segmento: su longitud original (4 bytes), la longitud de su cuerpo (4 bytes) y el cuerpo, que es el contenido 
+   con el último byte completado con ceros (los bytes que producen se descartan, ya que se conoce la longitud 
+   original). Un segmento de longitud original 0 marca el final. Si la codificación no reduce el segmento, se guarda 
+   sin comprimir, marcándolo con el bit BLOQUE_ALMACENADO de la longitud.
+ - Cuando la suma de las frecuencias supera LIMITE_MODELO se dividen entre dos (sin bajar de 1), de manera que los 
+   códigos no superan los 32 bits y el modelo da más peso a los datos recientes.
+"""
+
+""" Modelo de frecuencias compartido por el compresor y el descompresor adaptativos, junto con sus códigos canónicos. """
+class ModeloAdaptativo:
+    def __init__(self):
+        self.cuentas = [1] * 256 # Frecuencia de cada byte; todos empiezan con 1 para que tengan código
+        self.tabla_char_codigo = None
+        self.actualizar_codigos()
+
+    # Construye los códigos canónicos a partir de las frecuencias actuales, insertándolas siempre en el mismo orden
+    def actualizar_codigos(self):
+        frecuencias = {}
+        for valor in range(256):
+            frecuencias[chr(valor)] = self.cuentas[valor]
+        compresor = CompresorHuffman(None)
+        tabla_codigos = compresor.generar_codigos(compresor.construir_arbol(frecuencias))
+        self.tabla_char_codigo = codigos_canonicos(longitudes_codigos(tabla_codigos))
+
+    # Suma al modelo las frecuencias de un segmento ya procesado y actualiza los códigos
+    def actualizar(self, segmento):
+        cuentas, _ = histograma_bloque(segmento)
+        for valor in range(256):
+            self.cuentas[valor] += cuentas[valor]
+        while sum(self.cuentas) > LIMITE_MODELO:
+            self.cuentas = [(cuenta + 1) // 2 for cuenta in self.cuentas]
+        self.actualizar_codigos()
+
+""" Comprime en el formato adaptativo todo lo que se lea del archivo entrada y lo escribe en el archivo salida. Si se 
+    indica un verificador, recibe los datos leídos para calcular su suma. Si la entrada está vacía no se escribe nada, 
+    igual que un archivo vacío se comprime en otro vacío. """
+def comprimir_adaptativo(entrada, salida, verificador=None):
+    modelo = ModeloAdaptativo()
+    tam_segmento = SEGMENTO_MIN
+    segmento = entrada.read(tam_segmento)
+    if not segmento:
+        return
+    salida.write(MAGICO + int_to_1byte(VERSION_ADAPTATIVA))
+    while segmento:
+        if verificador is not None:
+            verificador.write(segmento)
+        tabla_enteros = CompresorHuffman.codigos_enteros(modelo.tabla_char_codigo)
+        content, buffer_bits, n_bits = CompresorHuffman.elegir_codificador(tabla_enteros)(segmento, tabla_enteros)
+
+        # Completar el último byte con ceros
+        if n_bits:
+            content += int_to_1byte(buffer_bits << (8 - n_bits))
+
+        # Si el segmento no se reduce, se guarda sin comprimir
+        if len(content) >= len(segmento):
+            salida.write(int_to_4bytes(len(segmento)) + int_to_4bytes(len(segmento) | BLOQUE_ALMACENADO) + segmento)
+        else:
+            salida.write(int_to_4bytes(len(segmento)) + int_to_4bytes(len(content)) + content)
+
+        modelo.actualizar(segmento)
+        tam_segmento = min(2 * tam_segmento, SEGMENTO_MAX)
+        segmento = entrada.read(tam_segmento)
+
+    salida.write(int_to_4bytes(0)) # Marca de fin de segmentos
+    salida.flush()
+
+""" Descomprime los segmentos del formato adaptativo leídos del archivo entrada, situado justo después de la 
+    cabecera, y escribe los datos originales en el archivo salida. """
+def descomprimir_adaptativo(entrada, salida):
+    modelo = ModeloAdaptativo()
+    len_original = bytes4_to_int(entrada.read(4))
+    while len_original:
+        segmento, marca = leer_cuerpo(entrada)
+        if marca != BLOQUE_ALMACENADO:
+            segmento = DecodificadorHuffman(modelo.tabla_char_codigo).decodificar_longitud(segmento, len_original)
+        salida.write(segmento)
+
+        modelo.actualizar(segmento)
+        len_original = bytes4_to_int(entrada.read(4))
+    salida.flush()
+
+""" Descomprime un flujo que no se puede recorrer más de una vez, como la entrada estándar. Solo admite el formato 
+    adaptativo, ya que el resto necesitan conocer el tamaño del archivo o acceder a su final. """
+def descomprimir_flujo(entrada, salida):
+    inicio = entrada.read(len(MAGICO) + 1)
+    if not inicio: # Flujo vacío, como el de un archivo vacío comprimido
+        return
+    if inicio != MAGICO + int_to_1byte(VERSION_ADAPTATIVA):
+        raise ValueError("Desde un flujo solo se puede descomprimir el formato adaptativo (opción --adaptativo)")
+    descomprimir_adaptativo(entrada, salida)
+
+
+"""
+Diccionarios compartidos. Para archivos pequeños la cabecera con el árbol y la pasada de recuento de frecuencias 
+dominan tanto el tamaño como el tiempo. Un diccionario guarda una tabla de códigos canónicos entrenada con un corpus de 
+muestra; los archivos comprimidos con él solo llevan en la cabecera MAGICO, la versión VERSION_DICCIONARIO, el CRC-32 
+del diccionario (4 bytes) y la longitud de los datos originales (8 bytes), seguidos del contenido.
+"""
+
+""" Tabla de códigos canónicos compartida por muchos archivos, junto con su identificador. """
+class DiccionarioHuffman:
+    def __init__(self, longitudes):
+        self.longitudes = longitudes # Longitud del código de cada byte
+        self.tabla_char_codigo = codigos_canonicos(longitudes)
+        self.serializado = bits_to_bytes(serializar_longitudes(longitudes))
+        self.identificador = zlib.crc32(self.serializado) & 0xffffffff
+
+    """ Construye el diccionario a partir de las frecuencias de los archivos de muestra. Todos los bytes reciben un 
+        código, aunque no aparezcan en las muestras, y si long_max no es None los códigos se limitan a long_max bits. """
+    @staticmethod
+    def entrenar(rutas_muestras, long_max=None, tam_buffer=TAM_BUFFER):
+        cuentas, _ = sumar_histogramas([histograma_archivo(ruta, tam_buffer) for ruta in rutas_muestras])
+        frecuencias = {}
+        for valor in range(256):
+            frecuencias[chr(valor)] = cuentas[valor] + 1
+
+        compresor = CompresorHuffman(None)
+        arbol_huffman = compresor.construir_arbol(frecuencias)
+        tabla_codigos = compresor.generar_codigos(arbol_huffman)
+        if long_max is not None:
+            arbol_huffman, tabla_codigos = compresor.limitar_longitud(arbol_huffman, tabla_codigos, long_max)
+        return DiccionarioHuffman(longitudes_codigos(tabla_codigos))
+
+    """ Lee un diccionario guardado con guardar. """
+    @staticmethod
+    def cargar(ruta_diccionario):
+        archivo = open(ruta_diccionario, 'rb')
+        try:
+            if archivo.read(len(MAGICO_DICCIONARIO)) != MAGICO_DICCIONARIO:
+                raise ValueError("El archivo %s no es un diccionario" % ruta_diccionario)
+            longitudes = leer_longitudes(archivo)
+        finally:
+            archivo.close()
+        return DiccionarioHuffman(longitudes)
+
+    def guardar(self, ruta_diccionario):
+        archivo = open(ruta_diccionario, 'wb')
+        archivo.write(MAGICO_DICCIONARIO + self.serializado)
+        archivo.close()
+
+    """ Cabecera de los archivos comprimidos con este diccionario, con la longitud de los datos originales. """
+    def generar_cabecera(self, longitud):
+        return MAGICO + int_to_1byte(VERSION_DICCIONARIO) + int_to_4bytes(self.identificador) + int_to_8bytes(longitud)
+
+
+"""
+Servicio de compresión
+"""
+# Atiende una petición del servicio en uno de los procesos del pool: la tarea es la operación, los datos y las 
+# opciones de compresión
+def atender_peticion_tarea(tarea):
+    operacion, datos, canonico, long_max, diccionario, adaptativo, crc = tarea
+    if operacion == PETICION_COMPRIMIR:
+        return comprimir_datos(datos, canonico, long_max, diccionario, adaptativo, crc)
+    return descomprimir_datos(datos, diccionario)
+
+'''
+    Servicio de compresión que atiende peticiones por un socket Unix, para no pagar el arranque del intérprete ni 
+    reconstruir las tablas en cada llamada:
+     - Cada conexión se atiende en un hilo y puede enviar varias peticiones seguidas.
+     - Las peticiones pequeñas se atienden en el propio hilo, y las de MINIMO_POOL bytes o más se envían al pool de 
+       procesos, donde no compiten con las demás por el intérprete.
+     - Los decodificadores se guardan en una caché indexada por los bytes de la cabecera, de manera que los datos 
+       comprimidos con la misma tabla (por ejemplo, con un diccionario) no vuelven a construirla.
+     - Cada petición se recibe entera en memoria antes de atenderla, y su resultado se envía también entero, por lo 
+       que los datos de una petición no pueden superar PETICION_MAX bytes.
+    Las peticiones de compresión usan las opciones con las que se crea el servicio.
+'''
+class ServicioHuffman:
+    def __init__(self, trabajos=1, canonico=False, long_max=None, diccionario=None, adaptativo=False, crc=False):
+        self.pool = crear_pool(trabajos)
+        self.opciones = (canonico, long_max, diccionario, adaptativo, crc)
+        self.diccionario = diccionario
+        self.tablas = {} # Caché de decodificadores de DescompresorHuffman.leer_decodificador
+
+    """ Comprime o descomprime los datos según la operación y devuelve el resultado. """
+    def atender(self, operacion, datos):
+        if operacion not in (PETICION_COMPRIMIR, PETICION_DESCOMPRIMIR):
+            raise ValueError("Operación no soportada: %r" % operacion)
+        if self.pool is not None and len(datos) >= MINIMO_POOL:
+            return self.pool.apply(atender_peticion_tarea, ((operacion, datos) + self.opciones,))
+        if operacion == PETICION_COMPRIMIR:
+            return comprimir_datos(datos, *self.opciones)
+        return descomprimir_datos(datos, self.diccionario, tablas=self.tablas)
+
+    def cerrar(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+""" Atiende las peticiones de una conexión hasta que el cliente la cierra. Los errores de una petición se devuelven 
+    al cliente sin cerrar la conexión, salvo si la petición supera PETICION_MAX bytes: sus datos no se llegan a leer, 
+    así que tras el error se cierra la conexión. """
+class ManejadorServicio(SocketServer.StreamRequestHandler):
+    def handle(self):
+        while True:
+            cabecera = self.rfile.read(5)
+            if len(cabecera) < 5:
+                return
+            longitud = bytes4_to_int(cabecera[1:])
+            if longitud > PETICION_MAX:
+                mensaje = "La petición ocupa %d bytes y el servicio admite %d como máximo" % (longitud, PETICION_MAX)
+                self.wfile.write(RESPUESTA_ERROR + int_to_4bytes(len(mensaje)) + mensaje)
+                return
+            datos = self.rfile.read(longitud)
+            if len(datos) < longitud:
+                return
+            try:
+                resultado = self.server.servicio.atender(cabecera[0], datos)
+                estado = RESPUESTA_CORRECTA
+            except Exception, error:
+                resultado = str(error)
+                estado = RESPUESTA_ERROR
+            self.wfile.write(estado + int_to_4bytes(len(resultado)))
+            self.wfile.write(resultado)
+
+""" Pone en marcha el servicio de compresión en el socket Unix ruta_socket y lo atiende hasta que se interrumpe 
+    (Ctrl+C). Si ya existe un socket en esa ruta, se sustituye. """
+def servir_huffman(ruta_socket, trabajos=1, canonico=False, long_max=None, diccionario=None, adaptativo=False,
+                   crc=False):
+    if not hasattr(SocketServer, 'ThreadingUnixStreamServer'):
+        raise ValueError("El servicio de compresión requiere sockets Unix")
+    if os.path.exists(ruta_socket):
+        os.remove(ruta_socket)
+
+    servicio = ServicioHuffman(trabajos, canonico, long_max, diccionario, adaptativo, crc)
+    servidor = SocketServer.ThreadingUnixStreamServer(ruta_socket, ManejadorServicio)
+    servidor.daemon_threads = True
+    servidor.servicio = servicio
+    try:
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        servidor.server_close()
+        os.remove(ruta_socket)
+        servicio.cerrar()
+
+'''
+    Cliente del servicio de compresión. Mantiene abierta la conexión con el socket Unix, de manera que se pueden 
+    enviar muchas peticiones pequeñas sin volver a conectar. Si el servicio devuelve un error, se lanza ValueError 
+    con su mensaje; los datos de más de PETICION_MAX bytes se rechazan sin enviarlos.
+'''
+class ClienteHuffman:
+    def __init__(self, ruta_socket):
+        self.conexion = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.conexion.connect(ruta_socket)
+        self.entrada = self.conexion.makefile('rb')
+
+    def comprimir(self, datos):
+        return self.solicitar(PETICION_COMPRIMIR, datos)
+
+    def descomprimir(self, datos):
+        return self.solicitar(PETICION_DESCOMPRIMIR, datos)
+
+    def solicitar(self, operacion, datos):
+        if len(datos) > PETICION_MAX:
+            raise ValueError("La petición ocupa %d bytes y el servicio admite %d como máximo" %
+                             (len(datos), PETICION_MAX))
+        self.conexion.sendall(operacion + int_to_4bytes(len(datos)))
+        self.conexion.sendall(datos)
+        cabecera = self.entrada.read(5)
+        if len(cabecera) < 5:
+            raise ValueError("El servicio de compresión ha cerrado la conexión")
+        resultado = self.entrada.read(bytes4_to_int(cabecera[1:]))
+        if cabecera[0] == RESPUESTA_ERROR:
+            raise ValueError(resultado)
+        return resultado
+
+    def cerrar(self):
+        self.entrada.close()
+        self.conexion.close()
 
 
 """ 
 Argumentos recibidos por el programa principal:
- * Flag que indica si se va a comprimir o descomprimir: 
+ * Flag que indica la operación: 
     '-c' para comprimir 
     '-d' para descomprimir
- * Ruta del archivo de entrada 
+    '-t' para comprobar archivos comprimidos descomprimiéndolos sin escribir nada
+    '-e' para entrenar un diccionario con archivos de muestra y guardarlo en --diccionario
+    '-a' para guardar archivos y directorios en un contenedor, indicado como primer argumento
+    '-x' para extraer miembros de un contenedor, indicado como primer argumento (todos si no se indica ninguno)
+    '-s' para buscar en un archivo comprimido el patrón indicado como primer argumento
+ * Opcionalmente, '-b N' para leer los archivos en bloques de N bytes (por defecto 1 MiB), que es también el tamaño de 
+   bloque de los formatos por bloques (como máximo TAM_BLOQUE_MAX)
+ * Opcionalmente, '--canonico' para comprimir con códigos canónicos y cabecera versionada
+ * Opcionalmente, '-l N' para limitar a N bits la longitud de los códigos
+ * Opcionalmente, '-j N' para comprimir en el formato por bloques (de -b bytes), o descomprimir uno o un contenedor, 
+   con N procesos
+ * Opcionalmente, '--indice N' para añadir al formato por bloques un punto de control cada N bytes
+ * Opcionalmente, '--nivel N' (y '--ventana N') para aplicar LZ77 a cada bloque antes de Huffman
+ * Opcionalmente, '--contextos N' para codificar cada bloque con el modelo de orden 1, en N tablas como máximo
+ * Opcionalmente, '--entrelazado' para repartir los bytes de cada bloque en flujos que se decodifican por separado
+ * Opcionalmente, '--adaptativo' para comprimir en una sola pasada con un modelo que se actualiza sobre la marcha
+ * Opcionalmente, '--diccionario RUTA' para comprimir o descomprimir con la tabla de un diccionario entrenado
+ * Opcionalmente, '--histograma N' para contar las frecuencias de los bytes con N procesos
+ * Opcionalmente, '--crc' para añadir el CRC-32 y la longitud de los datos originales, que se comprueban al descomprimir
+ * Opcionalmente, '--rango INICIO:LONGITUD' para descomprimir solo ese rango de bytes, que se escribe en la salida estándar
+ * Opcionalmente, '--mmap' para leer el archivo de entrada proyectándolo en memoria
+ * Opcionalmente, '--destino DIR' con -x, y '--contexto N' con -s para mostrar N bytes alrededor de cada coincidencia
+ * Opcionalmente, '--stats' para escribir en la salida de errores el tiempo de cada fase
+ * Opcionalmente, '--servidor RUTA_SOCKET' para atender peticiones de compresión por un socket Unix en lugar de 
+   procesar archivos
+ * Ruta del archivo de entrada, o '-' para leer de la entrada estándar y escribir en la salida estándar (solo en el 
+   formato adaptativo)
 
 Si no se reciben los argumentos necesarios, se imprime un mensaje de
-error indicando la correcta invocación del programa. 
+error indicando la correcta invocación del programa. Las opciones que no se pueden combinar se rechazan con un mensaje 
+de error, y los errores al procesar los archivos se muestran sin la traza.
 """
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Uso: python huf.py [-c | -d] ruta_archivo")
+    uso = "python huf.py [-c | -d | -t | -e | -a | -x | -s] [-b N] [--canonico] [-l N] [-j N] [--indice N] [--rango INICIO:LONGITUD] [--mmap] [--histograma N] [--adaptativo] [--diccionario RUTA] [--destino DIR] [--nivel N] [--ventana N] [--contextos N] [--entrelazado] [--contexto N] [--stats] [--crc] [--servidor RUTA_SOCKET] ruta_archivo ..."
+    parser = OptionParser(usage=uso)
+    parser.add_option('-c', action='store_const', const='-c', dest='modo', help='comprime el archivo de entrada')
+    parser.add_option('-d', action='store_const', const='-d', dest='modo', help='descomprime el archivo de entrada')
+    parser.add_option('-t', '--probar', action='store_const', const='-t', dest='modo',
+                      help='comprueba los archivos comprimidos indicados descomprimiéndolos sin escribir nada y, si '
+                           'tienen suma de verificación, comparándola con la de los datos descomprimidos')
+    parser.add_option('-e', '--entrenar', action='store_const', const='-e', dest='modo',
+                      help='entrena un diccionario con los archivos de muestra indicados y lo guarda en --diccionario')
+    parser.add_option('-a', '--archivar', action='store_const', const='-a', dest='modo',
+                      help='comprime en el contenedor indicado como primer argumento los archivos y directorios '
+                           'restantes, repartiendo sus bloques entre -j procesos')
+    parser.add_option('-x', '--extraer', action='store_const', const='-x', dest='modo',
+                      help='extrae del contenedor indicado como primer argumento los miembros restantes (o todos, si '
+                           'no se indica ninguno), repartiendo sus bloques entre -j procesos')
+    parser.add_option('-s', '--buscar', action='store_const', const='-s', dest='modo',
+                      help='busca el patrón indicado como primer argumento en el archivo comprimido y muestra la '
+                           'posición de cada coincidencia en el archivo original, sin descomprimirlo en disco')
+    parser.add_option('-b', '--buffer', type='int', dest='tam_buffer', default=TAM_BUFFER, metavar='N',
+                      help='lee los archivos en bloques de N bytes, limitando la memoria utilizada (por defecto %d)' % TAM_BUFFER)
+    parser.add_option('--canonico', action='store_true', dest='canonico', default=False,
+                      help='comprime con códigos canónicos, guardando en la cabecera solo la longitud de cada código')
+    parser.add_option('-l', '--long-max', type='int', dest='long_max', default=None, metavar='N',
+                      help='limita a N bits la longitud de los códigos (p. ej. 12 o 15), para que las tablas de '
+                           'decodificación sean pequeñas')
+    parser.add_option('-j', '--jobs', type='int', dest='trabajos', default=None, metavar='N',
+                      help='comprime en el formato por bloques de -b bytes, codificados de forma independiente, o '
+                           'descomprime un archivo en ese formato, repartiendo los bloques entre N procesos')
+    parser.add_option('--indice', type='int', dest='intervalo', default=None, metavar='N',
+                      help='comprime en el formato por bloques con un índice de acceso aleatorio, con un punto de '
+                           'control cada N bytes')
+    parser.add_option('--rango', dest='rango', default=None, metavar='INICIO:LONGITUD',
+                      help='descomprime solo LONGITUD bytes a partir del byte INICIO y los escribe en la salida estándar')
+    parser.add_option('--mmap', action='store_true', dest='usar_mmap', default=False,
+                      help='lee el archivo de entrada proyectándolo en memoria (mmap), sin la copia de cada lectura')
+    parser.add_option('--histograma', type='int', dest='procesos_histograma', default=1, metavar='N',
+                      help='cuenta las frecuencias de los bytes repartiendo rangos del archivo entre N procesos')
+    parser.add_option('--adaptativo', action='store_true', dest='adaptativo', default=False,
+                      help='comprime en una sola pasada con un modelo que se actualiza sobre la marcha; es el modo que '
+                           'se usa si ruta_archivo es - (entrada y salida estándar)')
+    parser.add_option('--diccionario', dest='diccionario', default=None, metavar='RUTA',
+                      help='comprime o descomprime con la tabla del diccionario RUTA, sin contar las frecuencias ni '
+                           'guardar el árbol; con -e, es el archivo en el que se guarda el diccionario entrenado')
+    parser.add_option('--destino', dest='destino', default='.', metavar='DIR',
+                      help='con -x, directorio en el que se extraen los miembros (por defecto el actual)')
+    parser.add_option('--nivel', type='int', dest='nivel', default=None, metavar='N',
+                      help='comprime en el formato por bloques aplicando LZ77 antes de Huffman; N va de 1 (más rápido) '
+                           'a 9 (mejor compresión)')
+    parser.add_option('--ventana', type='int', dest='ventana', default=VENTANA_LZ, metavar='N',
+                      help='con --nivel, distancia máxima en bytes de las coincidencias de LZ77 (por defecto %d)' % VENTANA_LZ)
+    parser.add_option('--contextos', type='int', dest='tablas_contexto', default=None, metavar='N',
+                      help='comprime en el formato por bloques eligiendo la tabla de cada byte según el byte anterior, '
+                           'con los contextos agrupados en N tablas como máximo (por ejemplo %d, hasta %d)' %
+                           (TABLAS_CONTEXTO, TABLAS_CONTEXTO_MAX))
+    parser.add_option('--entrelazado', action='store_true', dest='entrelazado', default=False,
+                      help='comprime en el formato por bloques repartiendo los bytes de cada bloque en %d flujos '
+                           'intercalados que se decodifican por separado' % FLUJOS_ENTRELAZADOS)
+    parser.add_option('--contexto', type='int', dest='contexto', default=0, metavar='N',
+                      help='con -s, muestra también los N bytes anteriores y posteriores a cada coincidencia')
+    parser.add_option('--crc', action='store_true', dest='crc', default=False,
+                      help='añade al archivo comprimido el CRC-32 y la longitud de los datos originales, que se '
+                           'comprueban al descomprimir o con -t')
+    parser.add_option('--stats', action='store_true', dest='stats', default=False,
+                      help='escribe en la salida de errores una línea JSON con el tiempo de cada fase, los bytes de '
+                           'entrada y salida y la memoria máxima (también con la variable de entorno HUF_STATS)')
+    parser.add_option('--servidor', dest='servidor', default=None, metavar='RUTA_SOCKET',
+                      help='en lugar de procesar archivos, atiende peticiones de compresión y descompresión por el '
+                           'socket Unix RUTA_SOCKET, con las opciones de compresión indicadas y -j procesos para las '
+                           'peticiones grandes')
+    opciones, argumentos = parser.parse_args()
+
+    if opciones.servidor is not None:
+        diccionario = None
+        if opciones.diccionario is not None:
+            diccionario = DiccionarioHuffman.cargar(opciones.diccionario)
+        trabajos = opciones.trabajos
+        if trabajos is None: trabajos = 1
+        servir_huffman(opciones.servidor, trabajos, opciones.canonico, opciones.long_max, diccionario,
+                       opciones.adaptativo, opciones.crc)
         sys.exit()
 
-    if sys.argv[1] == '-c':
-        ruta_archivo = sys.argv[2]
-        ruta_archivo_comprimido = ruta_archivo + '.huf'
-        comprimir_archivo_huffman(ruta_archivo, ruta_archivo_comprimido)
-    elif sys.argv[1] == '-d':
-        ruta_archivo_comprimido = sys.argv[2]
-        descomprimir_archivo_huffman(ruta_archivo_comprimido)
-    else:
-        print("Uso: python huf.py [-c|-d] ruta_archivo")
+    rango = None
+    if opciones.rango is not None:
+        try:
+            rango = [int(valor) for valor in opciones.rango.split(':')]
+        except ValueError:
+            rango = None
+
+    if opciones.modo is None or opciones.tam_buffer <= 0 or \
+       (len(argumentos) != 1 and opciones.modo in ('-c', '-d')) or not argumentos or \
+       (opciones.modo == '-a' and len(argumentos) < 2) or \
+       (opciones.modo == '-s' and (len(argumentos) != 2 or not argumentos[0])) or opciones.contexto < 0 or \
+       (opciones.modo == '-e' and opciones.diccionario is None) or \
+       (opciones.trabajos is not None and opciones.trabajos <= 0) or \
+       (opciones.intervalo is not None and opciones.intervalo <= 0) or opciones.procesos_histograma <= 0 or \
+       (opciones.nivel is not None and not 1 <= opciones.nivel <= 9) or opciones.ventana <= 0 or \
+       (opciones.tablas_contexto is not None and
+        (not 1 <= opciones.tablas_contexto <= TABLAS_CONTEXTO_MAX or opciones.nivel is not None)) or \
+       (opciones.entrelazado and (opciones.nivel is not None or opciones.tablas_contexto is not None)) or \
+       (opciones.rango is not None and (rango is None or len(rango) != 2 or min(rango) < 0)):
+        print("Uso: " + uso)
         sys.exit()
+
+    # Con menos de 8 bits no caben los códigos de los 256 valores de un byte (los diccionarios siempre los tienen todos)
+    if opciones.long_max is not None and not 8 <= opciones.long_max <= 32:
+        parser.error("el límite de longitud de los códigos (-l) debe estar entre 8 y 32 bits")
+
+    bloques = opciones.modo == '-a' or (opciones.modo == '-c' and (
+        opciones.trabajos is not None or opciones.intervalo is not None or opciones.nivel is not None or
+        opciones.tablas_contexto is not None or opciones.entrelazado))
+    if bloques and opciones.tam_buffer > TAM_BLOQUE_MAX:
+        parser.error("en los formatos por bloques el tamaño de bloque (-b) no puede superar %d bytes" % TAM_BLOQUE_MAX)
+
+    # Las opciones que el formato elegido no usaría se rechazan, en lugar de ignorarlas sin avisar
+    opciones_bloques = [('-j', opciones.trabajos is not None), ('--indice', opciones.intervalo is not None),
+                        ('--nivel', opciones.nivel is not None), ('--contextos', opciones.tablas_contexto is not None),
+                        ('--entrelazado', opciones.entrelazado)]
+    def usadas(lista):
+        return [nombre for nombre, usada in lista if usada]
+    opciones_lectura = [('--mmap', opciones.usar_mmap), ('--histograma', opciones.procesos_histograma != 1)]
+    if opciones.modo in ('-c', '-d') and argumentos[0] == '-':
+        incompatibles = usadas(opciones_bloques + opciones_lectura +
+                               [('--canonico', opciones.canonico), ('-l', opciones.long_max is not None),
+                                ('--diccionario', opciones.diccionario is not None), ('--crc', opciones.crc),
+                                ('--rango', opciones.rango is not None), ('--stats', opciones.stats)])
+        if incompatibles:
+            parser.error("con la entrada estándar (-) no se admite %s: solo se usa el formato adaptativo y no se "
+                         "emiten estadísticas" % ', '.join(incompatibles))
+    elif opciones.modo == '-c' and opciones.adaptativo:
+        incompatibles = usadas(opciones_bloques + opciones_lectura +
+                               [('--canonico', opciones.canonico), ('-l', opciones.long_max is not None),
+                                ('--diccionario', opciones.diccionario is not None)])
+        if incompatibles:
+            parser.error("--adaptativo no se puede combinar con %s" % ', '.join(incompatibles))
+    elif opciones.modo == '-c' and opciones.diccionario is not None:
+        incompatibles = usadas(opciones_bloques + [('--canonico', opciones.canonico),
+                                                   ('-l', opciones.long_max is not None),
+                                                   ('--histograma', opciones.procesos_histograma != 1)])
+        if incompatibles:
+            parser.error("--diccionario no se puede combinar con %s (la tabla es la del diccionario)" %
+                         ', '.join(incompatibles))
+    elif opciones.modo == '-a':
+        # El contenedor solo usa -b, -l y -j
+        incompatibles = usadas(opciones_bloques[1:] + opciones_lectura +
+                               [('--canonico', opciones.canonico), ('--adaptativo', opciones.adaptativo),
+                                ('--diccionario', opciones.diccionario is not None), ('--crc', opciones.crc)])
+        if incompatibles:
+            parser.error("el contenedor (-a) no usa %s" % ', '.join(incompatibles))
+    elif bloques:
+        # Los bloques se leen con read para repartirlos entre los procesos y cada uno lleva su tabla canónica
+        incompatibles = usadas(opciones_lectura + [('--canonico', opciones.canonico)])
+        if incompatibles:
+            parser.error("el formato por bloques (%s) no usa %s" % (', '.join(usadas(opciones_bloques)),
+                                                                    ', '.join(incompatibles)))
+
+    configurar_estadisticas(opciones.stats)
+
+    # Los errores esperables (archivos dañados o inexistentes, formatos que no corresponden) se muestran con un 
+    # mensaje en la salida de errores, sin la traza
+    try:
+        diccionario = None
+        if opciones.diccionario is not None and opciones.modo != '-e':
+            diccionario = DiccionarioHuffman.cargar(opciones.diccionario)
+
+        trabajos = opciones.trabajos
+        if trabajos is None: trabajos = 1
+
+        if opciones.modo == '-e':
+            diccionario = DiccionarioHuffman.entrenar(argumentos, opciones.long_max, opciones.tam_buffer)
+            diccionario.guardar(opciones.diccionario)
+        elif opciones.modo == '-a':
+            compresor = CompresorArchivo(argumentos[1:], opciones.tam_buffer, opciones.long_max, trabajos)
+            compresor.comprimir_archivo(argumentos[0])
+        elif opciones.modo == '-x':
+            nombres = None
+            if len(argumentos) > 1: nombres = argumentos[1:]
+            DescompresorArchivo(argumentos[0], trabajos).extraer(nombres, opciones.destino)
+        elif opciones.modo == '-t':
+            # Se comprueban todos los archivos, y el programa termina con error si alguno está dañado
+            errores = 0
+            for ruta_archivo_comprimido in argumentos:
+                try:
+                    crc, longitud, verificado = probar_huffman(ruta_archivo_comprimido, opciones.tam_buffer, trabajos,
+                                                               opciones.usar_mmap, diccionario)
+                except Exception, error:
+                    print("%s: ERROR: %s" % (ruta_archivo_comprimido, error))
+                    errores += 1
+                    continue
+                if verificado:
+                    print("%s: correcto (%d bytes, CRC-32 %08x verificado)" % (ruta_archivo_comprimido, longitud, crc))
+                else:
+                    print("%s: correcto (%d bytes, CRC-32 %08x; el archivo no tiene suma de verificación)" %
+                          (ruta_archivo_comprimido, longitud, crc))
+            if errores:
+                sys.exit(1)
+        elif opciones.modo == '-s':
+            # Cada coincidencia se muestra con su posición en el archivo original y, si se pide, su contexto
+            def informar(posicion, fragmento):
+                if opciones.contexto:
+                    print("%d: %r" % (posicion, fragmento))
+                else:
+                    print(posicion)
+            buscar_huffman(argumentos[1], argumentos[0], informar, opciones.contexto, opciones.tam_buffer, trabajos,
+                           opciones.usar_mmap, diccionario)
+        elif argumentos[0] == '-':
+            # Entrada y salida estándar: se procesan en una sola pasada
+            if opciones.modo == '-c':
+                comprimir_adaptativo(sys.stdin, sys.stdout)
+            else:
+                descomprimir_flujo(sys.stdin, sys.stdout)
+        elif opciones.modo == '-c':
+            ruta_archivo = argumentos[0]
+            ruta_archivo_comprimido = ruta_archivo + '.huf'
+            comprimir_archivo_huffman(ruta_archivo, ruta_archivo_comprimido, opciones.tam_buffer, opciones.canonico,
+                                      opciones.long_max, opciones.trabajos, opciones.intervalo, opciones.usar_mmap,
+                                      opciones.procesos_histograma, opciones.adaptativo, diccionario, opciones.nivel,
+                                      opciones.ventana, opciones.tablas_contexto, opciones.entrelazado, opciones.crc,
+                                      informar=True)
+        else:
+            ruta_archivo_comprimido = argumentos[0]
+            if rango is not None:
+                sys.stdout.write(descomprimir_rango_huffman(ruta_archivo_comprimido, rango[0], rango[1]))
+            else:
+                descomprimir_archivo_huffman(ruta_archivo_comprimido, opciones.tam_buffer, trabajos, opciones.usar_mmap,
+                                             diccionario)
+    except (ValueError, EnvironmentError), error:
+        sys.stderr.write("Error: %s\n" % error)
+        sys.exit(1)
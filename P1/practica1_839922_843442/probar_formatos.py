@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Autores: Jesús López Ansón (839922), Javier Sin Pelayo (843442)
+# Funcionamiento: comprueba que huf.py recupera exactamente los datos originales en cada uno de sus formatos y modos:
+#                 comprime y descomprime los archivos de prueba y un corpus sintético con cada combinación de opciones,
+#                 y prueba además -t, --rango, -s, el contenedor (-a y -x), la entrada y salida estándar, la interfaz
+#                 en memoria y el servicio de compresión. Muestra una línea por caso y termina con error si alguno falla.
+
+# MODO DE USO
+# python probar_formatos.py [--tam N] [--modos M1,M2,...] [--conservar DIR]
+#   - Los archivos se generan y comprimen en un directorio temporal (o en --conservar DIR, que no se borra al terminar)
+
+import os, sys, time, struct, random, signal, socket, shutil, tempfile, subprocess, threading
+from optparse import OptionParser
+from cStringIO import StringIO
+
+import huf
+from benchmark import generar_corpus
+
+HUF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'huf.py')
+PRUEBAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pruebas')
+ARCHIVOS_PRUEBA = ['vacio.txt', 'uno.txt', 'quijote.txt', 'practica1_23-24.pdf']
+
+# Clientes que usan a la vez el servicio de compresión, veces que cada uno envía todos los archivos y tamaño máximo de 
+# los archivos que se envían
+CLIENTES_SERVICIO = 3
+VUELTAS_SERVICIO = 2
+TAM_MAX_SERVICIO = 1 << 18
+
+# Se sustituye por la ruta del diccionario entrenado con los archivos de prueba
+DICCIONARIO = '<diccionario>'
+
+# Modos que se prueban: nombre, opciones de compresión, opciones de descompresión y si el archivo comprimido está en el
+# formato por bloques (y por tanto admite --rango)
+MODOS = [
+    ('original', [], [], False),
+    ('canonico', ['--canonico'], [], False),
+    ('limitado', ['-l', '10'], [], False),
+    ('mmap', ['--mmap', '-b', '65536'], ['--mmap', '-b', '65536'], False),
+    ('histograma', ['--histograma', '2'], [], False),
+    ('bloques', ['-j', '1', '-b', '65536'], [], True),
+    ('bloques_paralelo', ['-j', '2', '-b', '65536'], ['-j', '2'], True),
+    ('indice', ['-j', '1', '-b', '65536', '--indice', '4096'], [], True),
+    ('lz', ['--nivel', '4', '-b', '65536'], ['-j', '2'], True),
+    ('contextos', ['--contextos', '8', '-b', '65536'], [], True),
+    ('entrelazado', ['--entrelazado', '-b', '65536'], ['-j', '2'], True),
+    ('adaptativo', ['--adaptativo'], [], False),
+    ('diccionario', ['--diccionario', DICCIONARIO], ['--diccionario', DICCIONARIO], False),
+    ('crc', ['--crc'], [], False),
+    ('crc_bloques', ['--crc', '-j', '2', '-b', '65536'], ['-j', '2'], True),
+    ('crc_adaptativo', ['--crc', '--adaptativo'], [], False),
+]
+
+""" Resultados de las comprobaciones: número de casos y lista de los que han fallado. """
+class Resultados:
+    def __init__(self):
+        self.casos = 0
+        self.errores = []
+
+    def comprobar(self, caso, correcto, detalle=''):
+        self.casos += 1
+        if correcto:
+            print("OK     %s" % caso)
+        else:
+            self.errores.append(caso)
+            print("ERROR  %s %s" % (caso, detalle))
+
+resultados = Resultados()
+
+def leer(ruta):
+    archivo = open(ruta, 'rb')
+    datos = archivo.read()
+    archivo.close()
+    return datos
+
+""" Ejecuta huf.py con los argumentos indicados y devuelve su estado de salida, su salida estándar y su salida de
+    errores. Si se indica entrada, se le pasa por la entrada estándar. """
+def ejecutar(argumentos, entrada=None, directorio=None):
+    proceso = subprocess.Popen([sys.executable, HUF] + argumentos, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=directorio)
+    salida, errores = proceso.communicate(entrada)
+    return proceso.returncode, salida, errores
+
+# Última línea no vacía de la salida de errores, para explicar un fallo
+def ultima_linea(errores):
+    lineas = errores.strip().splitlines()
+    if not lineas:
+        return ''
+    return lineas[-1]
+
+""" Posiciones de todas las apariciones (también solapadas) del patrón en los datos, como las que muestra -s. """
+def apariciones(datos, patron):
+    posiciones = []
+    pos = datos.find(patron)
+    while pos != -1:
+        posiciones.append(pos)
+        pos = datos.find(patron, pos + 1)
+    return posiciones
+
+""" Patrón de 4 bytes de los datos, a partir de la mitad, que se puede pasar como argumento a -s: sin bytes nulos ni
+    un guion inicial. Devuelve None si no hay ninguno. """
+def patron_busqueda(datos):
+    for inicio in range(len(datos) // 2, len(datos) - 3):
+        patron = datos[inicio:inicio + 4]
+        if '\0' not in patron and patron[0] != '-':
+            return patron
+    return None
+
+""" Comprime y descomprime cada archivo con las opciones del modo, y comprueba -t, -s y, en el formato por bloques,
+    --rango sobre el archivo comprimido. Los archivos comprimidos se quedan en el subdirectorio del modo. """
+def probar_modo(modo, opciones_c, opciones_d, bloques, archivos, directorio):
+    carpeta = os.path.join(directorio, modo)
+    os.mkdir(carpeta)
+    for nombre, ruta in archivos:
+        datos = leer(ruta)
+        caso = "%s %s" % (modo, nombre)
+        copia = os.path.join(carpeta, nombre)
+        comprimido = copia + '.huf'
+        shutil.copyfile(ruta, copia)
+
+        estado, _, errores = ejecutar(['-c'] + opciones_c + [copia])
+        if estado != 0:
+            resultados.comprobar(caso, False, "(compresión: %s)" % ultima_linea(errores))
+            continue
+        os.remove(copia)
+        estado, _, errores = ejecutar(['-d'] + opciones_d + [comprimido])
+        resultados.comprobar(caso, estado == 0 and leer(copia) == datos, ultima_linea(errores))
+
+        estado, salida, errores = ejecutar(['-t'] + opciones_d + [comprimido])
+        resultados.comprobar(caso + " -t", estado == 0 and ': correcto' in salida, ultima_linea(salida + errores))
+
+        patron = patron_busqueda(datos)
+        if patron is not None:
+            estado, salida, errores = ejecutar(['-s'] + opciones_d + [patron, comprimido])
+            encontradas = [int(linea) for linea in salida.split()]
+            resultados.comprobar(caso + " -s", estado == 0 and encontradas == apariciones(datos, patron),
+                                 ultima_linea(errores))
+
+        if bloques and len(datos) > 1000:
+            inicio = len(datos) // 3
+            longitud = len(datos) // 2
+            estado, salida, errores = ejecutar(['-d', '--rango', '%d:%d' % (inicio, longitud), comprimido])
+            resultados.comprobar(caso + " --rango", estado == 0 and salida == datos[inicio:inicio + longitud],
+                                 ultima_linea(errores))
+
+""" Codifica datos aleatorios con el árbol de unas frecuencias de Fibonacci, cuyos códigos llegan a 39 bits, y
+    comprueba que codificar (el codificador sin NumPy, el único que admite códigos de más de 32 bits) devuelve
+    exactamente los bits de los códigos concatenados, y que se decodifican. """
+def probar_codigos_largos():
+    frecuencias = {}
+    anterior, actual = 1, 1
+    for valor in range(40):
+        frecuencias[chr(valor)] = actual
+        anterior, actual = actual, anterior + actual
+    compresor = huf.CompresorHuffman(None)
+    tabla_codigos = compresor.generar_codigos(compresor.construir_arbol(frecuencias))
+    tabla_enteros = huf.CompresorHuffman.codigos_enteros(tabla_codigos)
+    decodificador = huf.DecodificadorHuffman(tabla_codigos)
+
+    aleatorio = random.Random(1)
+    correcto = max([len(codigo) for codigo in tabla_codigos.values()]) > 32
+    for prueba in range(200):
+        datos = ''.join([chr(aleatorio.randrange(40)) for i in range(aleatorio.randrange(1, 50))])
+        bits = ''.join([tabla_codigos[byte] for byte in datos])
+        try:
+            content, buffer_bits, n_bits = huf.CompresorHuffman.codificar(datos, tabla_enteros)
+        except ValueError:
+            correcto = False
+            break
+        completos = len(bits) - len(bits) % 8
+        correcto = correcto and content == huf.bits_to_bytes(bits[:completos]) and n_bits == len(bits) % 8 and \
+                   buffer_bits == int('0' + bits[completos:], 2)
+        correcto = correcto and decodificador.decodificar(huf.bits_to_bytes(bits), len(bits))[0] == datos
+    resultados.comprobar("códigos de más de 32 bits", correcto)
+
+""" Comprueba que el decodificador rechaza con ValueError los bits que no corresponden a ningún código, tanto en los
+    códigos que se alargan bit a bit como en los últimos bits del flujo. """
+def probar_contenido_danado():
+    casos = [('código largo', {'a': '0'}, 1, '\xff', 8),
+             ('últimos bits', {'a': '0', 'b': '10'}, 2, '\xc0', 1)]
+    for caso, tabla_codigos, k, datos, total_bits in casos:
+        try:
+            huf.DecodificadorHuffman(tabla_codigos, k).decodificar(datos, total_bits)
+            correcto = False
+        except ValueError:
+            correcto = True
+        resultados.comprobar("contenido dañado (%s)" % caso, correcto)
+
+# Opciones que huf.py debe rechazar con un error, sin llegar a crear el archivo comprimido; ARCHIVO se sustituye por la
+# ruta de un archivo de prueba (y DICCIONARIO, por la del diccionario entrenado)
+ARCHIVO = '<archivo>'
+OPCIONES_INVALIDAS = [
+    ['-c', '-j', '1', '-b', str(huf.TAM_BLOQUE_MAX + 1), ARCHIVO],
+    ['-c', '-j', '2', '-'],
+    ['-c', '--crc', '-'],
+    ['-d', '-j', '2', '-'],
+    ['-c', '--adaptativo', '-j', '1', ARCHIVO],
+    ['-c', '--adaptativo', '--nivel', '4', ARCHIVO],
+    ['-c', '--diccionario', DICCIONARIO, '-j', '1', ARCHIVO],
+    ['-c', '--diccionario', DICCIONARIO, '-l', '12', ARCHIVO],
+    ['-c', '-l', '4', ARCHIVO],
+    ['-c', '-l', '33', ARCHIVO],
+    ['-c', '-j', '2', '--mmap', '--histograma', '4', ARCHIVO],
+    ['-c', '--canonico', '-j', '2', ARCHIVO],
+    ['-c', '--adaptativo', '--canonico', ARCHIVO],
+    ['-c', '--diccionario', DICCIONARIO, '--canonico', ARCHIVO],
+    ['-c', '--canonico', '-'],
+    ['-c', '--stats', '-'],
+    ['-a', '--nivel', '4', ARCHIVO + '.huf', ARCHIVO],
+]
+
+""" Comprueba que huf.py rechaza las opciones de OPCIONES_INVALIDAS con un mensaje de error (y no con una traza) y sin
+    crear el archivo comprimido. """
+def probar_opciones_invalidas(directorio, ruta_diccionario):
+    ruta = os.path.join(directorio, 'invalido.txt')
+    shutil.copyfile(os.path.join(PRUEBAS, 'uno.txt'), ruta)
+    for argumentos in OPCIONES_INVALIDAS:
+        argumentos = [argumento.replace(ARCHIVO, ruta).replace(DICCIONARIO, ruta_diccionario)
+                      for argumento in argumentos]
+        estado, _, errores = ejecutar(argumentos)
+        correcto = estado != 0 and 'Traceback' not in errores and not os.path.exists(ruta + '.huf')
+        resultados.comprobar("rechaza %s" % ' '.join(argumentos).replace(directorio + os.sep, ''), correcto,
+                             ultima_linea(errores))
+
+""" Sustituye los bytes del archivo a partir de la posición indicada (negativa si es desde el final). """
+def sobrescribir(ruta, posicion, datos):
+    archivo = open(ruta, 'r+b')
+    if posicion < 0:
+        archivo.seek(posicion, 2)
+    else:
+        archivo.seek(posicion)
+    archivo.write(datos)
+    archivo.close()
+
+""" Comprueba que una descompresión que falla (sin el diccionario, con la suma de verificación de un archivo dañado,
+    con una longitud original imposible en la cabecera de --crc, en la de --canonico o en el directorio de los
+    bloques, o con bits que no corresponden a ningún código)
+    termina con un error, que es el de la causa del fallo, y deja intacto el archivo de salida que ya existía, sin
+    archivos temporales. """
+def probar_salida_conservada(directorio, ruta_diccionario):
+    carpeta = os.path.join(directorio, 'conservada')
+    os.mkdir(carpeta)
+    ruta = os.path.join(carpeta, 'quijote.txt')
+    quijote = leer(os.path.join(PRUEBAS, 'quijote.txt'))
+    casos = [('sin diccionario', quijote, ['--diccionario', ruta_diccionario], None, 'diccionario'),
+             ('crc dañado', quijote, ['--crc'], (-1, '\xff'), 'suma de verificación'),
+             ('longitud dañada', quijote, ['--crc'], (8, struct.pack('>Q', 1 << 50)), 'longitud'),
+             ('longitud canónica dañada', 'a' * 5000, ['--canonico'], (6, struct.pack('>Q', 1 << 50)), 'longitud'),
+             ('longitud de bloques dañada', 'a' * 5000, ['-j', '1'], (-28, struct.pack('>Q', 5001)), 'longitud'),
+             ('contenido dañado', 'a' * 5000, ['--crc'], (-1, '\xff'), 'dañado')]
+    for caso, datos, opciones_c, dano, mensaje in casos:
+        archivo = open(ruta, 'wb')
+        archivo.write(datos)
+        archivo.close()
+        ejecutar(['-c'] + opciones_c + [ruta])
+        if dano is not None:
+            sobrescribir(ruta + '.huf', dano[0], dano[1])
+        anterior = 'contenido anterior\n'
+        archivo = open(ruta, 'wb')
+        archivo.write(anterior)
+        archivo.close()
+        estado, _, errores = ejecutar(['-d', ruta + '.huf'])
+        correcto = estado != 0 and mensaje in ultima_linea(errores) and leer(ruta) == anterior and \
+                   sorted(os.listdir(carpeta)) == ['quijote.txt', 'quijote.txt.huf']
+        resultados.comprobar("salida conservada %s" % caso, correcto, ultima_linea(errores))
+
+""" Guarda los archivos en un contenedor (la mitad en un subdirectorio) y comprueba la extracción de todos los
+    miembros y de uno solo. """
+def probar_contenedor(archivos, directorio):
+    os.makedirs(os.path.join(directorio, 'contenedor', 'sub'))
+    miembros = []
+    for n, (nombre, ruta) in enumerate(archivos):
+        miembro = 'contenedor/' + nombre
+        if n % 2: miembro = 'contenedor/sub/' + nombre
+        shutil.copyfile(ruta, os.path.join(directorio, miembro))
+        miembros.append((miembro, leer(ruta)))
+
+    estado, _, errores = ejecutar(['-a', '-j', '2', '-b', '65536', 'contenedor.huf', 'contenedor'], None, directorio)
+    resultados.comprobar("contenedor -a", estado == 0, ultima_linea(errores))
+    estado, _, errores = ejecutar(['-x', '-j', '2', '--destino', 'extraidos', 'contenedor.huf'], None, directorio)
+    correcto = estado == 0
+    for miembro, datos in miembros:
+        ruta = os.path.join(directorio, 'extraidos', miembro)
+        correcto = correcto and os.path.exists(ruta) and leer(ruta) == datos
+    resultados.comprobar("contenedor -x", correcto, ultima_linea(errores))
+
+    miembro, datos = miembros[-1]
+    estado, _, errores = ejecutar(['-x', '--destino', 'uno', 'contenedor.huf', miembro], None, directorio)
+    ruta = os.path.join(directorio, 'uno', miembro)
+    resultados.comprobar("contenedor -x %s" % miembro, estado == 0 and os.path.exists(ruta) and leer(ruta) == datos,
+                         ultima_linea(errores))
+
+    # Un mismo archivo indicado dos veces tendría dos miembros con el mismo nombre
+    estado, _, errores = ejecutar(['-a', 'repetido.huf', 'contenedor', 'contenedor'], None, directorio)
+    resultados.comprobar("contenedor -a con nombres repetidos rechazado", estado != 0 and 'Traceback' not in errores
+                         and not os.path.exists(os.path.join(directorio, 'repetido.huf')), ultima_linea(errores))
+
+    # Un contenedor con dos miembros del mismo nombre (el segundo renombrado en el índice) no se extrae
+    for nombre in ('a1', 'a2'):
+        shutil.copyfile(os.path.join(PRUEBAS, 'uno.txt'), os.path.join(directorio, nombre))
+    ejecutar(['-a', 'renombrado.huf', 'a1', 'a2'], None, directorio)
+    ruta = os.path.join(directorio, 'renombrado.huf')
+    contenido = leer(ruta)
+    posicion = contenido.rfind('a2')
+    archivo = open(ruta, 'wb')
+    archivo.write(contenido[:posicion] + 'a1' + contenido[posicion + 2:])
+    archivo.close()
+    estado, _, errores = ejecutar(['-x', '--destino', 'renombrado', 'renombrado.huf'], None, directorio)
+    resultados.comprobar("contenedor -x con nombres repetidos rechazado", estado != 0 and 'Traceback' not in errores
+                         and not os.path.exists(os.path.join(directorio, 'renombrado')), ultima_linea(errores))
+
+""" Comprime y descomprime cada archivo por la entrada y la salida estándar (-c - y -d -), y comprueba que -d - rechaza
+    los datos que no están en el formato adaptativo. """
+def probar_flujo(archivos):
+    for nombre, ruta in archivos:
+        datos = leer(ruta)
+        estado, comprimido, errores = ejecutar(['-c', '-'], datos)
+        if estado == 0:
+            estado, salida, errores = ejecutar(['-d', '-'], comprimido)
+        resultados.comprobar("flujo %s" % nombre, estado == 0 and salida == datos, ultima_linea(errores))
+
+    # Lo que no está en el formato adaptativo se rechaza con un mensaje de error, sin traza
+    estado, _, errores = ejecutar(['-d', '-'], leer(os.path.join(PRUEBAS, 'uno.txt')))
+    resultados.comprobar("flujo no adaptativo rechazado", estado != 0 and errores.startswith('Error: ') and
+                         'Traceback' not in errores, ultima_linea(errores))
+
+""" Comprueba la interfaz en memoria con varias opciones, que su resultado coincide con el archivo .huf del modo
+    original y que comprimir_flujo_huffman escribe lo mismo que comprimir_datos. """
+def probar_memoria(archivos, directorio, diccionario):
+    opciones = [
+        ('original', {}),
+        ('canonico', {'canonico': True}),
+        ('limitado', {'long_max': 10}),
+        ('adaptativo', {'adaptativo': True}),
+        ('diccionario', {'diccionario': diccionario}),
+        ('crc', {'crc': True}),
+    ]
+    for nombre, ruta in archivos:
+        datos = leer(ruta)
+        for modo, argumentos in opciones:
+            comprimido = huf.comprimir_datos(datos, **argumentos)
+            correcto = huf.descomprimir_datos(comprimido, diccionario) == datos
+            flujo = StringIO()
+            huf.comprimir_flujo_huffman(StringIO(datos), flujo, **argumentos)
+            correcto = correcto and flujo.getvalue() == comprimido
+            if modo == 'original':
+                correcto = correcto and comprimido == leer(os.path.join(directorio, 'original', nombre + '.huf'))
+            resultados.comprobar("memoria %s %s" % (modo, nombre), correcto)
+
+""" Arranca el servicio de compresión y comprueba, con CLIENTES_SERVICIO clientes a la vez, que devuelve los datos
+    originales de los archivos de hasta TAM_MAX_SERVICIO bytes, tanto comprimiéndolos él mismo como descomprimiendo
+    los archivos comprimidos con una tabla por archivo y por bloques. Los clientes se atienden en hilos distintos del
+    mismo proceso, por lo que un error en los datos indica un estado compartido entre descompresiones. Un cliente que
+    no llega a conectarse no se cuenta, y hace fallar todos los casos. """
+def probar_servicio(archivos, directorio):
+    casos = []
+    for nombre, ruta in archivos:
+        if os.path.getsize(ruta) > TAM_MAX_SERVICIO:
+            continue
+        casos.append((nombre, leer(ruta), [leer(os.path.join(directorio, modo, nombre + '.huf'))
+                                           for modo in ('original', 'bloques_paralelo')]))
+    errores = {} # Casos fallidos de cada cliente
+
+    def cliente(n):
+        conexion = huf.ClienteHuffman(ruta_socket)
+        errores[n] = []
+        try:
+            for vuelta in range(VUELTAS_SERVICIO):
+                for nombre, datos, comprimidos in casos[n % len(casos):] + casos[:n % len(casos)]:
+                    try:
+                        correcto = conexion.descomprimir(conexion.comprimir(datos)) == datos
+                        for comprimido in comprimidos:
+                            correcto = correcto and conexion.descomprimir(comprimido) == datos
+                    except ValueError:
+                        correcto = False
+                    if not correcto:
+                        errores[n].append(nombre)
+        finally:
+            conexion.cerrar()
+
+    ruta_socket = os.path.join(directorio, 'huf.sock')
+    proceso = subprocess.Popen([sys.executable, HUF, '--servidor', ruta_socket, '-j', '2'])
+    try:
+        limite = time.time() + 10
+        while not os.path.exists(ruta_socket) and time.time() < limite:
+            time.sleep(0.05)
+        hilos = [threading.Thread(target=cliente, args=(n,)) for n in range(CLIENTES_SERVICIO)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        # Una petición mayor que PETICION_MAX se rechaza sin leer sus datos y se cierra la conexión
+        conexion = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conexion.connect(ruta_socket)
+        conexion.sendall(huf.PETICION_COMPRIMIR + huf.int_to_4bytes(huf.PETICION_MAX + 1))
+        entrada = conexion.makefile('rb')
+        cabecera = entrada.read(5)
+        mensaje = entrada.read(huf.bytes4_to_int(cabecera[1:]))
+        cerrada = entrada.read(1) == ''
+        entrada.close()
+        conexion.close()
+        resultados.comprobar("servicio petición mayor que el máximo",
+                             cabecera[0] == huf.RESPUESTA_ERROR and 'máximo' in mensaje and cerrada, mensaje)
+    finally:
+        os.kill(proceso.pid, signal.SIGINT)
+        proceso.wait()
+
+    for nombre, _, _ in casos:
+        fallidos = [n for n in errores if nombre in errores[n]]
+        resultados.comprobar("servicio %s" % nombre, len(errores) == CLIENTES_SERVICIO and not fallidos,
+                             "(clientes con datos incorrectos: %s)" % fallidos)
+
+
+if __name__ == "__main__":
+    uso = "python probar_formatos.py [--tam N] [--modos M1,M2,...] [--conservar DIR]"
+    parser = OptionParser(usage=uso)
+    parser.add_option('--tam', type='int', dest='tam', default=1 << 18, metavar='N',
+                      help='tamaño en bytes de los archivos del corpus sintético (por defecto 256 KiB)')
+    parser.add_option('--modos', dest='modos', default=None, metavar='M1,M2,...',
+                      help='modos de compresión que se prueban, entre %s (por defecto todos)' %
+                           ', '.join([modo for modo, _, _, _ in MODOS]))
+    parser.add_option('--conservar', dest='conservar', default=None, metavar='DIR',
+                      help='genera los archivos en DIR y no lo borra al terminar')
+    opciones, argumentos = parser.parse_args()
+
+    modos = MODOS
+    if opciones.modos is not None:
+        elegidos = opciones.modos.split(',')
+        modos = [modo for modo in MODOS if modo[0] in elegidos + ['original', 'bloques_paralelo']]
+    if argumentos or opciones.tam <= 0:
+        print("Uso: " + uso)
+        sys.exit()
+
+    directorio = opciones.conservar
+    if directorio is None:
+        directorio = tempfile.mkdtemp(prefix='huf_pruebas_')
+    elif not os.path.isdir(directorio):
+        os.makedirs(directorio)
+
+    try:
+        corpus = os.path.join(directorio, 'corpus')
+        os.mkdir(corpus)
+        archivos = [(nombre, os.path.join(PRUEBAS, nombre)) for nombre in ARCHIVOS_PRUEBA]
+        archivos += generar_corpus(corpus, 1, opciones.tam, 0, ['texto', 'binario', 'sesgado', 'uniforme', 'diminuto'])
+
+        ruta_diccionario = os.path.join(directorio, 'diccionario.hufd')
+        estado, _, errores = ejecutar(['-e', '-l', '15', '--diccionario', ruta_diccionario] +
+                                      [os.path.join(PRUEBAS, nombre) for nombre in ARCHIVOS_PRUEBA])
+        resultados.comprobar("diccionario -e", estado == 0, ultima_linea(errores))
+        diccionario = huf.DiccionarioHuffman.cargar(ruta_diccionario)
+
+        for modo, opciones_c, opciones_d, bloques in modos:
+            opciones_c = [opcion.replace(DICCIONARIO, ruta_diccionario) for opcion in opciones_c]
+            opciones_d = [opcion.replace(DICCIONARIO, ruta_diccionario) for opcion in opciones_d]
+            probar_modo(modo, opciones_c, opciones_d, bloques, archivos, directorio)
+        probar_codigos_largos()
+        probar_contenido_danado()
+        probar_opciones_invalidas(directorio, ruta_diccionario)
+        probar_salida_conservada(directorio, ruta_diccionario)
+        probar_contenedor(archivos, directorio)
+        probar_flujo(archivos)
+        probar_memoria(archivos, directorio, diccionario)
+        probar_servicio(archivos, directorio)
+    finally:
+        if opciones.conservar is None:
+            shutil.rmtree(directorio)
+
+    print("%d casos, %d errores" % (resultados.casos, len(resultados.errores)))
+    if resultados.errores:
+        sys.exit(1)